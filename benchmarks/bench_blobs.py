@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""Measures the cost of storing duplicate data files.
+
+The script stores the same image under a number of file records, as
+happens when a scan is imported again or cloned, in a database
+without and with a blob store. It reports the time to store the
+files and the disk space used by the data directory.
+
+Usage: python benchmarks/bench_blobs.py [files] [size in KB]
+"""
+import os
+import sys
+import shutil
+import tempfile
+import time
+from os.path import abspath, dirname, join
+
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+from romidata2.db import FarmDatabase
+
+
+def disk_usage(path):
+    inodes = {}
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            st = os.stat(join(root, name))
+            inodes[st.st_ino] = st.st_blocks * 512
+    return sum(inodes.values())
+
+
+def measure(name, basedir, count, data, blobs):
+    path = join(basedir, name)
+    db = FarmDatabase(path, blobs=blobs)
+    files = [db.new_file("farm", "scan", "scan%d" % (i // 10), "image%d" % i,
+                         "scans/%d/image%d.jpg" % (i // 10, i), "image/jpeg")
+             for i in range(count)]
+    start = time.perf_counter()
+    for f in files:
+        db.file_store_bytes(f, data)
+    elapsed = time.perf_counter() - start
+    print("%-10s %8.0f files/s %10.1f MB on disk"
+          % (name, count / elapsed, disk_usage(join(path, "data")) / 1e6))
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+    data = os.urandom(size * 1024)
+    basedir = tempfile.mkdtemp()
+    try:
+        measure("plain", basedir, count, data, False)
+        measure("blobs", basedir, count, data, True)
+    finally:
+        shutil.rmtree(basedir)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Measures the time to clone data objects.
+
+The script loads the prototypes of the examples and clones analyses,
+cameras, scan paths, and scans. It compares clone() with
+copy.deepcopy(), which walks all the references of the objects. The
+comparison uses detached prototypes, because copy.deepcopy() fails
+on objects that refer to a database. Then clone() is measured again
+with a factory that is attached to a database, as in an importer.
+
+Usage: python benchmarks/bench_clone.py [count] [objects]
+
+'count' is the number of clones, 'objects' the number of notes that
+are stored in the database.
+"""
+import sys
+import copy
+import shutil
+import tempfile
+import time
+from os.path import abspath, dirname, join
+
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+from romidata2.db import FarmDatabase
+from romidata2.impl import DefaultFactory
+from romidata2.protodb import Prototypes
+
+
+def new_database(basedir, count):
+    db = FarmDatabase(basedir)
+    factory = DefaultFactory(db)
+    for i in range(count):
+        factory.create("Note", {
+            "observation_unit": "", "author": "",
+            "date": "2020-08-26T12:00:00+02:00",
+            "type": "note", "text": "Note %d" % i }).store()
+    return db, factory
+
+
+def new_scan(factory, proto):
+    return factory.create("Scan", {
+        "observation_unit": "", "date": "2020-08-26T12:00:00+02:00",
+        "people": ["julie"], "camera": "", "scanning_device": "",
+        "factor_values": {"genotype": "WT"},
+        "scan_path": proto.get_scan_path("circular_36").serialize() })
+
+
+def prototypes(proto, factory):
+    return [("Analysis", proto.analyses[0]),
+            ("Camera", proto.cameras[0]),
+            ("ScanPath", proto.scan_paths[0]),
+            ("Scan", new_scan(factory, proto))]
+
+
+def measure(name, clone, obj, count, repeat=5):
+    elapsed = float("inf")
+    for r in range(repeat):
+        start = time.perf_counter()
+        for i in range(count):
+            clone(obj)
+        elapsed = min(elapsed, time.perf_counter() - start)
+    print("%-34s %10.0f clones/s" % (name, count / elapsed))
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    objects = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    basedir = tempfile.mkdtemp()
+    try:
+        protodir = join(dirname(abspath(__file__)), "..", "examples", "prototypes")
+        proto = Prototypes(protodir)
+        for name, obj in prototypes(proto, DefaultFactory(None)):
+            measure("copy.deepcopy(%s)" % name, copy.deepcopy, obj, count)
+            measure("%s.clone()" % name, lambda o: o.clone(), obj, count)
+        db, factory = new_database(join(basedir, "db"), objects)
+        proto = Prototypes(protodir, factory)
+        for name, obj in prototypes(proto, factory):
+            measure("%s.clone(), with database" % name, lambda o: o.clone(),
+                    obj, count)
+    finally:
+        shutil.rmtree(basedir)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Measures the number of objects per second that the factory creates.
+
+The script creates File, Note, Scan, and Analysis objects from their
+serialized properties, one by one with create() and in bulk with
+create_list(). Then it stores a number of notes in a database and
+measures the time to load the database, which creates every object
+through the factory, first with a single worker, then with a pool of
+worker threads.
+
+Usage: python benchmarks/bench_factory.py [count]
+"""
+import sys
+import json
+import shutil
+import tempfile
+import time
+from os.path import abspath, dirname, join
+
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+from romidata2.db import FarmDatabase
+from romidata2.impl import DefaultFactory, new_id
+
+
+def note_properties():
+    return { "id": new_id(), "observation_unit": new_id(), "author": new_id(),
+             "date": "2020-08-26T12:00:00+02:00", "type": "note",
+             "text": "Note" }
+
+
+def file_properties():
+    return { "id": new_id(), "owner": new_id(), "source_name": "scan",
+             "source_id": new_id(), "short_name": "image",
+             "date_created": "2020-08-26T12:00:00+02:00",
+             "path": "scan/image.jpg", "mimetype": "image/jpeg" }
+
+
+def scan_properties():
+    return { "id": new_id(), "observation_unit": new_id(),
+             "date": "2020-08-26T12:00:00+02:00", "people": [new_id()],
+             "camera": new_id(), "scanning_device": new_id(),
+             "factor_values": {"genotype": "WT"},
+             "scan_path": {"short_name": "circular_36", "type": "circular",
+                           "parameters": {"radius": 350, "nb_points": 36}} }
+
+
+def analysis_properties():
+    path = join(dirname(abspath(__file__)), "..", "examples", "prototypes",
+                "analyses", "plant_analysis.json")
+    with open(path) as f:
+        return json.load(f)
+
+
+def measure(name, create, count, repeat=5):
+    elapsed = float("inf")
+    for r in range(repeat):
+        start = time.perf_counter()
+        create()
+        elapsed = min(elapsed, time.perf_counter() - start)
+    print("%-32s %10.0f objects/s" % (name, count / elapsed))
+
+
+def new_crop(factory):
+    farm = factory.create("Farm", {
+        "short_name": "farm", "name": "Farm", "description": "",
+        "address": "", "country": "FR", "license": "" })
+    zone = factory.create("Zone", {"farm": farm.id, "short_name": "zone"})
+    zone.store()
+    farm.add_zone(zone)
+    crop = factory.create("ObservationUnit", {
+        "type": "crop", "short_name": "lettuce",
+        "context": farm.id, "zone": zone.id })
+    crop.zone = zone
+    farm.add_observation_unit(crop)
+    zone.add_observation_unit(crop)
+    crop.store()
+    farm.store()
+    return crop
+
+
+def measure_load(count):
+    basedir = tempfile.mkdtemp()
+    try:
+        path = join(basedir, "db")
+        factory = DefaultFactory(FarmDatabase(path))
+        crop = new_crop(factory)
+        for i in range(count):
+            properties = note_properties()
+            properties["observation_unit"] = crop.id
+            properties["author"] = ""
+            factory.create("Note", properties).store()
+        measure("FarmDatabase (Note)", lambda: FarmDatabase(path), count, 1)
+        measure("FarmDatabase (Note), 4 workers",
+                lambda: FarmDatabase(path, workers=4), count, 1)
+    finally:
+        shutil.rmtree(basedir)
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    factory = DefaultFactory(None)
+    for classname, properties in [("File", file_properties()),
+                                  ("Note", note_properties()),
+                                  ("Scan", scan_properties()),
+                                  ("Analysis", analysis_properties())]:
+        measure("create(%s)" % classname,
+                lambda: [factory.create(classname, properties)
+                         for i in range(count)], count)
+        array = [properties] * count
+        measure("create_list(%s)" % classname,
+                lambda: factory.create_list(classname, array), count)
+    measure_load(count)
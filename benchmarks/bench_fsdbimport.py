@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Measures the rate at which FSDB scans are imported.
+
+The script writes a FSDB directory with a number of scans, each with
+a number of images and a map, and imports the scans with a
+ScanImporter, first with a single worker thread, then with a pool of
+workers, and as a dry run.
+
+Usage: python benchmarks/bench_fsdbimport.py [scans] [images] [size in KB]
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+from os.path import abspath, dirname, join
+
+from PIL import Image
+
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+from romidata2.db import FarmDatabase
+from romidata2.impl import DefaultFactory
+from romidata2.protodb import Prototypes
+from romidata2.fsdbimport import ScanImporter
+from bench_factory import new_crop
+
+PROTOTYPES = join(dirname(abspath(__file__)), "..", "examples", "prototypes")
+
+
+def write_image(path, size):
+    # A valid JPEG header followed by padding, so that the size of the
+    # files does not depend on the encoder
+    Image.new("RGB", (640, 480)).save(path, "JPEG")
+    with open(path, "ab") as f:
+        f.write(os.urandom(size * 1024))
+
+
+def new_fsdb(path, scans, images, size):
+    for i in range(scans):
+        scan = join(path, "scan%d" % i)
+        os.makedirs(join(scan, "images"))
+        os.makedirs(join(scan, "maps"))
+        os.makedirs(join(scan, "metadata"))
+        files = []
+        for j in range(images):
+            files.append({"id": "rgb-%d" % j, "file": "rgb-%d.jpg" % j})
+            write_image(join(scan, "images", "rgb-%d.jpg" % j), size)
+        write_image(join(scan, "maps", "map.jpg"), size)
+        with open(join(scan, "files.json"), "w") as f:
+            json.dump({"filesets": [
+                {"id": "images", "files": files},
+                {"id": "maps", "files": [{"id": "map", "file": "map.jpg"}]}]}, f)
+        with open(join(scan, "metadata", "metadata.json"), "w") as f:
+            json.dump({"date": "20190416"}, f)
+
+
+def new_importer(path, **kwargs):
+    db = FarmDatabase(path)
+    factory = DefaultFactory(db)
+    proto = Prototypes(PROTOTYPES)
+    crop = new_crop(factory)
+    farm = crop.context
+    person = factory.create("Person", {
+        "short_name": "julie", "name": "Julie", "email": "",
+        "affiliation": "", "role": "" })
+    person.store()
+    farm.add_person(person)
+    for device in [proto.get_camera("picamera_v2"),
+                   proto.get_scanning_device("camera_rail")]:
+        device.owner = farm
+        db.store(device)
+    farm.add_camera(proto.get_camera("picamera_v2"))
+    farm.add_scanning_device(proto.get_scanning_device("camera_rail"))
+    return ScanImporter(db, factory, proto, farm, crop, ["julie"],
+                        "picamera_v2", "camera_rail", "linear_4m", **kwargs)
+
+
+if __name__ == "__main__":
+    scans = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    images = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    size = int(sys.argv[3]) if len(sys.argv) > 3 else 256
+    basedir = tempfile.mkdtemp()
+    try:
+        new_fsdb(join(basedir, "fsdb"), scans, images, size)
+        scan_ids = ["scan%d" % i for i in range(scans)]
+        for name, kwargs in [("1 worker", {"workers": 1}),
+                             ("8 workers", {"workers": 8}),
+                             ("dry run", {"workers": 8, "dry_run": True})]:
+            importer = new_importer(join(basedir, name), **kwargs)
+            print("%-10s %s" % (name, importer.import_scans(join(basedir, "fsdb"),
+                                                            scan_ids)))
+    finally:
+        shutil.rmtree(basedir)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""Measures the cost of importing local files into a database.
+
+The script writes a number of image files into a source directory, as
+found in a scan, and imports them into a database by reading them and
+storing their bytes, and with new_file_from_path(), which links the
+files when the source is on the same file system. It reports the
+import rate and the disk space added by the import.
+
+Usage: python benchmarks/bench_import.py [files] [size in KB]
+"""
+import os
+import sys
+import shutil
+import tempfile
+import time
+from os.path import abspath, dirname, join
+
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+from romidata2.db import FarmDatabase
+from bench_blobs import disk_usage
+
+
+def import_bytes(db, i, path):
+    f = db.new_file("farm", "scan", "scan", "image%d" % i,
+                    "scans/image%d.jpg" % i, "image/jpeg")
+    with open(path, "rb") as source:
+        db.file_store_bytes(f, source.read())
+
+
+def import_path(db, i, path):
+    db.new_file_from_path("farm", "scan", "scan", "image%d" % i,
+                          "scans/image%d.jpg" % i, "image/jpeg", path)
+
+
+def measure(name, basedir, paths, store):
+    path = join(basedir, name)
+    db = FarmDatabase(path)
+    usage = disk_usage(basedir)
+    start = time.perf_counter()
+    for i, source in enumerate(paths):
+        store(db, i, source)
+    elapsed = time.perf_counter() - start
+    print("%-10s %8.0f files/s %10.1f MB added on disk"
+          % (name, len(paths) / elapsed, (disk_usage(basedir) - usage) / 1e6))
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+    basedir = tempfile.mkdtemp()
+    try:
+        os.makedirs(join(basedir, "source"))
+        paths = []
+        for i in range(count):
+            paths.append(join(basedir, "source", "image%d.jpg" % i))
+            with open(paths[-1], "wb") as f:
+                f.write(os.urandom(size * 1024))
+        measure("bytes", basedir, paths, import_bytes)
+        measure("path", basedir, paths, import_path)
+    finally:
+        shutil.rmtree(basedir)
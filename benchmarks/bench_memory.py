@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Measures the memory used by the data objects of romidata2.
+
+The script creates a large number of File, Note, and Scan objects with
+realistic values (many files share the same owner, source, and
+mimetype) and reports the number of bytes allocated per object. It
+also measures the same file records stored in a FileTable, and the
+time to select the files of one scan in both representations.
+
+Usage: python benchmarks/bench_memory.py [count]
+"""
+import sys
+import gc
+import tracemalloc
+import time
+from os.path import abspath, dirname, join
+
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+from romidata2.impl import DefaultFactory, new_id
+from romidata2.filetable import FileTable
+
+
+def file_records(count):
+    owner = new_id()
+    for i in range(count):
+        if i % 100 == 0:
+            scan_id = new_id()
+        yield {
+            "id": new_id(),
+            "owner": str(owner),
+            "source_name": "scan",
+            "source_id": str(scan_id),
+            "short_name": "image-%03d" % (i % 100),
+            "date_created": "2020-08-26T12:00:00+02:00",
+            "path": "farm/crop/scans/20200826-120000-%s/image-%03d.jpg" % (scan_id, i % 100),
+            "mimetype": "image/jpeg" }
+
+
+def new_files(factory, count):
+    return [factory.create("File", record) for record in file_records(count)]
+
+
+def new_file_table(factory, count):
+    table = FileTable(capacity=count)
+    for record in file_records(count):
+        table.add(record)
+    return table
+
+
+def new_notes(factory, count):
+    return [factory.create("Note", {
+        "id": new_id(),
+        "observation_unit": new_id(),
+        "author": new_id(),
+        "date": "2020-08-26T12:00:00+02:00",
+        "type": "note",
+        "text": "Note %d" % i }) for i in range(count)]
+
+
+def new_scans(factory, count):
+    return [factory.create("Scan", {
+        "id": new_id(),
+        "observation_unit": new_id(),
+        "date": "2020-08-26T12:00:00+02:00",
+        "people": [],
+        "camera": new_id(),
+        "scanning_device": new_id(),
+        "factor_values": {},
+        "scan_path": {"short_name": "circular", "type": "circular",
+                      "parameters": {}} }) for i in range(count)]
+
+
+def measure(name, create, factory, count):
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    objects = create(factory, count)
+    gc.collect()
+    end = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("%-9s %8d objects %8.0f bytes/object" % (name, len(objects),
+                                                     (end - start) / len(objects)))
+    return objects
+
+
+def measure_select(name, select, repeat=20):
+    start = time.perf_counter()
+    for i in range(repeat):
+        r = select()
+    elapsed = (time.perf_counter() - start) / repeat
+    print("%-9s %8d matches %8.2f ms/select" % (name, len(r), 1000 * elapsed))
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    factory = DefaultFactory(None)
+    files = measure("File", new_files, factory, count)
+    table = measure("FileTable", new_file_table, factory, count)
+    measure("Note", new_notes, factory, count)
+    measure("Scan", new_scans, factory, count)
+    scan_id = files[len(files) // 2].source_id
+    measure_select("File", lambda: [f for f in files
+                                    if f.source_name == "scan"
+                                    and f.source_id == scan_id])
+    scan_id = table.select(None, None, None)[len(table) // 2].source_id
+    measure_select("FileTable", lambda: table.select("scan", scan_id, None))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Measures the startup time and the memory of a snapshot database.
+
+The script stores a single farm with a number of crops, each with its
+notes, in a database, and exports it into a snapshot. It then
+compares the time and the memory (Python allocations, measured with
+tracemalloc) needed to open the database and the snapshot, and to
+look up one crop with its notes, and reports the number of objects
+that the snapshot created for the lookup. It then looks up all the
+crops with their notes, with a snapshot that keeps a single lookup,
+and reports the memory once they are all looked up.
+
+Usage: python benchmarks/bench_snapshot.py [crops] [notes]
+"""
+import gc
+import sys
+import shutil
+import tempfile
+import time
+import tracemalloc
+from os.path import abspath, dirname, join
+
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+from romidata2.db import FarmDatabase
+from romidata2.impl import DefaultFactory
+from romidata2.snapshot import write_snapshot, FarmSnapshotDatabase
+from romidata2.instrument import counters
+from bench_factory import new_crop
+
+
+def new_database(path, count, notes):
+    db = FarmDatabase(path)
+    factory = DefaultFactory(db)
+    crop = new_crop(factory)
+    farm = crop.context
+    crops = [crop.id]
+    for i in range(1, count):
+        crop = factory.create("ObservationUnit", {
+            "type": "crop", "short_name": "crop%d" % i, "context": farm.id })
+        farm.add_observation_unit(crop)
+        crop.store()
+        crops.append(crop.id)
+    for crop_id in crops:
+        for j in range(notes):
+            factory.create("Note", {
+                "observation_unit": crop_id, "author": "",
+                "date": "2020-08-26T12:00:00+02:00",
+                "type": "note", "text": "Note %d" % j }).store()
+    return db, crops
+
+
+def measure(name, open_database, crop_ids):
+    tracemalloc.start()
+    start = time.perf_counter()
+    db = open_database()
+    opened = time.perf_counter() - start
+    created = counters.snapshot().get("snapshot.objects_created", 0)
+    crop = db.lookup(crop_ids[0])
+    notes = len(crop.notes)
+    looked_up = time.perf_counter() - start - opened
+    memory = tracemalloc.get_traced_memory()[0]
+    created = counters.snapshot().get("snapshot.objects_created", 0) - created
+    crop = None
+    for crop_id in crop_ids:
+        len(db.lookup(crop_id).notes)
+    # The dropped objects refer to each other: they are only freed by
+    # the garbage collector
+    gc.collect()
+    all_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("%-10s open %9.2f ms, lookup %8.2f ms (%d notes, %d objects created), "
+          "%8.1f MB, %8.1f MB after all the lookups"
+          % (name, opened * 1e3, looked_up * 1e3, notes, created,
+             memory / 1e6, all_memory / 1e6))
+
+
+if __name__ == "__main__":
+    crops = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    notes = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    basedir = tempfile.mkdtemp()
+    try:
+        path = join(basedir, "db")
+        db, crop_ids = new_database(path, crops, notes)
+        start = time.perf_counter()
+        write_snapshot(db, join(path, "snapshot.bin"))
+        print("write_snapshot %.0f ms" % ((time.perf_counter() - start) * 1e3))
+        measure("database", lambda: FarmDatabase(path), crop_ids)
+        measure("snapshot", lambda: FarmSnapshotDatabase(join(path, "snapshot.bin"),
+                                                         cache_size=1),
+                crop_ids)
+    finally:
+        shutil.rmtree(basedir)
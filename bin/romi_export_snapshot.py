@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+
+import sys
+from os.path import abspath, join
+
+import argparse
+
+sys.path.append(abspath('.'))
+from romidata2.db import FarmDatabase
+from romidata2.snapshot import write_snapshot
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a database into a read-only snapshot")
+    parser.add_argument("-d", "--db", required=True,
+                        help="The path of the database directory")
+    parser.add_argument("-o", "--output",
+                        help="The path of the snapshot (default: DB/snapshot.bin)")
+    parser.add_argument("--load-workers", type=int, default=1,
+                        help="The number of workers that read the database (default: 1)")
+    args = parser.parse_args()
+    db = FarmDatabase(args.db, workers=args.load_workers)
+    write_snapshot(db, args.output or join(args.db, "snapshot.bin"))
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import sys
+import os
 from os.path import abspath
 
 import argparse
@@ -8,7 +9,9 @@ import argparse
 sys.path.append(abspath('.'))
 from romidata2.webapp import FarmWebApp
 from romidata2.db import FarmDatabase
+from romidata2.snapshot import FarmSnapshotDatabase
 from romidata2.webcache import WebCache
+from romidata2 import instrument
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Start the REST server")
@@ -18,9 +21,63 @@ if __name__ == "__main__":
                         help="The path to the web cache directory")
     parser.add_argument("-t", "--type", required=True,
                         help="Either 'farms' or 'investigations'")
+    parser.add_argument("--memory-cache", type=int, default=0,
+                        help="The size of the in-memory image cache, in MB (default: disabled)")
+    parser.add_argument("-s", "--server", choices=["flask", "asgi"], default="flask",
+                        help="Use Flask's development server (default) or the asyncio-based ASGI server")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="The address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=5001,
+                        help="The port to listen on (default: 5001)")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="The number of worker processes of the ASGI server (default: 1). "
+                        "The change feed (/changes) is disabled with more than one")
+    parser.add_argument("--threads", type=int, default=16,
+                        help="The number of threads per ASGI worker (default: 16)")
+    parser.add_argument("--max-streams", type=int, default=64,
+                        help="The maximum number of change streams per ASGI worker (default: 64)")
+    parser.add_argument("--load-workers", type=int, default=1,
+                        help="The number of workers that read the database at startup (default: 1)")
+    parser.add_argument("--snapshot",
+                        help="Serve the read-only snapshot with the given path (see bin/romi_export_snapshot.py)")
+    parser.add_argument("--shared", action="store_true",
+                        help="Share the database with other processes through a change log")
+    parser.add_argument("--refresh-interval", type=float, default=0,
+                        help="Load the objects stored by other processes every N seconds (default: 0, disabled)")
+    parser.add_argument("--log-level", default="WARNING",
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="The level of the diagnostic messages (default: WARNING)")
     
     args = parser.parse_args()
-    db = FarmDatabase(args.db)
-    cache = WebCache(db, args.type, args.cache)
-    app = FarmWebApp(db, cache)
-    app.run(host='127.0.0.1', port=5001)
+    instrument.configure(args.log_level)
+    if args.server == "asgi":
+        import uvicorn
+        os.environ["ROMI_DB"] = abspath(args.db)
+        os.environ["ROMI_CACHE"] = abspath(args.cache)
+        os.environ["ROMI_TYPE"] = args.type
+        os.environ["ROMI_MEMORY_CACHE"] = str(args.memory_cache)
+        os.environ["ROMI_THREADS"] = str(args.threads)
+        os.environ["ROMI_MAX_STREAMS"] = str(args.max_streams)
+        os.environ["ROMI_WORKERS"] = str(args.workers)
+        os.environ["ROMI_LOG_LEVEL"] = args.log_level
+        os.environ["ROMI_LOAD_WORKERS"] = str(args.load_workers)
+        os.environ["ROMI_REFRESH_INTERVAL"] = str(args.refresh_interval)
+        os.environ["ROMI_SHARED"] = "1" if args.shared else "0"
+        if args.snapshot:
+            os.environ["ROMI_SNAPSHOT"] = abspath(args.snapshot)
+        uvicorn.run("romidata2.asgi:create_app", factory=True,
+                    host=args.host, port=args.port, workers=args.workers)
+    elif args.snapshot:
+        db = FarmSnapshotDatabase(args.snapshot, args.db)
+        cache = WebCache(db, args.type, args.cache,
+                         memory_size=args.memory_cache * 1024 * 1024)
+        FarmWebApp(db, cache).run(host=args.host, port=args.port, threaded=True)
+    else:
+        db = FarmDatabase(args.db, workers=args.load_workers,
+                          shared=args.shared)
+        cache = WebCache(db, args.type, args.cache,
+                         memory_size=args.memory_cache * 1024 * 1024)
+        app = FarmWebApp(db, cache)
+        if args.refresh_interval > 0:
+            db.start_watcher(args.refresh_interval)
+        app.run(host=args.host, port=args.port, threaded=True)
@@ -59,9 +59,7 @@ def create_chatelain_farm(db):
 
     relpath = db.farm_filepath(farm, "photo", "jpg")
     photo_file = db.new_file(farm.id, "farm", farm.id, "photo", relpath, "image/jpg")
-    with open("chatelain.jpg", "rb") as f:
-        data = f.read() 
-        db.file_store_bytes(photo_file, data)
+    db.file_store_path(photo_file, "chatelain.jpg")
     farm.photo = photo_file
     
     picamera = proto.get_camera("picamera_v2")
@@ -143,9 +141,7 @@ def create_valdaura_farm(db):
 
     relpath = db.farm_filepath(farm, "photo", "jpg")
     photo_file = db.new_file(farm.id, "farm", farm.id, "photo", relpath, "image/jpg")
-    with open("valdaura.jpg", "rb") as f:
-        data = f.read() 
-        db.file_store_bytes(photo_file, data)
+    db.file_store_path(photo_file, "valdaura.jpg")
     farm.photo = photo_file
     
     farm.store()
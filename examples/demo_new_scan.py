@@ -24,6 +24,6 @@ if __name__ == "__main__":
     # Scan the second plant
     plant = study.observation_units[1]
     newscan = study.clone_scan(scan)
-    newscan.observation_unit_id = plant.id
+    newscan.observation_unit = plant
     
     db.store(investigation)
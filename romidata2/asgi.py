@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""romidata2.asgi
+==============
+
+Provides an asyncio-based (ASGI) serving mode for the REST API. The
+AsgiApp class wraps a FarmWebApp, or any other WSGI application, and
+runs the handling of each request, as well as the iteration over the
+response body, in a pool of worker threads. The event loop therefore
+never blocks on a slow image resize or a large datastream read, and
+many clients can be served concurrently by a single process.
+
+The application can be served by any ASGI server. The create_app()
+function builds the application from environment variables so that it
+can be started in several worker processes, for example with
+uvicorn::
+
+    ROMI_DB=db ROMI_CACHE=cache uvicorn --factory romidata2.asgi:create_app --workers 4
+
+The following environment variables are recognized: ROMI_DB (the
+path of the database directory, required), ROMI_CACHE (the path of
+the web cache directory, required), ROMI_TYPE ('farms' or
+'investigations', default 'farms'), ROMI_MEMORY_CACHE (the size of
+the in-memory image cache, in MB, default 0), ROMI_THREADS (the
+number of worker threads per process, default 16), ROMI_MAX_STREAMS
+(the maximum number of change streams per process, default 64),
+ROMI_LOAD_WORKERS (the number of workers that read the database at
+startup, default 1), ROMI_REFRESH_INTERVAL (the interval, in seconds,
+at which the objects stored by other processes are loaded, default 0,
+disabled), ROMI_SHARED ('1' to share the database through a change
+log, see romidata2.changelog, default '0'), ROMI_SNAPSHOT (the path of
+a read-only snapshot to serve instead of the database, see
+romidata2.snapshot), and ROMI_LOG_LEVEL (the level of the diagnostic
+messages, for example 'INFO', default 'WARNING').
+
+The change streams (/changes/stream) are iterated by threads of their
+own, so that they never use up the threads of the other requests.
+When a client goes away, its stream is closed. The sequence numbers
+of the changes are counted by each process, so the change feed
+(/changes and /changes/stream) is disabled, and answers with a 503
+status, when ROMI_WORKERS (the number of worker processes of the
+server, default 1) is larger than 1.
+
+Examples
+--------
+>>> from romidata2.db import FarmDatabase
+>>> from romidata2.webcache import WebCache
+>>> from romidata2.webapp import FarmWebApp
+>>> from romidata2.asgi import AsgiApp
+>>> db = FarmDatabase("demo/db")
+>>> app = AsgiApp(FarmWebApp(db, WebCache(db, "farms", "/tmp/romicache")))
+
+"""
+import os
+import sys
+import asyncio
+import logging
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+__author__ = "Peter Hanappe"
+__copyright__ = "Copyright 2020, Sony Computer Science Laboratories"
+__credits__ = ["Peter Hanappe"]
+__license__ = "Affero General Public License"
+__version__ = "3"
+__maintainer__ = "Peter Hanappe"
+__email__ = "peter@hanappe.com"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+logger = logging.getLogger(__name__)
+
+
+class AsgiApp():
+    """Class that serves a WSGI application over ASGI.
+
+    Attributes
+    ----------
+    wsgi_app : callable
+        The WSGI application, usually a FarmWebApp.
+    threads : int
+        The number of worker threads used to run the WSGI application.
+    max_streams : int
+        The maximum number of event streams (text/event-stream
+        responses) served at once, each by its own thread. Further
+        streams are refused with a 503 status.
+
+    """
+    def __init__(self, wsgi_app, threads: int = 16, max_streams: int = 64):
+        self.__wsgi_app = wsgi_app
+        self.__executor = ThreadPoolExecutor(max_workers=threads,
+                                             thread_name_prefix="romi-asgi")
+        self.__max_streams = max_streams
+        self.__streams = 0
+        self.__stream_executor = ThreadPoolExecutor(max_workers=max_streams,
+                                                    thread_name_prefix="romi-asgi-stream")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.__lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.__http(scope, receive, send)
+        else:
+            raise ValueError("Unsupported ASGI scope type: %s" % scope["type"])
+
+    async def __lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.__executor.shutdown(wait=False)
+                self.__stream_executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def __read_body(self, receive):
+        body = BytesIO()
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+            body.write(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body.seek(0)
+        return body
+
+    def __environ(self, scope, body):
+        """Converts the ASGI connection scope into a WSGI environment."""
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+            "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": "HTTP/%s" % scope.get("http_version", "1.1"),
+            "REMOTE_ADDR": client[0],
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": body,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False
+        }
+        for name, value in scope.get("headers", []):
+            name = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if name == "CONTENT_TYPE" or name == "CONTENT_LENGTH":
+                key = name
+            else:
+                key = "HTTP_%s" % name
+            if key in environ:
+                value = "%s,%s" % (environ[key], value)
+            environ[key] = value
+        return environ
+
+    def __start(self, environ):
+        """Calls the WSGI application. This runs in a worker thread."""
+        response = {}
+        def start_response(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(name.lower().encode("latin-1"),
+                                    value.encode("latin-1"))
+                                   for name, value in headers]
+            return lambda data: None
+        iterable = self.__wsgi_app(environ, start_response)
+        return response, iterable, iter(iterable)
+
+    async def __wait_disconnect(self, receive):
+        """Returns when the client has gone away."""
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+
+    async def __next(self, loop, executor, iterator, disconnected):
+        """Returns the next chunk of the response body, None at its end,
+        or False when the client went away first. The pending call to
+        next() is still awaited in that case, so that the iterable can
+        be closed once its thread is free again."""
+        chunk = loop.run_in_executor(executor, next, iterator, None)
+        done, pending = await asyncio.wait({chunk, disconnected},
+                                           return_when=asyncio.FIRST_COMPLETED)
+        if chunk in done:
+            return chunk.result()
+        await asyncio.wait({chunk})
+        return False
+
+    def __is_stream(self, response) -> bool:
+        for name, value in response.get("headers", []):
+            if name == b"content-type":
+                return value.startswith(b"text/event-stream")
+        return False
+
+    async def __http(self, scope, receive, send):
+        body = await self.__read_body(receive)
+        if body == None:
+            return
+        environ = self.__environ(scope, body)
+        loop = asyncio.get_running_loop()
+        response, iterable, iterator = await loop.run_in_executor(self.__executor,
+                                                                  self.__start,
+                                                                  environ)
+        executor = self.__executor
+        streaming = self.__is_stream(response)
+        if streaming:
+            # Event streams last long, so they are iterated by their
+            # own threads and never hold the threads of the requests
+            if self.__streams >= self.__max_streams:
+                if hasattr(iterable, "close"):
+                    await loop.run_in_executor(self.__executor, iterable.close)
+                await self.__send_unavailable(send)
+                return
+            self.__streams += 1
+            executor = self.__stream_executor
+        disconnected = asyncio.ensure_future(self.__wait_disconnect(receive))
+        try:
+            # The first chunk is read before sending the headers
+            # because some WSGI applications only call
+            # start_response() when the body is first iterated.
+            chunk = await self.__next(loop, executor, iterator, disconnected)
+            if chunk is False:
+                return
+            await send({"type": "http.response.start",
+                        "status": response["status"],
+                        "headers": response["headers"]})
+            while chunk != None:
+                if chunk:
+                    await send({"type": "http.response.body",
+                                "body": chunk,
+                                "more_body": True})
+                chunk = await self.__next(loop, executor, iterator, disconnected)
+                if chunk is False:
+                    return
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            disconnected.cancel()
+            if streaming:
+                self.__streams -= 1
+            if hasattr(iterable, "close"):
+                await loop.run_in_executor(executor, iterable.close)
+
+    async def __send_unavailable(self, send):
+        await send({"type": "http.response.start", "status": 503,
+                    "headers": [(b"content-type", b"text/plain"),
+                                (b"retry-after", b"5")]})
+        await send({"type": "http.response.body",
+                    "body": b"Too many event streams"})
+
+
+def create_app() -> AsgiApp:
+    """Creates the ASGI application of the Farmer's Dashboard API using the
+    configuration found in the environment variables (see the module
+    documentation).
+
+    """
+    from romidata2.db import FarmDatabase
+    from romidata2.webcache import WebCache
+    from romidata2.webapp import FarmWebApp
+    from romidata2 import instrument
+    instrument.configure(os.environ.get("ROMI_LOG_LEVEL", "WARNING"))
+    if os.environ.get("ROMI_SNAPSHOT"):
+        from romidata2.snapshot import FarmSnapshotDatabase
+        db = FarmSnapshotDatabase(os.environ["ROMI_SNAPSHOT"], os.environ["ROMI_DB"])
+    else:
+        db = FarmDatabase(os.environ["ROMI_DB"],
+                          workers=int(os.environ.get("ROMI_LOAD_WORKERS", "1")),
+                          shared=os.environ.get("ROMI_SHARED", "0") == "1")
+    memory_size = int(os.environ.get("ROMI_MEMORY_CACHE", "0")) * 1024 * 1024
+    cache = WebCache(db, os.environ.get("ROMI_TYPE", "farms"),
+                     os.environ["ROMI_CACHE"], memory_size=memory_size)
+    threads = int(os.environ.get("ROMI_THREADS", "16"))
+    max_streams = int(os.environ.get("ROMI_MAX_STREAMS", "64"))
+    change_feed = int(os.environ.get("ROMI_WORKERS", "1")) <= 1
+    if not change_feed:
+        logger.warning("The change feed is disabled: it needs a single worker process")
+    app = AsgiApp(FarmWebApp(db, cache, change_feed=change_feed), threads, max_streams)
+    interval = float(os.environ.get("ROMI_REFRESH_INTERVAL", "0"))
+    if interval > 0 and hasattr(db, "start_watcher"):
+        db.start_watcher(interval)
+    return app
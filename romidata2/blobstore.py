@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""romidata2.blobstore
+===================
+
+Provides a content-addressed store for the contents of the data
+files. Each distinct content is stored once, as a blob named after
+its SHA-256 hash, in the 'blobs' subdirectory of the data directory:
+
+    data/blobs/3a/3a7bd3e2360a3d29eea436fcfb7e44c735d117c42d1c1835420b6b9942dd4f1b
+
+The data file itself (data/<path>) is a hard link to the blob. The
+readers of the data files are therefore not affected, storing a
+content that is already known costs no disk space, and the number of
+files that use a blob is given by its link count. Blobs are made
+read-only, so that a data file can only be changed by replacing it,
+never by writing into it, which would change all its copies.
+
+The hash of a content is computed while it is stored, also when it
+is read from a stream. verify() hashes the blobs again to detect
+corrupted files, and collect_garbage() removes the blobs that are no
+longer used by any data file.
+
+Every database opened on a directory that contains a blob store uses
+it. The blob store is created by opening a database with blobs=True.
+When the file system does not support hard links, the blobs are
+copied instead.
+
+Examples
+--------
+>>> from romidata2.db import FarmDatabase
+>>> db = FarmDatabase("demo/db", blobs=True)
+>>> db.blobs.verify()
+[]
+
+"""
+from typing import List
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+
+from romidata2.instrument import count
+from romidata2.io import ingest_file
+
+__author__ = "Peter Hanappe"
+__copyright__ = "Copyright 2020, Sony Computer Science Laboratories"
+__credits__ = ["Peter Hanappe"]
+__license__ = "Affero General Public License"
+__version__ = "3"
+__maintainer__ = "Peter Hanappe"
+__email__ = "peter@hanappe.com"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+logger = logging.getLogger(__name__)
+
+BLOBS_DIR = "blobs"
+
+# The size of the chunks in which streams are hashed and copied
+CHUNK_SIZE = 1024 * 1024
+
+
+class BlobStore():
+    """Class implementing a store of blobs addressed by their SHA-256
+    hash.
+
+    Attributes
+    ----------
+    directory : str
+        The data directory of the database. The blobs are stored in
+        its 'blobs' subdirectory.
+    create : bool
+        Create the blob store if it does not exist yet.
+
+    """
+    def __init__(self, directory: str, create: bool = False):
+        self.__directory = os.path.join(directory, BLOBS_DIR)
+        if create:
+            os.makedirs(self.__directory, exist_ok=True)
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        """Returns whether the data directory has a blob store."""
+        return os.path.isdir(os.path.join(directory, BLOBS_DIR))
+
+    def path(self, digest: str) -> str:
+        """Returns the path of the blob with the given hash."""
+        return os.path.join(self.__directory, digest[:2], digest)
+
+    def __tmpfile(self):
+        return tempfile.NamedTemporaryFile(dir=self.__directory, suffix=".tmp",
+                                           delete=False)
+
+    def __add(self, tmppath: str, digest: str) -> None:
+        """Moves a temporary file into the store, unless a blob with the
+        same hash exists already."""
+        path = self.path(digest)
+        if os.path.exists(path):
+            os.remove(tmppath)
+            count("blobs.deduplicated")
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.chmod(tmppath, 0o444)
+        os.replace(tmppath, path)
+        count("blobs.stored")
+
+    def put_bytes(self, data: bytes) -> str:
+        """Stores the data, if it is not stored yet, and returns its
+        hash. Known data is not written again."""
+        digest = hashlib.sha256(data).hexdigest()
+        if os.path.exists(self.path(digest)):
+            count("blobs.deduplicated")
+            return digest
+        with self.__tmpfile() as f:
+            f.write(data)
+        self.__add(f.name, digest)
+        return digest
+
+    def put_stream(self, stream) -> str:
+        """Stores the data read from a binary stream, hashing it while it
+        is copied, and returns its hash."""
+        h = hashlib.sha256()
+        f = self.__tmpfile()
+        try:
+            with f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    h.update(chunk)
+                    f.write(chunk)
+        except BaseException:
+            os.remove(f.name)
+            raise
+        digest = h.hexdigest()
+        self.__add(f.name, digest)
+        return digest
+
+    def put_file(self, path: str, move: bool = False) -> str:
+        """Stores the contents of a local file and returns its hash. The
+        file is moved into the store when move is set, and copied
+        otherwise (see romidata2.io.copy_file). It is never hard linked,
+        because the blobs are made read-only, and because the source
+        could be changed afterwards."""
+        digest = self.hash_file(path)
+        if os.path.exists(self.path(digest)):
+            count("blobs.deduplicated")
+            if move:
+                os.remove(path)
+            return digest
+        with self.__tmpfile() as f:
+            pass
+        try:
+            ingest_file(path, f.name, move=move, link=False)
+        except BaseException:
+            if os.path.exists(f.name):
+                os.remove(f.name)
+            raise
+        self.__add(f.name, digest)
+        return digest
+
+    def link(self, digest: str, path: str) -> None:
+        """Makes the file with the given path a link to the blob,
+        replacing the file if it exists."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmppath = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            os.link(self.path(digest), tmppath)
+        except OSError as e:
+            logger.debug("Cannot link %s (%s), copying it", path, e)
+            shutil.copyfile(self.path(digest), tmppath)
+        os.replace(tmppath, path)
+
+    def refcount(self, digest: str) -> int:
+        """Returns the number of data files that use the blob."""
+        return os.stat(self.path(digest)).st_nlink - 1
+
+    def digests(self) -> List[str]:
+        """Returns the hashes of all the blobs."""
+        r = []
+        for prefix in sorted(os.listdir(self.__directory)):
+            subdir = os.path.join(self.__directory, prefix)
+            if os.path.isdir(subdir):
+                r.extend(sorted(os.listdir(subdir)))
+        return r
+
+    def hash_file(self, path: str) -> str:
+        """Returns the SHA-256 hash of a file, read in chunks."""
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                h.update(chunk)
+        return h.hexdigest()
+
+    def verify(self, digests: List[str] = None) -> List[str]:
+        """Hashes the blobs again, all of them by default, and returns the
+        hashes of the blobs whose contents do not match."""
+        if digests == None:
+            digests = self.digests()
+        return [digest for digest in digests
+                if self.hash_file(self.path(digest)) != digest]
+
+    def collect_garbage(self) -> int:
+        """Removes the blobs that are not used by any data file, and
+        returns their number. It must not run while files are stored."""
+        n = 0
+        for digest in self.digests():
+            if self.refcount(digest) == 0:
+                os.remove(self.path(digest))
+                n += 1
+        return n
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""romidata2.changefeed
+====================
+
+Provides a feed of the changes made to the database. The ChangeFeed
+registers itself as a listener of the database and records each
+stored object or file in a ring buffer, together with a sequence
+number that increases monotonically. Clients remember the sequence
+number of the last change they have seen and ask for the changes that
+followed it. They can wait for new changes instead of polling.
+
+Only the most recent changes are kept. A client that asks for changes
+that have already been dropped from the buffer is told to reset, that
+is, to reload the objects it is interested in.
+
+The sequence numbers are counted by each process. A sequence number
+issued by one process means nothing to another, so the feed can only
+be served by a single process: the REST API disables it when it runs
+with several worker processes (see romidata2.asgi).
+
+Examples
+--------
+>>> from romidata2.db import FarmDatabase
+>>> from romidata2.changefeed import ChangeFeed
+>>> db = FarmDatabase("demo/db")
+>>> feed = ChangeFeed(db)
+>>> changes, last, reset = feed.changes(0, timeout=10)
+
+"""
+from typing import List, Tuple
+import threading
+import time
+from collections import deque
+from itertools import islice
+
+from romidata2.datamodel import IDatabase
+
+__author__ = "Peter Hanappe"
+__copyright__ = "Copyright 2020, Sony Computer Science Laboratories"
+__credits__ = ["Peter Hanappe"]
+__license__ = "Affero General Public License"
+__version__ = "3"
+__maintainer__ = "Peter Hanappe"
+__email__ = "peter@hanappe.com"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+
+class ChangeFeed():
+    """Class implementing a ring buffer of the changes made to a database.
+
+    Each change is a dictionary with the following fields: 'seq' (the
+    sequence number), 'action' ('created' or 'updated'), 'classname',
+    'id', and 'related' (the IDs the object refers to, see
+    IDatabase.add_listener()).
+
+    Attributes
+    ----------
+    db : IDatabase
+        The database whose changes are recorded.
+    max_changes : int
+        The number of changes that are kept in the buffer, at least 1.
+
+    """
+    def __init__(self, db: IDatabase, max_changes: int = 10000):
+        if max_changes < 1:
+            raise ValueError("The change feed must keep at least one change: %d"
+                             % max_changes)
+        self.__changes = deque(maxlen=max_changes)
+        self.__last = 0
+        self.__condition = threading.Condition()
+        db.add_listener(self.database_changed)
+
+    @property
+    def last(self) -> int:
+        """The sequence number of the most recent change, or 0 if there
+        were no changes yet."""
+        return self.__last
+
+    def database_changed(self, action: str, classname: str, obj_id: str,
+                         related_ids: List[str]) -> None:
+        """The listener that is registered with the database."""
+        with self.__condition:
+            self.__last += 1
+            self.__changes.append({
+                "seq": self.__last,
+                "action": action,
+                "classname": classname,
+                "id": obj_id,
+                "related": list(related_ids)
+            })
+            self.__condition.notify_all()
+
+    def changes(self, since: int, timeout: float = 0,
+                ids: List[str] = None) -> Tuple[List[dict], int, bool]:
+        """Returns the changes that followed the change with sequence number
+        'since'.
+
+        Parameters
+        ----------
+        since: int
+            The sequence number of the last change seen by the client.
+        timeout: float
+            If there are no new changes, wait at most this number of
+            seconds for one.
+        ids: List[str]
+            If not None, only return the changes of the objects with
+            these IDs, or of the objects that refer to them.
+
+        Returns
+        -------
+        A tuple (changes, last, reset). The 'changes' list may be empty
+        if the timeout expired. 'last' is the sequence number to pass
+        as 'since' in the next call. 'reset' is True when some of the
+        changes that followed 'since' were dropped from the buffer, or
+        when 'since' is larger than any known sequence number (for
+        example, after a restart of the server).
+
+        """
+        deadline = time.monotonic() + timeout
+        if ids != None:
+            ids = set(ids)
+        while True:
+            r, last, reset = self.__wait(since, deadline)
+            if ids != None:
+                r = [change for change in r
+                     if change["id"] in ids or not ids.isdisjoint(change["related"])]
+            if len(r) > 0 or reset or time.monotonic() >= deadline:
+                return r, last, reset
+            # Only unrelated changes: keep waiting
+            since = last
+
+    def __wait(self, since: int, deadline: float) -> Tuple[List[dict], int, bool]:
+        with self.__condition:
+            while True:
+                if since > self.__last:
+                    return [], self.__last, True
+                if since < self.__last:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return [], self.__last, False
+                self.__condition.wait(remaining)
+            first = self.__changes[0]["seq"]
+            reset = since < first - 1
+            start = max(since - first + 1, 0)
+            return list(islice(self.__changes, start, None)), self.__last, reset
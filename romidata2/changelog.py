@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""romidata2.changelog
+===================
+
+Provides the coordination of several processes that share a database
+directory, for example the worker processes of the REST API (the
+readers) and an import script (the writer).
+
+The writer takes an exclusive lock on the file 'writer.lock' while it
+stores an object or a file record. The JSON file is written under a
+temporary name and renamed, so the readers never see a partial file.
+Then the path of the file is appended, as a single line, to the log
+'changes.log'. When the contents of a data file change, the path of
+its file record is appended, so that the readers reload the record
+and invalidate the responses that depend on it. The readers remember how far they have read in the log
+and, when they refresh, only load the files that were appended since.
+They never take the lock.
+
+Every database opened on a directory that contains a change log
+writes to it. The log is created by opening a database with
+shared=True. It only grows: it can be removed, or truncated, when no
+process uses the database. A reader that finds the log shorter than
+expected falls back to scanning the whole directory.
+
+The locks use fcntl and are only available on POSIX systems.
+
+Examples
+--------
+>>> from romidata2.db import FarmDatabase
+>>> db = FarmDatabase("demo/db", shared=True)
+>>> db.refresh()
+
+"""
+from typing import List
+import os
+import json
+import threading
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__author__ = "Peter Hanappe"
+__copyright__ = "Copyright 2020, Sony Computer Science Laboratories"
+__credits__ = ["Peter Hanappe"]
+__license__ = "Affero General Public License"
+__version__ = "3"
+__maintainer__ = "Peter Hanappe"
+__email__ = "peter@hanappe.com"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+
+LOG_FILE = "changes.log"
+LOCK_FILE = "writer.lock"
+
+
+class ChangeLog():
+    """Class implementing the change log and the writer lock of a shared
+    database directory.
+
+    Attributes
+    ----------
+    directory : str
+        The path of the database directory.
+    create : bool
+        Create the log if it does not exist yet.
+
+    """
+    def __init__(self, directory: str, create: bool = False):
+        if fcntl == None:
+            raise RuntimeError("Shared databases need fcntl (POSIX only)")
+        self.__path = os.path.join(directory, LOG_FILE)
+        self.__lockpath = os.path.join(directory, LOCK_FILE)
+        if create:
+            open(self.__path, "ab").close()
+        # The entries written by this log are skipped by read()
+        self.__token = uuid.uuid4().hex
+        self.__lock = threading.Lock()
+        self.__offset = os.path.getsize(self.__path)
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        """Returns whether the directory is shared, that is, whether it
+        contains a change log."""
+        return os.path.exists(os.path.join(directory, LOG_FILE))
+
+    @contextmanager
+    def writer(self):
+        """Returns a context manager that holds the writer lock. The lock
+        is exclusive across processes and across the threads of this
+        process."""
+        with self.__lock:
+            with open(self.__lockpath, "a") as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def append(self, relpaths: List[str]) -> None:
+        """Appends the paths of the files that were written. Must be
+        called while holding the writer lock."""
+        lines = "".join(json.dumps({"writer": self.__token, "path": relpath}) + "\n"
+                        for relpath in relpaths)
+        with open(self.__path, "a") as f:
+            f.write(lines)
+
+    def read(self) -> List[str]:
+        """Returns the paths of the files written by the other processes
+        since the last call, without duplicates and in the order of
+        their last change. Returns None if the log was truncated, in
+        which case the caller must look for changes by other means.
+        """
+        with open(self.__path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < self.__offset:
+                self.__offset = size
+                return None
+            f.seek(self.__offset)
+            data = f.read(size - self.__offset)
+        # A line that is still being appended is read the next time
+        end = data.rfind(b"\n") + 1
+        self.__offset += end
+        paths = {}
+        for line in data[:end].splitlines():
+            entry = json.loads(line)
+            if entry["writer"] != self.__token:
+                paths.pop(entry["path"], None)
+                paths[entry["path"]] = True
+        return list(paths)
@@ -9,7 +9,7 @@ this package.
 
 """
 from abc import ABC, abstractmethod
-from typing import List, Any
+from typing import List, Any, Iterator
 import copy
 import functools
 from datetime import datetime
@@ -56,6 +56,39 @@ class IFactory(ABC):
         as a list.
         """ 
         pass
+
+
+class IResolver(ABC):
+    """IResolver is the interface used by restore() to resolve the IDs
+    that an object refers to, once all the objects have been loaded.
+
+    Each method takes the object whose references are resolved and the
+    name of the field that holds the reference, so that the resolver
+    can report the references to objects or files that do not exist.
+    Empty IDs are not references and resolve to None.
+
+    """
+    @abstractmethod
+    def lookup(self, obj: Any, field: str, obj_id: str) -> Any:
+        """Returns the object with the given ID, or None."""
+        pass
+
+    @abstractmethod
+    def lookup_list(self, obj: Any, field: str, obj_ids: List[str]) -> List[Any]:
+        """Returns the objects with the given IDs, skipping the missing ones."""
+        pass
+
+    @abstractmethod
+    def get_file(self, obj: Any, field: str, file_id: str) -> Any:
+        """Returns the file with the given ID, or None."""
+        pass
+
+    @abstractmethod
+    def select_files(self, source_name: str, source_id: str,
+                     short_name: str) -> List[Any]:
+        """Returns the files that match the given values. See
+        IDatabase.select_files()."""
+        pass
     
 
 class IPrototypes(ABC):
@@ -113,7 +146,12 @@ class BaseClass(ABC):
     serialize, and parse methods that have to be implemented by all
     subclasses.
 
+    The interfaces declare empty __slots__ so that the implementations
+    can store their attributes in slots, without a per-instance
+    dictionary.
+
     """
+    __slots__ = ()
 
     @property
     @abstractmethod
@@ -154,7 +192,11 @@ class BaseClass(ABC):
         pass
 
     @abstractmethod
-    def restore(self) -> None:
+    def restore(self, resolver: IResolver = None) -> None:
+        """Links the object to the objects and files it refers to, after it
+        was loaded. If no resolver is given, the references are
+        looked up in the database of the object.
+        """
         pass
 
     @abstractmethod
@@ -168,6 +210,7 @@ class BaseClass(ABC):
 
         
 class IFile(BaseClass):
+    __slots__ = ()
 
     @property
     @abstractmethod
@@ -237,6 +280,7 @@ class IFile(BaseClass):
 
 
 class IPerson(BaseClass):
+    __slots__ = ()
 
     @property
     @abstractmethod
@@ -300,6 +344,7 @@ class IPerson(BaseClass):
 
     
 class IParameters(BaseClass):
+    __slots__ = ()
     
     @abstractmethod
     def get_value(self, key: str) -> Any:
@@ -316,6 +361,7 @@ class IParameters(BaseClass):
 
 
 class ISoftwareModule(BaseClass):
+    __slots__ = ()
 
     @property
     @abstractmethod
@@ -359,6 +405,7 @@ class ISoftwareModule(BaseClass):
     
 
 class ICamera(BaseClass):
+    __slots__ = ()
         
     @property
     @abstractmethod
@@ -432,6 +479,7 @@ class ICamera(BaseClass):
 
     
 class IScanningDevice(BaseClass):
+    __slots__ = ()
     
     @property
     @abstractmethod
@@ -495,6 +543,7 @@ class IScanningDevice(BaseClass):
 
         
 class IScanPath(BaseClass):
+    __slots__ = ()
         
     @property
     @abstractmethod
@@ -528,6 +577,7 @@ class IScanPath(BaseClass):
 
     
 class ISample(BaseClass):
+    __slots__ = ()
         
     @property
     @abstractmethod
@@ -581,6 +631,7 @@ class ISample(BaseClass):
 
 
 class IPose(BaseClass):
+    __slots__ = ()
 
     @property
     def dummy(self) -> None:
@@ -588,6 +639,7 @@ class IPose(BaseClass):
 
 
 class IUnit(BaseClass):
+    __slots__ = ()
 
     @property
     @abstractmethod
@@ -601,6 +653,7 @@ class IUnit(BaseClass):
 
 
 class IObservable(BaseClass):
+    __slots__ = ()
 
     @property
     @abstractmethod
@@ -614,6 +667,7 @@ class IObservable(BaseClass):
 
     
 class IDataStream(BaseClass):
+    __slots__ = ()
 
     @property
     @abstractmethod
@@ -656,6 +710,7 @@ class IDataStream(BaseClass):
 
 
 class INote(BaseClass):
+    __slots__ = ()
 
     @property
     @abstractmethod
@@ -694,6 +749,7 @@ class INote(BaseClass):
 
 
 class ITask(BaseClass):
+    __slots__ = ()
     STATE_DEFINED = "Defined"
     STATE_RUNNING = "Running"
     STATE_FINISHED = "Finished"
@@ -785,6 +841,7 @@ class ITask(BaseClass):
     
 
 class IObservedVariable(BaseClass):
+    __slots__ = ()
         
     @property
     @abstractmethod
@@ -838,6 +895,7 @@ class IObservedVariable(BaseClass):
 
 
 class IBiologicalMaterial(BaseClass):
+    __slots__ = ()
 
     @property
     @abstractmethod
@@ -921,6 +979,7 @@ class IBiologicalMaterial(BaseClass):
         
 
 class IBoundingBox(BaseClass):
+    __slots__ = ()
 
     @property
     def x(self) -> List[float]:
@@ -951,6 +1010,7 @@ class IBoundingBox(BaseClass):
     
     
 class IScan(BaseClass):
+    __slots__ = ()
         
     @property
     @abstractmethod
@@ -1058,6 +1118,7 @@ class IScan(BaseClass):
 
     
 class IAnalysis(BaseClass):
+    __slots__ = ()
     STATE_DEFINED = "Defined"
     STATE_RUNNING = "Running"
     STATE_FINISHED = "Finished"
@@ -1162,6 +1223,7 @@ class IAnalysis(BaseClass):
 
     
 class IObservationUnit(BaseClass):
+    __slots__ = ()
         
     @property
     @abstractmethod
@@ -1262,6 +1324,15 @@ class IObservationUnit(BaseClass):
     @abstractmethod
     def add_child(self, value: Any) -> None:
         pass
+
+    @abstractmethod
+    def iter_children(self, after: str = None, limit: int = None) -> Iterator[Any]:
+        """Iterates over the children, starting after the one with the ID
+        'after', or at the first one if 'after' is None, and yielding
+        at most 'limit' elements. Raises a ValueError if there is no
+        element with the ID 'after'.
+        """
+        pass
     
     @property
     @abstractmethod
@@ -1271,6 +1342,11 @@ class IObservationUnit(BaseClass):
     @abstractmethod
     def add_datastream(self, datastream: IDataStream) -> None:
         pass
+
+    @abstractmethod
+    def iter_datastreams(self, after: str = None, limit: int = None) -> Iterator[IDataStream]:
+        """Iterates over a page of the datastreams. See iter_children()."""
+        pass
         
     @property
     @abstractmethod
@@ -1280,6 +1356,11 @@ class IObservationUnit(BaseClass):
     @abstractmethod
     def add_scan(self, scan: Any) -> None:
         pass
+
+    @abstractmethod
+    def iter_scans(self, after: str = None, limit: int = None) -> Iterator[Any]:
+        """Iterates over a page of the scans. See iter_children()."""
+        pass
     
     @property
     @abstractmethod
@@ -1289,6 +1370,11 @@ class IObservationUnit(BaseClass):
     @abstractmethod
     def add_analysis(self, analysis: IAnalysis) -> None:
         pass
+
+    @abstractmethod
+    def iter_analyses(self, after: str = None, limit: int = None) -> Iterator[IAnalysis]:
+        """Iterates over a page of the analyses. See iter_children()."""
+        pass
     
     @property
     @abstractmethod
@@ -1299,9 +1385,15 @@ class IObservationUnit(BaseClass):
     def add_note(self, note: INote) -> None:
         pass
 
+    @abstractmethod
+    def iter_notes(self, after: str = None, limit: int = None) -> Iterator[INote]:
+        """Iterates over a page of the notes. See iter_children()."""
+        pass
+
     
     
 class IExperimentalFactor(BaseClass):
+    __slots__ = ()
     
     @property
     @abstractmethod
@@ -1335,6 +1427,7 @@ class IExperimentalFactor(BaseClass):
 
     
 class IStudy(BaseClass):
+    __slots__ = ()
 
     @property
     @abstractmethod
@@ -1462,6 +1555,7 @@ class IStudy(BaseClass):
 
         
 class IZone(BaseClass):
+    __slots__ = ()
 
     @property
     @abstractmethod
@@ -1498,6 +1592,7 @@ class IZone(BaseClass):
 
         
 class IFarm(BaseClass):
+    __slots__ = ()
         
     @property
     @abstractmethod
@@ -1641,6 +1736,7 @@ class IFarm(BaseClass):
     
 
 class IInvestigation(BaseClass):
+    __slots__ = ()
         
     @property
     @abstractmethod
@@ -1741,6 +1837,24 @@ class IDatabase(ABC):
     @abstractmethod
     def lookup(self, obj_id: str) -> BaseClass:
         pass
+
+    @abstractmethod
+    def lookup_many(self, obj_ids: List[str]) -> List[BaseClass]:
+        """Looks up several objects at once. Returns a list in the same
+        order as the IDs, with None for the IDs that were not found.
+        """
+        pass
+    
+    @abstractmethod
+    def add_listener(self, listener) -> None:
+        """Registers a function that is called each time an object or a file
+        is stored. The listener is called as listener(action,
+        classname, obj_id, related_ids), where action is either
+        'created' or 'updated', and related_ids is the list of the IDs
+        referenced by the stored object (its observation unit, scan,
+        owner, ...).
+        """
+        pass
     
     @abstractmethod
     def select(self, classname: str, prop: str, value: str) -> List[BaseClass]:
@@ -1755,6 +1869,16 @@ class IDatabase(ABC):
                  short_name: str, relpath: str, mimetype: str) -> IFile:
         pass
 
+    @abstractmethod
+    def new_file_from_path(self, owner_id, source_name: str, source_id: str,
+                           short_name: str, relpath: str, mimetype: str,
+                           path: str, move: bool = False) -> IFile:
+        """Creates a new file with the contents of a local file, which is
+        moved (move=True), hard linked or copied into the database,
+        whichever is possible first. A hard linked source must not be
+        changed afterwards."""
+        pass
+
     @abstractmethod
     def get_file(self, file_id: str) -> IFile:
         pass
@@ -1783,4 +1907,29 @@ class IDatabase(ABC):
     @abstractmethod
     def file_read_bytes(self, f: IFile) -> bytes:
         pass
+
+    @abstractmethod
+    def file_open(self, f: IFile, mode: str = "rb") -> Any:
+        """Opens the contents of the file for reading, in binary ('rb')
+        or text ('r') mode, and returns a file object. The caller
+        closes it."""
+        pass
+
+    @abstractmethod
+    def file_iter_chunks(self, f: IFile, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+        """Returns an iterator over the contents of the file, in chunks of
+        at most chunk_size bytes. The file is closed when the iteration
+        ends or when the iterator is closed."""
+        pass
+
+    @abstractmethod
+    def file_store_stream(self, f: IFile, stream: Any) -> None:
+        """Stores the contents of the file, read in chunks from a binary
+        file object."""
+        pass
+
+    @abstractmethod
+    def file_store_path(self, f: IFile, path: str) -> None:
+        """Stores the contents of the file, copied from a local file."""
+        pass
    
@@ -13,16 +13,49 @@ Examples
 >>> db = FarmDatabase("demo/db")
 >>> farm = db.get("farm000")
 
+The JSON files of a large database can be read by several workers:
+
+>>> db = FarmDatabase("demo/db", workers=8)
+
+The objects and files stored by other processes, for example by the
+import scripts, are loaded by refresh(), or periodically by a
+background thread:
+
+>>> db.refresh()
+>>> db.start_watcher(5.0)
+
+Several processes can share a database directory, with one writer and
+any number of readers. The readers then follow the writer's change
+log instead of scanning the directory (see romidata2.changelog):
+
+>>> db = FarmDatabase("demo/db", shared=True)
+
+The contents of the files can be stored once, whatever the number of
+files that have them (see romidata2.blobstore):
+
+>>> db = FarmDatabase("demo/db", blobs=True)
+
 """
-from typing import List, Any
+from typing import List, Any, Iterator
+import os
 import json
+import shutil
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from fs import open_fs
 import fs
 
 from romidata2.datamodel import *
 from romidata2.impl import *
-from romidata2.io import JsonImporter, JsonExporter
+from romidata2.io import JsonImporter, JsonExporter, ingest_file
+from romidata2.instrument import count
+from romidata2.filetable import FileTable
+from romidata2.changelog import ChangeLog
+from romidata2.blobstore import BlobStore
 
 __author__ = "Peter Hanappe"
 __copyright__ = "Copyright 2020, Sony Computer Science Laboratories"
@@ -34,85 +67,322 @@ __email__ = "peter@hanappe.com"
 __status__ = "Prototype"
 __version__ = "0.0.1"
 
+logger = logging.getLogger(__name__)
+
+# The size of the chunks in which the data files are copied
+CHUNK_SIZE = 1024 * 1024
+
+# The serialized fields that hold the IDs of other objects or files
+# (see the restore() methods in romidata2.impl), either a single ID or
+# a list of IDs. They are the related IDs passed to the listeners.
+REFERENCE_FIELDS = {
+    "Camera": ["owner"],
+    "ScanningDevice": ["owner"],
+    "ObservationUnit": ["context", "zone", "parent"],
+    "Note": ["author", "observation_unit"],
+    "DataStream": ["observation_unit", "file"],
+    "Scan": ["observation_unit", "people", "camera", "scanning_device"],
+    "Analysis": ["observation_unit", "scan"],
+    "Study": ["investigation"],
+    "Zone": ["farm"],
+    "Farm": ["people", "photo"]
+}
+
+# The number of seconds after which the modification time of a
+# directory is trusted by refresh() (see Database.__changed_files())
+RACY_INTERVAL = 2.0
+
+# The maximum number of unknown IDs remembered by the negative cache
+# of Database.lookup()
+MISSING_CACHE_SIZE = 10000
+
+
 class Database(IDatabase):
     def __init__(self,
                  basedir: str,
                  typename: str,
                  classname: str,
                  subtypename: str,
-                 factory: IFactory = None):
+                 factory: IFactory = None,
+                 workers: int = 1,
+                 shared: bool = False,
+                 blobs: bool = False):
         self.__basedir = basedir
         self.__typename = typename
         self.__subtypename = subtypename
         self.__classname = classname
         self.__indexfile = "index.json"
         self.__basefs = open_fs(self.__basedir, create=True)
-        self.__objects = {}        
-        self.__files = {}        
+        self.__objects = {}
+        # The path of the JSON file of each stored object, by ID
+        self.__catalog = {}
+        # The IDs that were looked up but are not in the database
+        self.__missing = OrderedDict()
+        self.__missing_lock = threading.Lock()
+        # The modification times of the JSON files seen by refresh()
+        self.__mtimes = {}
+        # The modification times of the directories scanned by refresh()
+        self.__dir_mtimes = {}
+        self.__refreshed = time.time()
+        # Serializes the insertions into the map of objects
+        self.__refresh_lock = threading.RLock()
+        self.__watcher = None
+        self.__watcher_stop = None
+        # The change log is opened before loading the files, so that
+        # the changes made during the load are applied by refresh()
+        self.__log = None
+        if shared or self.__is_shared():
+            if not self.__basefs.hassyspath("/"):
+                raise ValueError("Shared databases must be in a local directory")
+            self.__log = ChangeLog(self.__basefs.getsyspath("/"), create=True)
+        self.__listeners = []
+        self.__workers = workers
+        self.__dangling = []
         if factory == None:
             self.__factory = DefaultFactory(self)
         else:
             self.__factory = factory
+        self.__files = FileTable(self, self.__factory)
         self.__makedirs("objects")
         self.__makedirs("files")
         self.__makedirs("data")
+        self.__blobs = None
+        if blobs or (self.__basefs.hassyspath("data")
+                     and BlobStore.exists(self.__basefs.getsyspath("data"))):
+            if not self.__basefs.hassyspath("data"):
+                raise ValueError("Blob stores must be in a local directory")
+            self.__blobs = BlobStore(self.__basefs.getsyspath("data"), create=True)
         self.__load_files()
         self.__load_objects()
 
     def __del__(self):
+        self.stop_watcher()
         if self.__basefs:
-            print(self.__basefs)
             self.__basefs.close()
             self.__basefs = None
 
-    def __load_object(self, relpath: str) -> Any:
-        obj = None
-        print("Load %s" % relpath)
-        if self.__basefs.exists(relpath):
-            with self.__basefs.open(relpath) as json_file:
-                data = json.load(json_file)
-                obj = self.__factory.create(data["classname"],
-                                            data["value"])
-                self.__objects[data["id"]] = obj        
+    def __read_json(self, relpath: str) -> Any:
+        logger.debug("Load %s", relpath)
+        with self.__basefs.open(relpath) as json_file:
+            return json.load(json_file)
+
+    def __read_json_files(self, relpaths: List[str]) -> List[Any]:
+        """Reads and decodes the JSON files, and returns their contents in
+        the order of the paths. With several workers, the files are
+        read by a pool of threads.
+        """
+        if self.__workers <= 1 or len(relpaths) <= 1:
+            return [self.__read_json(relpath) for relpath in relpaths]
+        with ThreadPoolExecutor(self.__workers) as executor:
+            return list(executor.map(self.__read_json, relpaths))
+
+    def __value(self, data: dict) -> dict:
+        value = data["value"]
+        if not "id" in value:
+            # Some classes (Person, Camera, ...) don't serialize their
+            # ID: use the ID under which they were stored
+            value["id"] = data["id"]
+        return value
+
+    def __create_object(self, data: dict, relpath: str,
+                        objects: dict = None) -> Any:
+        obj = self.__factory.create(data["classname"], self.__value(data))
+        if objects == None:
+            objects = self.__objects
+        objects[data["id"]] = obj
+        self.__catalog[data["id"]] = relpath
+        self.__forget_missing(data["id"])
+        count("db.objects_loaded")
+        return obj
+
+    def __load_object(self, obj_id: str, relpath: str) -> Any:
+        """Loads an object that is not in memory. It is inserted like the
+        objects loaded by refresh(): under the same lock, in a copy of
+        the map of objects that replaces the map with a single
+        assignment. The object is linked after the insertion, so that
+        the objects it refers to can find it."""
+        with self.__refresh_lock:
+            obj = self.__objects.get(obj_id)
+            if obj != None:
+                return obj
+            if not self.__basefs.exists(relpath):
+                return None
+            objects = dict(self.__objects)
+            obj = self.__create_object(self.__read_json(relpath), relpath, objects)
+            self.__objects = objects
+            obj.restore()
         return obj
     
     def __load_objects(self) -> None:
-        for obj_type in self.__basefs.listdir('objects'):
-            for filename in self.__basefs.listdir('objects/%s' % obj_type):
+        relpaths = []
+        for obj_type in sorted(self.__basefs.listdir('objects')):
+            for filename in sorted(self.__basefs.listdir('objects/%s' % obj_type)):
                 if filename.endswith(".json"):
-                    self.__load_object(fs.path.join("objects", obj_type, filename))
+                    relpaths.append(fs.path.join("objects", obj_type, filename))
+        # The objects are created and linked in the order of their
+        # paths, whatever the number of workers
+        for data, relpath in zip(self.__read_json_files(relpaths), relpaths):
+            self.__create_object(data, relpath)
+        self.__link_objects()
+
+    def __link_objects(self) -> None:
+        """Resolves the references between the loaded objects, and to the
+        files, using the objects in memory only. The references that
+        cannot be resolved are reported together.
+        """
+        resolver = Resolver(self, self.__objects)
         for obj in self.__objects.values():
-            obj.restore()
+            obj.restore(resolver)
+        self.__dangling = resolver.dangling
+        if len(self.__dangling) > 0:
+            count("db.dangling_references", len(self.__dangling))
+            logger.warning("%d dangling references, including: %s",
+                           len(self.__dangling),
+                           "; ".join("%s %s: %s=%s" % d for d in self.__dangling[:10]))
+
+    @property
+    def dangling_references(self) -> List[tuple]:
+        """The references to missing objects or files found when the
+        database was loaded, as (classname, id, field, missing ID)
+        tuples."""
+        return self.__dangling
                 
-    def __load_id(self, obj_id: str) -> None:
-        relpath = fs.path.join("objects", "%s.json" % obj_id)
-        return self.__load_object(relpath)
+    def __load_id(self, obj_id: str) -> Any:
+        """Loads an object that is not in memory, such as an object that
+        refresh() is inserting. The path of its file is taken from the
+        catalog of the paths already loaded: the misses never touch
+        the disk, and the objects stored by other processes are found
+        once refresh() has loaded them. The IDs that are not found are
+        kept in a bounded negative cache.
+        """
+        if not obj_id or not isinstance(obj_id, str):
+            return None
+        with self.__missing_lock:
+            if obj_id in self.__missing:
+                self.__missing.move_to_end(obj_id)
+                count("db.lookup_misses_cached")
+                return None
+        relpath = self.__catalog.get(obj_id)
+        obj = None
+        if relpath != None:
+            obj = self.__load_object(obj_id, relpath)
+        if obj == None:
+            count("db.lookup_misses")
+            self.__remember_missing(obj_id)
+        return obj
+
+    def __remember_missing(self, obj_id: str) -> None:
+        with self.__missing_lock:
+            self.__missing[obj_id] = True
+            if len(self.__missing) > MISSING_CACHE_SIZE:
+                self.__missing.popitem(last=False)
 
-    def __store_object(self, obj_id: str, classname: str, obj: Any) -> None:
+    def __forget_missing(self, obj_id: str) -> None:
+        if len(self.__missing) > 0:
+            with self.__missing_lock:
+                self.__missing.pop(obj_id, None)
+
+    def __store_object(self, obj_id: str, classname: str, obj: Any) -> dict:
         self.__makedirs("objects", classname)
         relpath = fs.path.join("objects", classname, "%s.json" % obj_id)
-        print("Store %s" % relpath)
-        with self.__basefs.open(relpath, 'w') as f:
-            data = {
-                "id": obj_id,
-                "classname": classname,
-                "value": obj
-            }
+        logger.debug("Store %s", relpath)
+        count("db.objects_stored")
+        value = obj.serialize()
+        self.__catalog[obj_id] = relpath
+        data = {
+            "id": obj_id,
+            "classname": classname,
+            "value": value
+        }
+        self.__write_json(relpath, data)
+        return value
+
+    def __is_shared(self) -> bool:
+        return (self.__basefs.hassyspath("/")
+                and ChangeLog.exists(self.__basefs.getsyspath("/")))
+
+    @property
+    def shared(self) -> bool:
+        """Whether the database directory is shared with other processes
+        through a change log."""
+        return self.__log != None
+
+    def __write_json(self, relpath: str, data: Any) -> None:
+        if not self.__basefs.hassyspath("/"):
+            with self.__basefs.open(relpath, 'w') as f:
+                json.dump(data, f, indent=4, cls=JsonExporter)
+            self.__written(relpath)
+            return
+        # The file is renamed into place so that the readers never see
+        # a partial file, and so that the modification time of its
+        # directory changes (see __changed_files())
+        path = self.__basefs.getsyspath(relpath)
+        tmppath = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+        with open(tmppath, 'w') as f:
             json.dump(data, f, indent=4, cls=JsonExporter)
+        if self.__log == None:
+            os.replace(tmppath, path)
+            self.__written(relpath)
+        else:
+            with self.__log.writer():
+                os.replace(tmppath, path)
+                self.__written(relpath)
+                self.__log.append([relpath])
     
     def __insert(self, obj: BaseClass) -> None:
-        self.__objects[obj.id] = obj
+        # Under the lock of refresh(), so that the object is not lost
+        # when refresh() replaces the map of objects with its copy
+        with self.__refresh_lock:
+            self.__objects[obj.id] = obj
+        self.__forget_missing(obj.id)
             
     def store(self, obj: BaseClass) -> None:
+        action = "updated" if obj.id in self.__objects else "created"
         self.__insert(obj)
-        self.__store_object(obj.id, obj.classname, obj)
+        value = self.__store_object(obj.id, obj.classname, obj)
+        self.__notify(action, obj.classname, obj.id,
+                      self.__references(obj.classname, value))
+
+    def add_listener(self, listener) -> None:
+        self.__listeners.append(listener)
+
+    def __notify(self, action: str, classname: str, obj_id: str,
+                 related_ids: List[str]) -> None:
+        for listener in self.__listeners:
+            listener(action, classname, obj_id, related_ids)
+
+    def __references(self, classname: str, value: dict) -> List[str]:
+        """Returns the IDs of the objects and files that the serialized
+        object refers to.
+        """
+        r = []
+        for field in REFERENCE_FIELDS.get(classname, []):
+            v = value.get(field)
+            if isinstance(v, str):
+                if v:
+                    r.append(v)
+            elif isinstance(v, list):
+                r.extend(s for s in v if isinstance(s, str) and s)
+        return r
 
     def lookup(self, obj_id: str) -> BaseClass:
         r = self.__objects.get(obj_id)
         if r == None:
-            r = self.__load_id(obj_id)            
+            r = self.__load_id(obj_id)
+        return r
+
+    def lookup_many(self, obj_ids: List[str]) -> List[BaseClass]:
+        objects = self.__objects
+        r = [objects.get(obj_id) for obj_id in obj_ids]
+        for i, obj in enumerate(r):
+            if obj == None:
+                r[i] = self.__load_id(obj_ids[i])
         return r
             
+    def iter_objects(self):
+        """Iterates over all the objects of the database."""
+        return iter(list(self.__objects.values()))
+
     def select(self, classname: str, prop: str = None, value: str = None) -> List[BaseClass]:
         r = []
         for obj in self.__objects.values():
@@ -122,38 +392,44 @@ class Database(IDatabase):
                 r.append(obj)
         return r
         
-    def __insert_file(self, ifile: IFile) -> None:
-        self.__files[ifile.id] = ifile        
-
-    def __load_file(self, relpath: str) -> None:
-        with self.__basefs.open(relpath) as json_file:
-            data = json.load(json_file)
-            f = self.__factory.create("File", data)
-            self.__insert_file(f)
-
     def __load_files(self) -> None:
-        for filename in self.__basefs.listdir('files'):
-            if filename.endswith(".json"):
-                self.__load_file(fs.path.join("files", filename))
+        relpaths = [fs.path.join("files", filename)
+                    for filename in sorted(self.__basefs.listdir('files'))
+                    if filename.endswith(".json")]
+        for data in self.__read_json_files(relpaths):
+            self.__files.add(data)
 
     def __store_file(self, ifile: IFile) -> None:
         relpath = fs.path.join("files", "%s.json" % ifile.id)
-        with self.__basefs.open(relpath, 'w') as f:
-            json.dump(ifile, f, indent=4, cls=JsonExporter)
-        self.__insert_file(ifile)
+        self.__write_json(relpath, ifile)
 
     def new_file(self, owner_id, source_name: str, source_id: str,
                  short_name: str, relpath: str, mimetype: str) -> IFile:
-        f = self.__factory.create("File", {
+        f = self.__files.add({
+            "id": new_id(),
             "owner": owner_id,
             "source_name": source_name,
             "source_id": source_id,
             "short_name": short_name,
-            "date_created": current_date().isoformat(),
-            "source_name": source_name,
+            "date_created": current_date(),
             "path": relpath,
             "mimetype": mimetype })
         self.__store_file(f)
+        self.__notify("created", f.classname, f.id, [owner_id, source_id])
+        return f
+
+    def new_file_from_path(self, owner_id, source_name: str, source_id: str,
+                           short_name: str, relpath: str, mimetype: str,
+                           path: str, move: bool = False) -> IFile:
+        f = self.new_file(owner_id, source_name, source_id,
+                          short_name, relpath, mimetype)
+        if self.__blobs != None:
+            self.__store_blob(f, self.__blobs.put_file(path, move))
+        else:
+            target = self.__basefs.getsyspath(fs.path.join("data", relpath))
+            method = ingest_file(path, target, move=move)
+            count("files.imported.%s" % method)
+            self.__file_updated(f)
         return f
 
     def get_file(self, file_id: str) -> IFile:
@@ -163,14 +439,175 @@ class Database(IDatabase):
                      source_name: str,
                      source_id: str,
                      short_name: str) -> List[IFile]:
+        return self.__files.select(source_name, source_id, short_name)
+        
+    def __mtime(self, info) -> float:
+        return info.raw["details"]["modified"]
+
+    def __written(self, relpath: str) -> None:
+        """Records the modification time of a file written by this
+        database, so that refresh() does not load it again."""
+        info = self.__basefs.getinfo(relpath, namespaces=["details"])
+        self.__mtimes[relpath] = self.__mtime(info)
+
+    def __changed_files(self, dirpath: str, known, start: float) -> List[str]:
+        """Returns the JSON files in the directory that were created or
+        modified since they were last loaded. The files loaded at
+        startup have no recorded modification time: they are only
+        considered changed if they were modified after the database
+        was loaded.
+
+        The files are written under a temporary name and renamed, which
+        changes the modification time of the directory: a directory
+        that has not changed since the last scan is skipped. Its
+        modification time is only recorded once it is older than
+        RACY_INTERVAL, because the directory may be changed again
+        within the resolution of the file system's clock."""
+        mtime = self.__mtime(self.__basefs.getinfo(dirpath, namespaces=["details"]))
+        if self.__dir_mtimes.get(dirpath) == mtime:
+            return []
+        if mtime < start - RACY_INTERVAL:
+            self.__dir_mtimes[dirpath] = mtime
+        else:
+            self.__dir_mtimes.pop(dirpath, None)
+        count("db.directories_scanned")
         r = []
-        for f in self.__files.values():
-            if ((source_name == None or f.source_name == source_name)
-                and (source_id == None or f.source_id == source_id)
-                and (short_name == None or f.short_name == short_name)):
-                r.append(f)
+        for info in self.__basefs.scandir(dirpath, namespaces=["details"]):
+            if not info.name.endswith(".json"):
+                continue
+            relpath = fs.path.join(dirpath, info.name)
+            mtime = self.__mtime(info)
+            previous = self.__mtimes.get(relpath)
+            if previous == mtime:
+                continue
+            self.__mtimes[relpath] = mtime
+            if (previous == None and mtime < self.__refreshed
+                and known(info.name[:-5])):
+                continue
+            r.append(relpath)
         return r
-        
+
+    def __read_changed(self, relpaths: List[str]) -> List[tuple]:
+        """Reads the changed files. A file that cannot be decoded, for
+        example because it is still being written, is read again by the
+        next refresh."""
+        r = []
+        for relpath in relpaths:
+            try:
+                r.append((self.__read_json(relpath), relpath))
+            except (ValueError, OSError, fs.errors.FSError) as e:
+                logger.warning("Failed to read %s: %s", relpath, e)
+                self.__mtimes.pop(relpath, None)
+                self.__dir_mtimes.pop(fs.path.dirname(relpath), None)
+        return r
+
+    def __changed_paths(self, start: float) -> tuple:
+        """Returns the paths of the new and modified file records and
+        objects, from the change log if the database is shared, or else
+        by scanning the directories."""
+        relpaths = None
+        if self.__log != None:
+            relpaths = self.__log.read()
+        if relpaths != None:
+            return ([p for p in relpaths if p.startswith("files/")],
+                    [p for p in relpaths if p.startswith("objects/")])
+        file_paths = self.__changed_files(
+            "files", lambda file_id: self.__files.get(file_id) != None, start)
+        object_paths = []
+        for classname in sorted(self.__basefs.listdir("objects")):
+            object_paths.extend(self.__changed_files(
+                fs.path.join("objects", classname),
+                lambda obj_id: obj_id in self.__objects, start))
+        return file_paths, object_paths
+
+    def refresh(self) -> int:
+        """Loads the objects and file records that were created or
+        modified by another process since the database was loaded, or
+        since the last refresh. New objects are created and linked to
+        the objects in memory. Modified objects are updated in place,
+        so that the references to them remain valid. The objects that
+        have new files, such as the results of an analysis, are linked again.
+        The listeners are notified of all the changes.
+
+        In a shared database, only the files listed in the change log
+        are loaded, and the directories are not scanned.
+
+        Returns the number of files that were loaded. Files that were
+        removed are ignored.
+        """
+        with self.__refresh_lock:
+            start = time.time()
+            file_paths, object_paths = self.__changed_paths(start)
+            changes = []
+            sources = set()
+            for data, relpath in self.__read_changed(file_paths):
+                action = "updated" if self.__files.get(data["id"]) else "created"
+                f = self.__files.add(data)
+                sources.add(f.source_id)
+                changes.append((action, f.classname, f.id,
+                                [f.owner, f.source_id]))
+            # The new objects are inserted with a single assignment, so
+            # that the readers never see the dictionary change size.
+            # Only the changed objects, and the sources of the new
+            # files, are linked again.
+            objects = dict(self.__objects) if object_paths else self.__objects
+            linked = []
+            for data, relpath in self.__read_changed(object_paths):
+                obj = objects.get(data["id"])
+                if obj == None:
+                    obj = self.__create_object(data, relpath, objects)
+                    action = "created"
+                else:
+                    obj.parse(self.__value(data))
+                    obj.modified = False
+                    count("db.objects_reloaded")
+                    action = "updated"
+                linked.append(obj)
+                changes.append((action, obj.classname, obj.id,
+                                self.__references(obj.classname, data["value"])))
+            self.__objects = objects
+            linked.extend(objects[obj_id] for obj_id in sources
+                          if obj_id in objects)
+            resolver = Resolver(self, objects)
+            for obj in linked:
+                obj.restore(resolver)
+            if len(resolver.dangling) > 0:
+                count("db.dangling_references", len(resolver.dangling))
+                self.__dangling = self.__dangling + resolver.dangling
+            self.__refreshed = start
+        for change in changes:
+            self.__notify(*change)
+        if len(changes) > 0:
+            logger.info("Refreshed %d objects and files", len(changes))
+        return len(changes)
+
+    def __watch(self, interval: float, stop: threading.Event) -> None:
+        while not stop.wait(interval):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Failed to refresh the database")
+
+    def start_watcher(self, interval: float = 5.0) -> None:
+        """Starts a background thread that calls refresh() every
+        'interval' seconds."""
+        if self.__watcher != None:
+            return
+        self.__watcher_stop = threading.Event()
+        self.__watcher = threading.Thread(target=self.__watch,
+                                          args=(interval, self.__watcher_stop),
+                                          name="romidata2-refresh",
+                                          daemon=True)
+        self.__watcher.start()
+
+    def stop_watcher(self) -> None:
+        """Stops the thread started by start_watcher()."""
+        if self.__watcher != None:
+            self.__watcher_stop.set()
+            if self.__watcher != threading.current_thread():
+                self.__watcher.join()
+            self.__watcher = None
+
     def __makedirs(self, *dirs) -> None:
         relpath = fs.path.join(*dirs)
         self.__basefs.makedirs(relpath, recreate=True)
@@ -182,19 +619,74 @@ class Database(IDatabase):
 
     def __open_ifile(self, ifile: IFile, mode: str):
         return self.__open_file(fs.path.join("data", ifile.path), mode)
+
+    def __write_data(self, ifile: IFile, mode: str, write) -> None:
+        """Writes the contents of a data file with the given function. The
+        file is written under a temporary name and renamed, so that the
+        readers never see a partial file. This also replaces, instead
+        of writing into, a file imported with a hard link, which shares
+        its data with its source."""
+        relpath = fs.path.join("data", ifile.path)
+        if not self.__basefs.hassyspath("/"):
+            with self.__open_file(relpath, mode) as f:
+                write(f)
+        else:
+            self.__makedirs(fs.path.dirname(relpath))
+            path = self.__basefs.getsyspath(relpath)
+            tmppath = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+            try:
+                with open(tmppath, mode) as f:
+                    write(f)
+                os.replace(tmppath, path)
+            except BaseException:
+                if os.path.lexists(tmppath):
+                    os.remove(tmppath)
+                raise
+        self.__file_updated(ifile)
+
+    def __file_updated(self, ifile: IFile) -> None:
+        """Signals that the contents of a file changed. The other
+        processes find the path of its record in the change log, or
+        else its new modification time, and reload it on their next
+        refresh, which invalidates the responses that depend on it."""
+        relpath = fs.path.join("files", "%s.json" % ifile.id)
+        if self.__log != None:
+            with self.__log.writer():
+                self.__log.append([relpath])
+        elif self.__basefs.exists(relpath) and self.__basefs.hassyspath(relpath):
+            # The directory is touched too, so that it is scanned
+            os.utime(self.__basefs.getsyspath(relpath))
+            os.utime(self.__basefs.getsyspath("files"))
+            self.__written(relpath)
+        self.__notify("updated", ifile.classname, ifile.id,
+                      [ifile.owner, ifile.source_id])
         
+    @property
+    def blobs(self) -> BlobStore:
+        """The store of the contents of the files, or None if the files
+        are stored as they are."""
+        return self.__blobs
+
+    def __store_blob(self, ifile: IFile, digest: str) -> None:
+        relpath = fs.path.join("data", ifile.path)
+        self.__blobs.link(digest, self.__basefs.getsyspath(relpath))
+        self.__file_updated(ifile)
+
     def file_store_text(self, ifile: IFile, text: str) -> None:
-        f = self.__open_ifile(ifile, "w")
-        f.write(text)
-        f.close()
+        if self.__blobs != None:
+            digest = self.__blobs.put_bytes(text.encode("utf-8"))
+            self.__store_blob(ifile, digest)
+            return
+        self.__write_data(ifile, "w", lambda f: f.write(text))
         
     def file_store_json(self, ifile: IFile, value: Any) -> None:
         self.file_store_text(ifile, json.dumps(value, indent=4))
         
     def file_store_bytes(self, ifile: IFile, data: bytes) -> None:
-        f = self.__open_ifile(ifile, "wb")
-        f.write(data)
-        f.close()
+        if self.__blobs != None:
+            self.__store_blob(ifile, self.__blobs.put_bytes(data))
+            return
+        self.__write_data(ifile, "wb", lambda f: f.write(data))
     
     def file_read_text(self, ifile: IFile) -> str:
         f = self.__open_ifile(ifile, "r")
@@ -212,16 +704,42 @@ class Database(IDatabase):
         f.close()
         return r;
 
-    
-class InvestigationDatabase(Database):
-    def __init__(self, basedir: str, factory: IFactory = None):
-        super().__init__(basedir, "investigations", "Investigation", "studies", factory)
+    def file_open(self, ifile: IFile, mode: str = "rb") -> Any:
+        if not mode in ["r", "rb"]:
+            raise ValueError("Files can only be opened for reading: %s" % mode)
+        return self.__open_ifile(ifile, mode)
 
-        
-class FarmDatabase(Database):
-    def __init__(self, basedir: str, factory: IFactory = None):
-        super().__init__(basedir, "farms", "Farm", "zones", factory)
+    def file_iter_chunks(self, ifile: IFile,
+                         chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        # The file is opened now, so that a missing file is reported by
+        # the caller and not by the first iteration
+        f = self.__open_ifile(ifile, "rb")
+        def chunks():
+            with f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+        return chunks()
+
+    def file_store_stream(self, ifile: IFile, stream: Any) -> None:
+        if self.__blobs != None:
+            self.__store_blob(ifile, self.__blobs.put_stream(stream))
+            return
+        self.__write_data(ifile, "wb",
+                          lambda f: shutil.copyfileobj(stream, f, CHUNK_SIZE))
+
+    def file_store_path(self, ifile: IFile, path: str) -> None:
+        with open(path, "rb") as stream:
+            self.file_store_stream(ifile, stream)
 
+    
+class FarmLookup():
+    """The lookups of farm objects by ID or by short name, shared by the
+    farm databases (see FarmDatabase and
+    romidata2.snapshot.FarmSnapshotDatabase)."""
+    
     def get_person(self, person_id: str):
         r = self.lookup(person_id)
         if not r:
@@ -254,6 +772,20 @@ class FarmDatabase(Database):
 
     def get_datastream(self, stream_id: str):
         pass
+
+    
+class InvestigationDatabase(Database):
+    def __init__(self, basedir: str, factory: IFactory = None,
+                 workers: int = 1, shared: bool = False, blobs: bool = False):
+        super().__init__(basedir, "investigations", "Investigation", "studies",
+                         factory, workers, shared, blobs)
+
+        
+class FarmDatabase(Database, FarmLookup):
+    def __init__(self, basedir: str, factory: IFactory = None,
+                 workers: int = 1, shared: bool = False, blobs: bool = False):
+        super().__init__(basedir, "farms", "Farm", "zones", factory, workers,
+                         shared, blobs)
     
     def farm_filepath(self, farm, file_short_name, ext):
         return "%s/files/%s.%s" % (farm.short_name,
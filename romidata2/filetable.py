@@ -0,0 +1,394 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""romidata2.filetable
+===================
+
+Provides a compact, column-oriented storage for the file records of a
+database. File records are by far the most numerous objects in a
+database, and they are mostly accessed through select_files(). Instead
+of one Python object per file, the FileTable stores each field in a
+column: the owner, source name, source ID, short name, and mimetype
+are dictionary-encoded (each distinct string is stored once, and the
+column holds integer codes), the creation dates are stored as 64-bit
+timestamps, and only the paths are kept as individual strings.
+
+Selections are evaluated on whole columns with numpy, except the
+selections by source (name and ID), such as the images of a scan,
+which use an index of the rows of each source that is updated as the
+records are added. The IFile objects returned by the table are
+lightweight views that read and write the columns of their row.
+
+Examples
+--------
+>>> from romidata2.filetable import FileTable
+>>> table = FileTable()
+>>> f = table.add({"id": "file000", "owner": "scan000", "source_name": "scan",
+...                "source_id": "scan000", "short_name": "image-0001",
+...                "date_created": "2020-08-26T12:00:00+02:00",
+...                "path": "farm/scan000/image-0001.jpg",
+...                "mimetype": "image/jpeg"})
+>>> [f.id for f in table.select("scan", "scan000", None)]
+['file000']
+
+"""
+from typing import List, Any
+import bisect
+import threading
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from romidata2.datamodel import IFile, IFactory, IResolver
+from romidata2.impl import parse_date
+
+__author__ = "Peter Hanappe"
+__copyright__ = "Copyright 2020, Sony Computer Science Laboratories"
+__credits__ = ["Peter Hanappe"]
+__license__ = "Affero General Public License"
+__version__ = "3"
+__maintainer__ = "Peter Hanappe"
+__email__ = "peter@hanappe.com"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+NAIVE_EPOCH = datetime(1970, 1, 1)
+
+# The value of the offset column for dates without a timezone
+NAIVE = np.iinfo(np.int32).min
+
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+class StringPool():
+    """Class implementing the dictionary encoding of a string column. Each
+    distinct string is assigned an integer code.
+    """
+    __slots__ = ("__codes", "__strings")
+
+    def __init__(self):
+        self.__codes = {}
+        self.__strings = []
+
+    def __len__(self):
+        return len(self.__strings)
+
+    def __getitem__(self, code: int) -> str:
+        return self.__strings[code]
+
+    def encode(self, value: str) -> int:
+        """Returns the code of the string, adding it to the pool if needed."""
+        code = self.__codes.get(value)
+        if code == None:
+            code = len(self.__strings)
+            self.__strings.append(value)
+            self.__codes[value] = code
+        return code
+
+    def find(self, value: str) -> int:
+        """Returns the code of the string, or -1 if it is not in the pool."""
+        return self.__codes.get(value, -1)
+
+
+class FileView(IFile):
+    """Class implementing the IFile interface on top of one row of a
+    FileTable. Views are created on demand and hold no data of their
+    own.
+    """
+    __slots__ = ("__table", "__row")
+
+    def __init__(self, table, row: int):
+        self.__table = table
+        self.__row = row
+
+    def __eq__(self, other):
+        return (isinstance(other, FileView)
+                and other.__table is self.__table
+                and other.__row == self.__row)
+
+    def __hash__(self):
+        return hash(self.id)
+
+    @property
+    def id(self) -> str:
+        return self.__table.file_id(self.__row)
+
+    @property
+    def classname(self) -> str:
+        return "File"
+
+    @property
+    def modified(self) -> bool:
+        return False
+
+    @modified.setter
+    def modified(self, value: bool) -> None:
+        pass
+
+    @property
+    def factory(self) -> IFactory:
+        return self.__table.factory
+
+    @property
+    def database(self) -> Any:
+        return self.__table.database
+
+    @property
+    def owner(self) -> str:
+        return self.__table.string("owner", self.__row)
+
+    @property
+    def source_name(self) -> str:
+        return self.__table.string("source_name", self.__row)
+
+    @source_name.setter
+    def source_name(self, value: str):
+        self.__table.set_string("source_name", self.__row, value)
+
+    @property
+    def source_id(self) -> str:
+        return self.__table.string("source_id", self.__row)
+
+    @source_id.setter
+    def source_id(self, value: str):
+        self.__table.set_string("source_id", self.__row, value)
+
+    @property
+    def short_name(self) -> str:
+        return self.__table.string("short_name", self.__row)
+
+    @short_name.setter
+    def short_name(self, value: str):
+        self.__table.set_string("short_name", self.__row, value)
+
+    @property
+    def date_created(self) -> datetime:
+        return self.__table.date(self.__row)
+
+    @date_created.setter
+    def date_created(self, value: datetime):
+        self.__table.set_date(self.__row, value)
+
+    @property
+    def path(self) -> str:
+        return self.__table.path(self.__row)
+
+    @path.setter
+    def path(self, value: str):
+        self.__table.set_path(self.__row, value)
+
+    @property
+    def mimetype(self) -> str:
+        return self.__table.string("mimetype", self.__row)
+
+    @mimetype.setter
+    def mimetype(self, value: str):
+        self.__table.set_string("mimetype", self.__row, value)
+
+    def clone(self):
+        raise NotImplementedError()
+
+    def store(self) -> None:
+        raise NotImplementedError()
+
+    def restore(self, resolver: IResolver = None) -> None:
+        pass
+
+    def parse(self, properties: dict):
+        raise NotImplementedError()
+
+    def serialize(self) -> dict:
+        return { 'id': self.id,
+                 'owner': self.owner,
+                 'source_name': self.source_name,
+                 'source_id': self.source_id,
+                 'short_name': self.short_name,
+                 'date_created': self.date_created.isoformat(),
+                 'path': self.path,
+                 'mimetype': self.mimetype }
+
+
+class FileTable():
+    """Class implementing the column-oriented storage of file records.
+
+    Attributes
+    ----------
+    database : IDatabase
+        The database that owns the files, returned by IFile.database.
+    factory : IFactory
+        The factory of the database, returned by IFile.factory.
+    capacity : int
+        The initial number of rows. The columns grow as needed.
+
+    """
+    STRING_COLUMNS = ("owner", "source_name", "source_id", "short_name",
+                      "mimetype")
+
+    def __init__(self, database: Any = None, factory: IFactory = None,
+                 capacity: int = 1024):
+        self.__database = database
+        self.__factory = factory
+        self.__size = 0
+        self.__rows = {}
+        self.__ids = []
+        self.__paths = []
+        self.__pools = {name: StringPool() for name in FileTable.STRING_COLUMNS}
+        self.__codes = {name: np.zeros(capacity, dtype=np.int32)
+                        for name in FileTable.STRING_COLUMNS}
+        self.__times = np.zeros(capacity, dtype=np.int64)
+        self.__offsets = np.zeros(capacity, dtype=np.int32)
+        # The rows of each source, by the codes of its name and ID
+        self.__sources = {}
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return self.__size
+
+    @property
+    def database(self) -> Any:
+        return self.__database
+
+    @property
+    def factory(self) -> IFactory:
+        return self.__factory
+
+    def __grow(self) -> None:
+        capacity = 2 * max(len(self.__times), 1)
+        for name in FileTable.STRING_COLUMNS:
+            self.__codes[name] = self.__resized(self.__codes[name], capacity)
+        self.__times = self.__resized(self.__times, capacity)
+        self.__offsets = self.__resized(self.__offsets, capacity)
+
+    def __resized(self, column, capacity):
+        r = np.zeros(capacity, dtype=column.dtype)
+        r[:len(column)] = column
+        return r
+
+    def __source(self, row: int) -> tuple:
+        return (int(self.__codes["source_name"][row]),
+                int(self.__codes["source_id"][row]))
+
+    def __index(self, row: int) -> None:
+        rows = self.__sources.setdefault(self.__source(row), [])
+        if len(rows) == 0 or rows[-1] < row:
+            rows.append(row)
+        else:
+            bisect.insort(rows, row)
+
+    def __unindex(self, row: int) -> None:
+        key = self.__source(row)
+        rows = self.__sources[key]
+        rows.remove(row)
+        if len(rows) == 0:
+            del self.__sources[key]
+
+    def add(self, properties: dict) -> IFile:
+        """Adds a file record, or replaces the record with the same ID. The
+        properties are those of the serialized file (see
+        IFile.serialize()). Returns the view of the new record.
+        """
+        file_id = properties["id"]
+        with self.__lock:
+            row = self.__rows.get(file_id)
+            if row == None:
+                if self.__size == len(self.__times):
+                    self.__grow()
+                row = self.__size
+                self.__ids.append(file_id)
+                self.__paths.append(properties["path"])
+                self.__rows[file_id] = row
+                self.__size += 1
+            else:
+                self.__paths[row] = properties["path"]
+                self.__unindex(row)
+            for name in FileTable.STRING_COLUMNS:
+                self.__codes[name][row] = self.__pools[name].encode(properties[name])
+            self.__index(row)
+            date = properties["date_created"]
+            if isinstance(date, str):
+                date = parse_date(date)
+            self.__set_date(row, date)
+        return FileView(self, row)
+
+    def get(self, file_id: str) -> IFile:
+        """Returns the view of the file with the given ID, or None."""
+        row = self.__rows.get(file_id)
+        if row == None:
+            return None
+        return FileView(self, row)
+
+    def select(self, source_name: str, source_id: str,
+               short_name: str) -> List[IFile]:
+        """Returns the views of the files that match all the given values.
+        A value of None matches all the files.
+        """
+        if source_name != None and source_id != None:
+            return self.__select_source(source_name, source_id, short_name)
+        size = self.__size
+        mask = None
+        for name, value in (("source_name", source_name),
+                            ("source_id", source_id),
+                            ("short_name", short_name)):
+            if value == None:
+                continue
+            code = self.__pools[name].find(value)
+            if code < 0:
+                return []
+            matches = self.__codes[name][:size] == code
+            mask = matches if mask is None else mask & matches
+        rows = range(size) if mask is None else np.flatnonzero(mask).tolist()
+        return [FileView(self, row) for row in rows]
+
+    def __select_source(self, source_name: str, source_id: str,
+                        short_name: str) -> List[IFile]:
+        key = (self.__pools["source_name"].find(source_name),
+               self.__pools["source_id"].find(source_id))
+        rows = list(self.__sources.get(key, []))
+        if short_name != None:
+            code = self.__pools["short_name"].find(short_name)
+            column = self.__codes["short_name"]
+            rows = [row for row in rows if column[row] == code]
+        return [FileView(self, row) for row in rows]
+
+    def file_id(self, row: int) -> str:
+        return self.__ids[row]
+
+    def string(self, name: str, row: int) -> str:
+        return self.__pools[name][int(self.__codes[name][row])]
+
+    def set_string(self, name: str, row: int, value: str) -> None:
+        with self.__lock:
+            indexed = name == "source_name" or name == "source_id"
+            if indexed:
+                self.__unindex(row)
+            self.__codes[name][row] = self.__pools[name].encode(value)
+            if indexed:
+                self.__index(row)
+
+    def path(self, row: int) -> str:
+        return self.__paths[row]
+
+    def set_path(self, row: int, value: str) -> None:
+        self.__paths[row] = value
+
+    def date(self, row: int) -> datetime:
+        microseconds = int(self.__times[row])
+        offset = int(self.__offsets[row])
+        if offset == NAIVE:
+            return NAIVE_EPOCH + microseconds * ONE_MICROSECOND
+        tz = timezone(timedelta(seconds=offset))
+        return (EPOCH + microseconds * ONE_MICROSECOND).astimezone(tz)
+
+    def set_date(self, row: int, value: datetime) -> None:
+        with self.__lock:
+            self.__set_date(row, value)
+
+    def __set_date(self, row: int, value: datetime) -> None:
+        offset = value.utcoffset()
+        if offset == None:
+            self.__times[row] = (value - NAIVE_EPOCH) // ONE_MICROSECOND
+            self.__offsets[row] = NAIVE
+        else:
+            self.__times[row] = (value - EPOCH) // ONE_MICROSECOND
+            self.__offsets[row] = int(offset.total_seconds())
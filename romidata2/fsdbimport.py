@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""romidata2.fsdbimport
+====================
+
+Provides the import of the scans of a FSDB directory, the database of
+the plant imager and the rover, into a FarmDatabase. For each scan, a
+Scan object is created with its images, together with a stitching
+analysis, with the maps of the 'maps' fileset, and a plant analysis,
+with the plants of the 'individual_plants' fileset.
+
+The FSDB files are read directly (files.json and the JSON files in
+the metadata directory), so the romidata package is not needed. The
+data files are imported with new_file_from_path(), which links them
+when it can, by a pool of worker threads that also read the image
+sizes from the image headers and the metadata of the plants. The
+objects are created and stored by the calling thread, once the files
+of a scan are imported.
+
+With dry_run=True, the workers only read the source files and their
+metadata, and nothing is written: the reported rate is the rate at
+which the source can be read.
+
+Examples
+--------
+>>> from romidata2.db import FarmDatabase
+>>> from romidata2.impl import DefaultFactory
+>>> from romidata2.protodb import Prototypes
+>>> from romidata2.fsdbimport import ScanImporter
+>>> db = FarmDatabase("demo/db")
+>>> farm = db.get_farm("chatelain")
+>>> importer = ScanImporter(db, DefaultFactory(db), Prototypes("prototypes"),
+...                         farm, farm.get_observation_unit("lettuce"),
+...                         ["julie"], "picamera_v2", "camera_rail",
+...                         "linear_4m", workers=8)
+>>> stats = importer.import_scans("fsdb", ["2019-04-16"])
+>>> print(stats)
+7203 files, 10312.4 MB in 95.2 s: 75.7 files/s, 108.3 MB/s
+
+"""
+from typing import List, Any, Callable
+import os
+import json
+import time
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from romidata2.datamodel import *
+from romidata2.instrument import count
+from romidata2.util import new_scan
+
+__author__ = "Peter Hanappe"
+__copyright__ = "Copyright 2020, Sony Computer Science Laboratories"
+__credits__ = ["Peter Hanappe"]
+__license__ = "Affero General Public License"
+__version__ = "3"
+__maintainer__ = "Peter Hanappe"
+__email__ = "peter@hanappe.com"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+logger = logging.getLogger(__name__)
+
+# The size of the chunks in which the source files are read in a dry run
+CHUNK_SIZE = 1024 * 1024
+
+
+def image_size(path: str) -> tuple:
+    """Returns the width and height of an image. PIL only reads the
+    header of the file to open it, so the image is not decoded."""
+    with Image.open(path) as im:
+        return im.size
+
+
+class FsdbFile():
+    """A file of a FSDB fileset."""
+    __slots__ = ["id", "filename", "path", "metadata_path"]
+
+    def __init__(self, id: str, filename: str, path: str, metadata_path: str):
+        self.id = id
+        self.filename = filename
+        self.path = path
+        self.metadata_path = metadata_path
+
+    def metadata(self) -> dict:
+        """Returns the metadata of the file, or an empty dict."""
+        if not os.path.exists(self.metadata_path):
+            return {}
+        with open(self.metadata_path) as f:
+            return json.load(f)
+
+
+class FsdbScan():
+    """Class reading a scan of a FSDB directory.
+
+    Attributes
+    ----------
+    basedir : str
+        The path of the FSDB directory.
+    scan_id : str
+        The ID of the scan, which is also the name of its directory.
+
+    """
+    def __init__(self, basedir: str, scan_id: str):
+        self.__id = scan_id
+        self.__path = os.path.join(basedir, scan_id)
+        self.__filesets = None
+
+    @property
+    def id(self) -> str:
+        return self.__id
+
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.__path, "files.json"))
+
+    def metadata(self, key: str = None) -> Any:
+        """Returns the metadata of the scan, or the value of one of its
+        keys."""
+        path = os.path.join(self.__path, "metadata", "metadata.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                metadata = json.load(f)
+        else:
+            metadata = {}
+        if key == None:
+            return metadata
+        return metadata.get(key, None)
+
+    def get_files(self, fileset_id: str) -> List[FsdbFile]:
+        """Returns the files of a fileset, or None if the scan has no
+        fileset with this ID."""
+        if self.__filesets == None:
+            with open(os.path.join(self.__path, "files.json")) as f:
+                self.__filesets = {fileset["id"]: fileset["files"]
+                                   for fileset in json.load(f)["filesets"]}
+        files = self.__filesets.get(fileset_id, None)
+        if files == None:
+            return None
+        return [FsdbFile(f["id"], f["file"],
+                         os.path.join(self.__path, fileset_id, f["file"]),
+                         os.path.join(self.__path, "metadata", fileset_id,
+                                      "%s.json" % f["id"]))
+                for f in files]
+
+
+class ImportStats():
+    """The number of files and bytes imported, and the time it took."""
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+
+    def __str__(self):
+        elapsed = max(self.elapsed, 1e-9)
+        return ("%d files, %.1f MB in %.1f s: %.1f files/s, %.1f MB/s"
+                % (self.files, self.bytes / 1e6, self.elapsed,
+                   self.files / elapsed, self.bytes / 1e6 / elapsed))
+
+
+class ScanImporter():
+    """Class importing the scans of a FSDB directory into a database.
+
+    Attributes
+    ----------
+    db : IDatabase
+        The database into which the scans are imported.
+    factory : IFactory
+        The factory of the database.
+    prototypes : IPrototypes
+        The prototypes of the scan path and the analyses.
+    farm : IFarm
+        The farm of the observation unit.
+    observation_unit : IObservationUnit
+        The crop that was scanned.
+    people : List[str]
+        The IDs or short names of the operators.
+    camera : str
+        The ID or short name of the camera.
+    scanning_device : str
+        The ID or short name of the scanning device.
+    scan_path : str
+        The short name of the prototype of the scan path.
+    workers : int
+        The number of threads that import the files.
+    dry_run : bool
+        Only read the source files, without changing the database.
+    progress : Callable
+        Called as progress(scan_id, done, total) while the files of a
+        scan are imported.
+
+    """
+    def __init__(self, db: IDatabase, factory: IFactory, prototypes: IPrototypes,
+                 farm: IFarm, observation_unit: IObservationUnit,
+                 people: List[str], camera: str, scanning_device: str,
+                 scan_path: str, workers: int = 8, dry_run: bool = False,
+                 progress: Callable = None):
+        self.__db = db
+        self.__factory = factory
+        self.__proto = prototypes
+        self.__farm = farm
+        self.__crop = observation_unit
+        self.__people = people
+        self.__camera = camera
+        self.__scanning_device = scanning_device
+        self.__scan_path = prototypes.get_scan_path(scan_path)
+        if self.__scan_path == None:
+            raise ValueError("Can't find scanning path with name %s" % scan_path)
+        self.__workers = workers
+        self.__dry_run = dry_run
+        self.__progress = progress
+        self.__plants = {}
+
+    def import_scans(self, basedir: str, scan_ids: List[str]) -> ImportStats:
+        """Imports the scans of the FSDB directory and returns the
+        statistics of the import. Unknown scans are skipped."""
+        stats = ImportStats()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(self.__workers) as executor:
+            for scan_id in scan_ids:
+                fsdb_scan = FsdbScan(basedir, scan_id)
+                if not fsdb_scan.exists():
+                    logger.warning("Didn't find scan %s: skipping", scan_id)
+                    continue
+                self.__import_scan(executor, fsdb_scan, stats)
+        stats.elapsed = time.perf_counter() - start
+        return stats
+
+    def __import_scan(self, executor, fsdb_scan: FsdbScan,
+                      stats: ImportStats) -> None:
+        images = fsdb_scan.get_files("images")
+        if images == None:
+            images = fsdb_scan.get_files("raw_data")
+        if images == None:
+            raise ValueError("Can't find images directory")
+        maps = fsdb_scan.get_files("maps") or []
+        plants = fsdb_scan.get_files("individual_plants") or []
+
+        scan = stitching = plant_analysis = None
+        if not self.__dry_run:
+            scan = self.__new_scan(fsdb_scan)
+            stitching = self.__new_analysis("stitching", scan)
+            plant_analysis = self.__new_analysis("plant_analysis", scan)
+
+        jobs = ([("scan", scan, f) for f in images]
+                + [("maps", stitching, f) for f in maps]
+                + [("individual_plants", plant_analysis, f) for f in plants])
+        results = []
+        for i, result in enumerate(executor.map(self.__import_file, jobs)):
+            results.append(result)
+            stats.files += 1
+            stats.bytes += result["size"]
+            if self.__progress != None:
+                self.__progress(fsdb_scan.id, i + 1, len(jobs))
+
+        if not self.__dry_run:
+            n = len(images) + len(maps)
+            self.__store_stitching(scan, stitching, results[len(images):n])
+            self.__store_plant_analysis(scan, plant_analysis, results[n:])
+            count("fsdbimport.scans")
+
+    def __new_scan(self, fsdb_scan: FsdbScan) -> IScan:
+        scan = new_scan(self.__db, self.__factory, self.__crop.id, self.__people,
+                        self.__camera, self.__scanning_device, self.__scan_path)
+        d = fsdb_scan.metadata("date")
+        if d:
+            scan.date = datetime(int(d[0:4]), int(d[4:6]), int(d[6:8]),
+                                 12).astimezone()
+        scan.store()
+        return scan
+
+    def __new_analysis(self, short_name: str, scan: IScan) -> IAnalysis:
+        analysis = self.__proto.get_analysis(short_name)
+        analysis.observation_unit = self.__crop
+        analysis.scan = scan
+        analysis.state = IAnalysis.STATE_FINISHED
+        return analysis
+
+    def __import_file(self, job: tuple) -> dict:
+        """Imports one file, in a worker thread, and returns its size,
+        the ID of the new file, and its metadata."""
+        kind, source, f = job
+        result = { "id": f.id, "filename": f.filename,
+                   "size": os.path.getsize(f.path) }
+        if kind != "scan":
+            result["width"], result["height"] = image_size(f.path)
+        if kind == "individual_plants":
+            result["metadata"] = f.metadata()
+        if self.__dry_run:
+            with open(f.path, "rb") as stream:
+                while stream.read(CHUNK_SIZE):
+                    pass
+            return result
+        result["file"] = self.__db.new_file_from_path(*self.__file_args(kind, source, f),
+                                                      f.path)
+        count("fsdbimport.files")
+        return result
+
+    def __file_args(self, kind: str, source, f: FsdbFile) -> tuple:
+        if kind == "scan":
+            return (self.__farm.id, "scan", source.id, f.id,
+                    self.__db.scan_filepath(source, f.id, "jpg"), "image/jpeg")
+        if kind == "maps":
+            task = source.tasks[0]
+        else:
+            task = source.get_task("map_segmentation")
+        return (self.__farm.id, task.short_name, task.id, f.id,
+                self.__db.analysis_filepath(source, f.id, "png"), "image/png")
+
+    def __store_results(self, analysis: IAnalysis, results: dict) -> None:
+        self.__db.store(analysis)
+        relpath = self.__db.analysis_filepath(analysis, "results", "json")
+        output_file = self.__db.new_file(self.__farm.id, analysis.short_name,
+                                         analysis.id, "results", relpath,
+                                         "application/json")
+        self.__db.file_store_text(output_file, json.dumps(results, indent=4))
+        self.__crop.add_analysis(analysis)
+        analysis.scan.add_analysis(analysis)
+
+    def __store_stitching(self, scan: IScan, stitching: IAnalysis,
+                          maps: List[dict]) -> None:
+        results = {}
+        for m in maps:
+            results[m["id"]] = m["file"].id
+            if m["id"] == "map":
+                results["width"] = m["width"]
+                results["height"] = m["height"]
+        self.__store_results(stitching, results)
+
+    def __plant(self, file_id: str) -> IObservationUnit:
+        plant = self.__plants.get(file_id, None)
+        if plant == None:
+            plant = self.__factory.create("ObservationUnit", {
+                "type" : "plant",
+                "short_name" : "%s-plant-%s" % (self.__crop.short_name, file_id),
+                "context" : self.__farm.id,
+                "zone" : self.__crop.zone.id
+            })
+            self.__crop.add_child(plant)
+            self.__farm.add_observation_unit(plant)
+            self.__plants[file_id] = plant
+            plant.store()
+        return plant
+
+    def __store_plant_analysis(self, scan: IScan, analysis: IAnalysis,
+                               files: List[dict]) -> None:
+        plants = {}
+        for f in files:
+            file_id = f["id"]
+            if "mask" in file_id:
+                file_id = file_id.split("_")[0]
+            entry = plants.setdefault(file_id, {})
+            plant = self.__plant(file_id)
+            if "mask" in f["filename"]:
+                entry["mask"] = f["file"].id
+            else:
+                entry["observation_unit"] = plant.id
+                entry["image"] = f["file"].id
+                entry["location"] = f["metadata"]["loc"]
+                entry["id"] = f["metadata"]["id"]
+                entry["PLA"] = f["metadata"]["PLA"]
+                entry["width"] = f["width"]
+                entry["height"] = f["height"]
+        self.__store_results(analysis, { "plants": list(plants.values()) })
@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""romidata2.geometry
+==================
+
+Provides functions to read and write point clouds and triangle meshes
+in the PLY format, and to decimate them. The decimation uses a voxel
+grid: all the vertices that fall into the same voxel are replaced by
+their average. For meshes, the faces are remapped onto the merged
+vertices and the faces that collapsed are removed (vertex
+clustering). The voxel size can be chosen to reach a target vertex
+count.
+
+All computations use vectorized numpy operations. The decimated
+geometry is written as little-endian binary PLY with 32-bit float
+coordinates, 8-bit colors, and 32-bit face indices.
+
+Examples
+--------
+>>> from romidata2.geometry import read_ply, read_ply_stream, write_ply, decimate
+>>> geometry = read_ply(data)
+>>> with open("pointcloud.ply", "rb") as f:
+...     geometry = read_ply_stream(f)
+>>> small = decimate(geometry, 10000)
+>>> binary = write_ply(small)
+
+"""
+from io import BytesIO
+
+import numpy as np
+
+__author__ = "Peter Hanappe"
+__copyright__ = "Copyright 2020, Sony Computer Science Laboratories"
+__credits__ = ["Peter Hanappe"]
+__license__ = "Affero General Public License"
+__version__ = "3"
+__maintainer__ = "Peter Hanappe"
+__email__ = "peter@hanappe.com"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+
+PLY_TYPES = {
+    "char": "i1", "int8": "i1",
+    "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2",
+    "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4",
+    "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4",
+    "double": "f8", "float64": "f8"
+}
+
+# The number of vertices or faces that are read at once from a PLY file
+CHUNK_ROWS = 65536
+
+
+class Geometry():
+    """A point cloud or a triangle mesh.
+
+    Attributes
+    ----------
+    vertices : numpy.ndarray
+        The vertex coordinates, an array of shape (N, 3) and type float32.
+    colors : numpy.ndarray
+        The vertex colors, an array of shape (N, 3) and type uint8, or None.
+    faces : numpy.ndarray
+        The vertex indices of the triangles, an array of shape (M, 3)
+        and type int32, or None for point clouds.
+
+    """
+    def __init__(self, vertices, colors=None, faces=None):
+        self.vertices = vertices
+        self.colors = colors
+        self.faces = faces
+
+    @property
+    def vertex_count(self) -> int:
+        return len(self.vertices)
+
+    @property
+    def is_mesh(self) -> bool:
+        return self.faces is not None
+
+
+class _Reader():
+    """Reads a binary file object, and keeps the bytes that were read
+    ahead so that they can be read again."""
+    def __init__(self, f):
+        self.__f = f
+        self.__pending = b""
+
+    def read(self, size: int) -> bytes:
+        data = self.__pending[:size]
+        self.__pending = self.__pending[size:]
+        if len(data) < size:
+            data += self.__f.read(size - len(data))
+        return data
+
+    def unread(self, data: bytes) -> None:
+        self.__pending = data + self.__pending
+
+
+def _read_header(f):
+    if f.readline().strip() != b"ply":
+        raise ValueError("Not a PLY file")
+    fmt = None
+    elements = []
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError("Not a PLY file")
+        words = line.decode("ascii").split()
+        if len(words) == 0:
+            continue
+        if words[0] == "end_header":
+            break
+        if words[0] == "format":
+            fmt = words[1]
+        elif words[0] == "element":
+            elements.append({"name": words[1], "count": int(words[2]),
+                             "properties": []})
+        elif words[0] == "property":
+            if words[1] == "list":
+                elements[-1]["properties"].append((words[4], "list",
+                                                   PLY_TYPES[words[2]],
+                                                   PLY_TYPES[words[3]]))
+            else:
+                elements[-1]["properties"].append((words[2], PLY_TYPES[words[1]]))
+    if not fmt in ["ascii", "binary_little_endian", "binary_big_endian"]:
+        raise ValueError("Unsupported PLY format: %s" % fmt)
+    return fmt, elements
+
+
+def _vertex_columns(array, names):
+    vertices = np.stack([array["x"], array["y"], array["z"]],
+                        axis=-1).astype(np.float32)
+    colors = None
+    if "red" in names and "green" in names and "blue" in names:
+        colors = np.stack([array["red"], array["green"], array["blue"]],
+                          axis=-1).astype(np.uint8)
+    return vertices, colors
+
+
+class _VertexColumns():
+    """Collects the vertices and colors of the successive chunks of
+    the vertex element into preallocated arrays."""
+    def __init__(self, count, names):
+        self.vertices = np.empty((count, 3), dtype=np.float32)
+        self.colors = None
+        if "red" in names and "green" in names and "blue" in names:
+            self.colors = np.empty((count, 3), dtype=np.uint8)
+        self.__names = names
+        self.__size = 0
+
+    def add(self, array):
+        vertices, colors = _vertex_columns(array, self.__names)
+        end = self.__size + len(vertices)
+        self.vertices[self.__size:end] = vertices
+        if self.colors is not None:
+            self.colors[self.__size:end] = colors
+        self.__size = end
+
+
+def _triangulate(polygon):
+    n = len(polygon)
+    if n < 3:
+        return np.empty((0, 3), dtype=np.int32)
+    return np.stack([np.full(n - 2, polygon[0]), polygon[1:-1], polygon[2:]],
+                    axis=-1)
+
+
+def _read_binary(reader, elements, byteorder):
+    vertices, colors, faces = None, None, None
+    for element in elements:
+        props = element["properties"]
+        count = element["count"]
+        if all(len(p) == 2 for p in props):
+            dtype = np.dtype([(p[0], byteorder + p[1]) for p in props])
+            columns = None
+            if element["name"] == "vertex":
+                columns = _VertexColumns(count, dtype.names)
+            for start in range(0, count, CHUNK_ROWS):
+                rows = min(CHUNK_ROWS, count - start)
+                data = reader.read(rows * dtype.itemsize)
+                if len(data) < rows * dtype.itemsize:
+                    raise ValueError("Truncated PLY file")
+                if columns != None:
+                    columns.add(np.frombuffer(data, dtype=dtype))
+            if columns != None:
+                vertices, colors = columns.vertices, columns.colors
+        elif len(props) == 1 and props[0][1] == "list":
+            name, _, count_type, index_type = props[0]
+            triangles = _read_binary_polygons(reader, count,
+                                              byteorder + count_type,
+                                              byteorder + index_type)
+            if element["name"] == "face":
+                faces = triangles
+        else:
+            raise ValueError("Unsupported PLY element: %s" % element["name"])
+    return vertices, colors, faces
+
+
+def _read_binary_polygons(reader, count, count_type, index_type):
+    """Reads the polygons in chunks that are assumed to hold triangles
+    only. The rows that follow the first polygon that is not a
+    triangle are put back, and that polygon is read on its own."""
+    dtype = np.dtype([("n", count_type), ("i", index_type, 3)])
+    count_size = np.dtype(count_type).itemsize
+    index_size = np.dtype(index_type).itemsize
+    parts = []
+    remaining = count
+    while remaining > 0:
+        size = min(CHUNK_ROWS, remaining)
+        data = reader.read(size * dtype.itemsize)
+        array = np.frombuffer(data, dtype=dtype, count=len(data) // dtype.itemsize)
+        others = np.flatnonzero(array["n"] != 3)
+        rows = len(array) if len(others) == 0 else int(others[0])
+        parts.append(array["i"][:rows])
+        reader.unread(data[rows * dtype.itemsize:])
+        remaining -= rows
+        if rows < size:
+            data = reader.read(count_size)
+            if len(data) < count_size:
+                raise ValueError("Truncated PLY file")
+            n = int(np.frombuffer(data, dtype=count_type)[0])
+            data = reader.read(n * index_size)
+            if len(data) < n * index_size:
+                raise ValueError("Truncated PLY file")
+            parts.append(_triangulate(np.frombuffer(data, dtype=index_type)))
+            remaining -= 1
+    if len(parts) == 0:
+        return np.empty((0, 3), dtype=np.int32)
+    return np.concatenate(parts).astype(np.int32)
+
+
+def _read_ascii_rows(f, count):
+    rows = []
+    while len(rows) < count:
+        line = f.readline()
+        if not line:
+            raise ValueError("Truncated PLY file")
+        line = line.strip()
+        if line:
+            rows.append(line.decode("ascii"))
+    return rows
+
+
+def _read_ascii(f, elements):
+    vertices, colors, faces = None, None, None
+    for element in elements:
+        props = element["properties"]
+        count = element["count"]
+        if element["name"] == "vertex":
+            names = [p[0] for p in props]
+            columns = _VertexColumns(count, names)
+            for start in range(0, count, CHUNK_ROWS):
+                rows = _read_ascii_rows(f, min(CHUNK_ROWS, count - start))
+                values = np.array(" ".join(rows).split(), dtype=np.float64)
+                values = values.reshape((len(rows), len(names)))
+                columns.add({name: values[:, i] for i, name in enumerate(names)})
+            vertices, colors = columns.vertices, columns.colors
+        elif element["name"] == "face":
+            parts = []
+            for row in _read_ascii_rows(f, count):
+                polygon = [int(v) for v in row.split()]
+                parts.append(_triangulate(np.array(polygon[1:polygon[0] + 1])))
+            faces = np.concatenate(parts + [np.empty((0, 3))]).astype(np.int32)
+        else:
+            _read_ascii_rows(f, count)
+    return vertices, colors, faces
+
+
+def read_ply_stream(f) -> Geometry:
+    """Parses a PLY file from a binary file object. The file is read in
+    chunks of CHUNK_ROWS vertices or faces, so that only the geometry
+    that is kept is held in memory, and not the whole file.
+
+    Polygons with more than three vertices are split into triangles. Only
+    the vertex coordinates, the vertex colors, and the faces are kept.
+
+    Parameters
+    ----------
+    f: file object
+        The PLY file, opened in binary mode
+
+    """
+    fmt, elements = _read_header(f)
+    if fmt == "ascii":
+        vertices, colors, faces = _read_ascii(f, elements)
+    else:
+        byteorder = "<" if fmt == "binary_little_endian" else ">"
+        vertices, colors, faces = _read_binary(_Reader(f), elements, byteorder)
+    if vertices is None:
+        raise ValueError("The PLY file has no vertices")
+    return Geometry(vertices, colors, faces)
+
+
+def read_ply(data: bytes) -> Geometry:
+    """Parses the contents of a PLY file. See read_ply_stream().
+
+    Parameters
+    ----------
+    data: bytes
+        The contents of the PLY file
+
+    """
+    return read_ply_stream(BytesIO(data))
+
+
+def write_ply(geometry: Geometry) -> bytes:
+    """Encodes the geometry as a little-endian binary PLY file.
+
+    Parameters
+    ----------
+    geometry: Geometry
+        The point cloud or mesh
+
+    """
+    n = geometry.vertex_count
+    header = ["ply", "format binary_little_endian 1.0",
+              "element vertex %d" % n,
+              "property float x", "property float y", "property float z"]
+    fields = [("xyz", "<f4", 3)]
+    if geometry.colors is not None:
+        header += ["property uchar red", "property uchar green",
+                   "property uchar blue"]
+        fields.append(("rgb", "u1", 3))
+    if geometry.is_mesh:
+        header += ["element face %d" % len(geometry.faces),
+                   "property list uchar int vertex_indices"]
+    header.append("end_header")
+    vertices = np.empty(n, dtype=np.dtype(fields))
+    vertices["xyz"] = geometry.vertices
+    if geometry.colors is not None:
+        vertices["rgb"] = geometry.colors
+    parts = [("\n".join(header) + "\n").encode("ascii"), vertices.tobytes()]
+    if geometry.is_mesh:
+        faces = np.empty(len(geometry.faces),
+                         dtype=np.dtype([("n", "u1"), ("i", "<i4", 3)]))
+        faces["n"] = 3
+        faces["i"] = geometry.faces
+        parts.append(faces.tobytes())
+    return b"".join(parts)
+
+
+def _voxel_labels(vertices, voxel_size):
+    """Returns, for each vertex, the index of its voxel in the list of
+    occupied voxels, and the number of occupied voxels."""
+    origin = vertices.min(axis=0)
+    cells = np.floor((vertices - origin) / voxel_size).astype(np.int64)
+    dims = cells.max(axis=0) + 1
+    keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+    unique, labels = np.unique(keys, return_inverse=True)
+    return labels.reshape(-1), len(unique)
+
+
+def _find_voxel_size(vertices, target: int):
+    """Searches the voxel size for which the number of occupied voxels is
+    as close as possible to, but not above, the target count."""
+    extent = float(np.max(vertices.max(axis=0) - vertices.min(axis=0)))
+    if extent == 0.0:
+        return 1.0
+    low, high = extent / len(vertices) / 16.0, extent * 2.0
+    best = high
+    for i in range(24):
+        size = np.sqrt(low * high)
+        labels, count = _voxel_labels(vertices, size)
+        if count > target:
+            low = size
+        else:
+            best = size
+            high = size
+            if count >= 0.95 * target:
+                break
+    return best
+
+
+def voxel_downsample(geometry: Geometry, voxel_size: float) -> Geometry:
+    """Merges all the vertices that fall into the same voxel.
+
+    The merged vertex is placed at the average position (and color) of
+    the vertices in the voxel. The faces of a mesh are remapped onto
+    the merged vertices, and degenerate and duplicate faces are
+    removed.
+
+    Parameters
+    ----------
+    geometry: Geometry
+        The point cloud or mesh
+    voxel_size: float
+        The size of the edges of the voxels
+
+    """
+    vertices = geometry.vertices.astype(np.float64)
+    labels, count = _voxel_labels(vertices, voxel_size)
+    weights = np.bincount(labels, minlength=count).astype(np.float64)
+    merged = np.empty((count, 3), dtype=np.float32)
+    for axis in range(3):
+        merged[:, axis] = np.bincount(labels, vertices[:, axis], count) / weights
+    colors = None
+    if geometry.colors is not None:
+        colors = np.empty((count, 3), dtype=np.uint8)
+        for channel in range(3):
+            sums = np.bincount(labels, geometry.colors[:, channel], count)
+            colors[:, channel] = np.round(sums / weights)
+    faces = None
+    if geometry.is_mesh:
+        faces = labels[geometry.faces].astype(np.int32)
+        valid = ((faces[:, 0] != faces[:, 1])
+                 & (faces[:, 1] != faces[:, 2])
+                 & (faces[:, 0] != faces[:, 2]))
+        faces = faces[valid]
+        if len(faces) > 0:
+            _, first = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+            faces = faces[np.sort(first)]
+    return Geometry(merged, colors, faces)
+
+
+def decimate(geometry: Geometry, max_vertices: int) -> Geometry:
+    """Reduces the number of vertices to at most max_vertices using a
+    voxel grid. The geometry is returned unchanged if it is already
+    small enough.
+
+    Parameters
+    ----------
+    geometry: Geometry
+        The point cloud or mesh
+    max_vertices: int
+        The target number of vertices
+
+    """
+    if geometry.vertex_count <= max_vertices:
+        return geometry
+    voxel_size = _find_voxel_size(geometry.vertices.astype(np.float64),
+                                   max_vertices)
+    return voxel_downsample(geometry, voxel_size)
@@ -7,13 +7,17 @@ Provides the default implementation of the data objects used in romidata2.
 
 """
 from abc import ABC, abstractmethod
-from typing import List, Any
+from typing import List, Any, Iterator
 import copy
+import sys
 import random
 import string
 import uuid
+import types
 from datetime import datetime
 import functools
+import operator
+import logging
 
 from tzlocal import get_localzone
 import dateutil.parser
@@ -31,6 +35,8 @@ __email__ = "peter@hanappe.com"
 __status__ = "Prototype"
 __version__ = "0.0.1"
 
+logger = logging.getLogger(__name__)
+
 
 def new_id() -> str:
     """Generates a new random ID."""
@@ -42,6 +48,17 @@ def current_date() -> datetime:
     tz = get_localzone()
     return tz.localize(datetime.now())
 
+
+def parse_date(value: str) -> datetime:
+    """Parses a date. The dates stored by romidata2 are in ISO 8601 format,
+    which is parsed much faster by datetime than by dateutil. Other
+    formats are handed to dateutil.
+    """
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return dateutil.parser.parse(value)
+
         
 def lookup_id_list(db: IDatabase, array: List[str]) -> List[Any]:
     r = []
@@ -64,9 +81,133 @@ def find(given_value: str, array: List[Any], attr: str):
     return r
 
 
+def iter_page(array: List[Any], positions: dict, after: str = None,
+              limit: int = None) -> Iterator[Any]:
+    """Iterates over at most 'limit' elements of the array, starting after
+    the element with the ID 'after'. The positions dictionary maps the
+    IDs of the elements to their index in the array.
+    """
+    start = 0
+    if after:
+        if not after in positions:
+            raise ValueError("ID with value %s is not in the list" % after)
+        start = positions[after] + 1
+    stop = len(array) if limit == None else start + limit
+    return iter(array[start:stop])
+
+
+def append_unique(obj: Any, array: List[Any], positions: dict) -> bool:
+    """Appends the object to the array unless an object with the same ID
+    is already present. Returns True if the object was appended.
+    """
+    if obj.id in positions:
+        return False
+    positions[obj.id] = len(array)
+    array.append(obj)
+    return True
+
+
+def copy_values(value: Any) -> Any:
+    """Copies a JSON-like value: dictionaries and lists are copied
+    recursively, other values are immutable and are shared.
+    """
+    if isinstance(value, dict):
+        return {k: copy_values(v) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [copy_values(v) for v in value]
+    else:
+        return value
+
+
+# The slots of the classes, see copy_slots()
+_slots = {}
+
+def copy_slots(obj: Any, copy: Any) -> None:
+    """Copies the values of the slots of an object, including those
+    declared by its base classes, to another object of the same class.
+    """
+    cls = type(obj)
+    slots = _slots.get(cls)
+    if slots == None:
+        descriptors = tuple(value for klass in cls.__mro__
+                            for value in vars(klass).values()
+                            if isinstance(value, types.MemberDescriptorType))
+        getter = operator.attrgetter(*[d.__name__ for d in descriptors])
+        slots = _slots[cls] = (descriptors, getter)
+    descriptors, getter = slots
+    try:
+        values = getter(obj)
+    except AttributeError:
+        # Some slots were never set: copy them one by one
+        values = [getattr(obj, d.__name__, copy_slots) for d in descriptors]
+    for descriptor, value in zip(descriptors, values):
+        if value is not copy_slots:
+            descriptor.__set__(copy, value)
+
+
+class Resolver(IResolver):
+    """The default implementation of IResolver.
+
+    Without a map of objects, the IDs are looked up in the database.
+    The database itself creates a resolver with the map of all the
+    objects it loaded: the IDs are looked up in the map only, so that
+    linking never reads from disk.
+
+    The references that could not be resolved are collected in
+    'dangling', as (classname, id, field, missing ID) tuples.
+    """
+    def __init__(self, database: IDatabase, objects: dict = None):
+        self.__database = database
+        self.__objects = objects
+        self.__dangling = []
+
+    @property
+    def dangling(self) -> List[tuple]:
+        return self.__dangling
+
+    def __missing(self, obj: Any, field: str, obj_id: str) -> None:
+        self.__dangling.append((obj.classname, obj.id, field, obj_id))
+
+    def lookup(self, obj: Any, field: str, obj_id: str) -> Any:
+        if not obj_id:
+            return None
+        if self.__objects != None:
+            r = self.__objects.get(obj_id)
+        else:
+            r = self.__database.lookup(obj_id)
+        if r == None:
+            self.__missing(obj, field, obj_id)
+        return r
+
+    def lookup_list(self, obj: Any, field: str, obj_ids: List[str]) -> List[Any]:
+        r = []
+        for obj_id in obj_ids:
+            value = self.lookup(obj, field, obj_id)
+            if value != None:
+                r.append(value)
+        return r
+
+    def get_file(self, obj: Any, field: str, file_id: str) -> Any:
+        if not file_id:
+            return None
+        r = self.__database.get_file(file_id)
+        if r == None:
+            self.__missing(obj, field, file_id)
+        return r
+
+    def select_files(self, source_name: str, source_id: str,
+                     short_name: str) -> List[Any]:
+        return self.__database.select_files(source_name, source_id, short_name)
+
+
 class BaseImpl():
+    __slots__ = ("__id", "__classname", "__modified", "__factory",
+                 "__database")
+
     def __init__(self, factory, database, classname):
-        self.__id = new_id()
+        # The ID is generated when it is first used: most objects
+        # are created with the ID found in their properties.
+        self.__id = None
         self.__classname = classname
         self.__modified = False
         self.__factory = factory
@@ -85,6 +226,8 @@ class BaseImpl():
         
     @property
     def id(self) -> str:
+        if self.__id == None:
+            self.__id = new_id()
         return self.__id
 
     @id.setter
@@ -109,15 +252,38 @@ class BaseImpl():
         return self.__database
 
     def clone(self):
-        c = copy.deepcopy(self)
-        c.__id = new_id()
+        """Returns a copy of the object with a new ID.
+
+        The copy is shallow: it refers to the same factory, database,
+        and linked objects (owner, observation unit, ...) as the
+        original. Classes that own mutable values, such as lists,
+        dictionaries, or parameters, extend clone() to copy them.
+        """
+        c = object.__new__(type(self))
+        copy_slots(self, c)
+        c.__id = None
         c.__modified = True
         return c
     
     def store(self) -> None:
         self.database.store(self)
 
-    def restore(self) -> None:
+    @classmethod
+    def allocate(cls, factory, database, classname, properties: dict):
+        """Returns a new instance of the class with the attributes of
+        BaseImpl set as by __init__() and parse(), without calling
+        them. The fast constructors of the classes (see
+        DefaultFactory.FAST_CONSTRUCTORS) set the other attributes
+        themselves."""
+        obj = object.__new__(cls)
+        obj.__id = properties.get('id')
+        obj.__classname = classname
+        obj.__modified = True
+        obj.__factory = factory
+        obj.__database = database
+        return obj
+
+    def restore(self, resolver: IResolver = None) -> None:
         pass
 
     @modifies
@@ -130,9 +296,14 @@ class BaseImpl():
 
     
 class File(BaseImpl, IFile):
-    
+    __slots__ = ("__owner_id", "__source_name", "__source_id", "__short_name",
+                 "__date_created", "__path", "__mimetype",
+                 "parent")
+
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
+        # Set by the study or investigation that contains the object
+        self.parent = None
         self.__owner_id = ""
         self.__source_name = ""
         self.__source_id = ""
@@ -203,13 +374,30 @@ class File(BaseImpl, IFile):
         
     def parse(self, properties: dict):
         super().parse(properties)
-        self.__owner_id = properties["owner"]
-        self.source_name = properties["source_name"]
-        self.source_id = properties["source_id"]
+        # The owner, source, and mimetype are shared by many files:
+        # intern them to keep a single copy of each string.
+        self.__owner_id = sys.intern(properties["owner"])
+        self.source_name = sys.intern(properties["source_name"])
+        self.source_id = sys.intern(properties["source_id"])
         self.short_name = properties["short_name"]
-        self.date_created = dateutil.parser.parse(properties["date_created"])
+        self.date_created = parse_date(properties["date_created"])
         self.path = properties["path"]
-        self.mimetype = properties["mimetype"]
+        self.mimetype = sys.intern(properties["mimetype"])
+
+    @classmethod
+    def from_properties(cls, factory, database, classname, properties: dict):
+        """Creates a file from its properties, as __init__() and parse()
+        do, but without the wrappers of the setters."""
+        obj = cls.allocate(factory, database, classname, properties)
+        obj.parent = None
+        obj.__owner_id = sys.intern(properties["owner"])
+        obj.__source_name = sys.intern(properties["source_name"])
+        obj.__source_id = sys.intern(properties["source_id"])
+        obj.__short_name = properties["short_name"]
+        obj.__date_created = parse_date(properties["date_created"])
+        obj.__path = properties["path"]
+        obj.__mimetype = sys.intern(properties["mimetype"])
+        return obj
 
     def serialize(self) -> dict:
         return { 'id': self.id,
@@ -223,7 +411,9 @@ class File(BaseImpl, IFile):
 
 
 class Person(BaseImpl, IPerson):
-    
+    __slots__ = ("__short_name", "__name", "__email", "__affiliation",
+                 "__role")
+
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
         self.__short_name = ""
@@ -295,7 +485,10 @@ class Person(BaseImpl, IPerson):
 
     
 class Camera(BaseImpl, ICamera):
-    
+    __slots__ = ("__short_name", "__name", "__description", "__lens",
+                 "__owner", "__owner_id", "__software_module",
+                 "__parameters")
+
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
         self.__short_name = ""
@@ -374,9 +567,11 @@ class Camera(BaseImpl, ICamera):
         c.__owner = None
         return c;
     
-    def restore(self) -> None:
-        self.__owner = self.database.lookup(self.__owner_id)
-        self.__owner.add_camera(self)
+    def restore(self, resolver: IResolver = None) -> None:
+        resolver = resolver or Resolver(self.database)
+        self.__owner = resolver.lookup(self, "owner", self.__owner_id)
+        if self.__owner != None:
+            self.__owner.add_camera(self)
         
     def parse(self, properties: dict):
         super().parse(properties)
@@ -401,7 +596,9 @@ class Camera(BaseImpl, ICamera):
 
 
 class ScanningDevice(BaseImpl, IScanningDevice):
-    
+    __slots__ = ("__short_name", "__name", "__description", "__owner",
+                 "__owner_id", "__software_module", "__parameters")
+
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
         self.__short_name = ""
@@ -471,9 +668,11 @@ class ScanningDevice(BaseImpl, IScanningDevice):
         c.__owner = None
         return c; 
     
-    def restore(self) -> None:
-        self.__owner = self.database.lookup(self.__owner_id)
-        self.__owner.add_scanning_device(self)
+    def restore(self, resolver: IResolver = None) -> None:
+        resolver = resolver or Resolver(self.database)
+        self.__owner = resolver.lookup(self, "owner", self.__owner_id)
+        if self.__owner != None:
+            self.__owner.add_scanning_device(self)
        
     def parse(self, properties: dict):
         super().parse(properties)
@@ -496,7 +695,9 @@ class ScanningDevice(BaseImpl, IScanningDevice):
 
         
 class Sample(BaseImpl, ISample):
-    
+    __slots__ = ("__short_name", "__description", "__development_stage",
+                 "__anatomical_entity")
+
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
         self.__short_name = ""
@@ -557,7 +758,14 @@ class Sample(BaseImpl, ISample):
 
     
 class ObservationUnit(BaseImpl, IObservationUnit):
-    
+    __slots__ = ("__type", "__short_name", "__context", "__context_id",
+                 "__zone", "__zone_id", "__spatial_distribution",
+                 "__factor_values", "__samples", "__parent",
+                 "__parent_id", "__children", "__description_file",
+                 "__scans", "__analyses", "__datastreams", "__notes",
+                 "__positions",
+                 "__loader")
+
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
         self.__type = ""
@@ -577,6 +785,9 @@ class ObservationUnit(BaseImpl, IObservationUnit):
         self.__analyses = []
         self.__datastreams = []
         self.__notes = []
+        self.__positions = {"children": {}, "datastreams": {}, "scans": {},
+                            "analyses": {}, "notes": {}}
+        self.__loader = None
         
     @property
     def type(self) -> str:
@@ -647,72 +858,125 @@ class ObservationUnit(BaseImpl, IObservationUnit):
     def parent(self, value: Any) -> None:
         self.__parent = value
         self.__parent_id = value.id
-        print("ObservationUnit.parent '%s'" % self.__parent_id)
+        logger.debug("ObservationUnit.parent '%s'", self.__parent_id)
 
     @property
     def children(self) -> List[Any]:
+        self.__load_children()
         return self.__children
 
     def add_child(self, child: Any) -> None:
-        print("ObservationUnit.add_child")
-        if find(child.id, self.children, "id") == None:
-            self.children.append(child)
+        self.__load_children()
+        if append_unique(child, self.__children, self.__positions["children"]):
             child.parent = self
+
+    def iter_children(self, after: str = None, limit: int = None) -> Iterator[Any]:
+        self.__load_children()
+        return iter_page(self.__children, self.__positions["children"],
+                         after, limit)
             
     @property
     def datastreams(self) -> List[IDataStream]:
+        self.__load_children()
         return self.__datastreams
 
     def add_datastream(self, datastream: IDataStream):
-        if find(datastream.id, self.datastreams, "id") == None:
-            self.datastreams.append(datastream)
+        self.__load_children()
+        if append_unique(datastream, self.__datastreams,
+                         self.__positions["datastreams"]):
             datastream.observation_unit = self
+
+    def iter_datastreams(self, after: str = None,
+                         limit: int = None) -> Iterator[IDataStream]:
+        self.__load_children()
+        return iter_page(self.__datastreams, self.__positions["datastreams"],
+                         after, limit)
         
     @property
     def scans(self) -> List[Any]:
+        self.__load_children()
         return self.__scans
     
     def add_scan(self, scan: Any):
-        if find(scan.id, self.scans, "id") == None:
-            self.scans.append(scan)
+        self.__load_children()
+        if append_unique(scan, self.__scans, self.__positions["scans"]):
             scan.observation_unit = self
+
+    def iter_scans(self, after: str = None, limit: int = None) -> Iterator[Any]:
+        self.__load_children()
+        return iter_page(self.__scans, self.__positions["scans"],
+                         after, limit)
             
     @property
     def analyses(self) -> List[IAnalysis]:
+        self.__load_children()
         return self.__analyses
         
     def add_analysis(self, analysis: IAnalysis):
-        if find(analysis.id, self.analyses, "id") == None:
-            self.analyses.append(analysis)
+        self.__load_children()
+        append_unique(analysis, self.__analyses, self.__positions["analyses"])
+
+    def iter_analyses(self, after: str = None,
+                      limit: int = None) -> Iterator[IAnalysis]:
+        self.__load_children()
+        return iter_page(self.__analyses, self.__positions["analyses"],
+                         after, limit)
     
     @property
     def notes(self) -> List[INote]:
+        self.__load_children()
         return self.__notes
         
     def add_note(self, note: INote):
-        if find(note.id, self.notes, "id") == None:
+        self.__load_children()
+        if not note.id in self.__positions["notes"]:
             note.observation_unit = self
-            self.notes.append(note)
+            append_unique(note, self.__notes, self.__positions["notes"])
+
+    def iter_notes(self, after: str = None, limit: int = None) -> Iterator[INote]:
+        self.__load_children()
+        return iter_page(self.__notes, self.__positions["notes"],
+                         after, limit)
+
+    def defer_children(self, loader: Any = None) -> None:
+        """Defers the linking of the objects that add themselves to this
+        one when they are restored (see romidata2.snapshot). The
+        loader is called with this object before the objects are
+        first accessed or added to, and calls defer_children(None)
+        once they are linked."""
+        self.__loader = loader
+
+    def __load_children(self) -> None:
+        if self.__loader != None:
+            self.__loader(self)
 
     ##
 
-    def restore(self) -> None:
-        self.__context = self.database.lookup(self.__context_id)
-        self.__context.add_observation_unit(self)
-        if self.__zone_id:
-            self.__zone = self.database.lookup(self.__zone_id)
+    def restore(self, resolver: IResolver = None) -> None:
+        resolver = resolver or Resolver(self.database)
+        self.__context = resolver.lookup(self, "context", self.__context_id)
+        if self.__context != None:
+            self.__context.add_observation_unit(self)
+        self.__zone = resolver.lookup(self, "zone", self.__zone_id)
+        if self.__zone != None:
             self.__zone.add_observation_unit(self)
-        print("ObservationUnit.restore: parent='%s'" % self.__parent_id)
-        if self.__parent_id:
-            self.__parent = self.database.lookup(self.__parent_id)
+        logger.debug("ObservationUnit.restore: parent='%s'", self.__parent_id)
+        self.__parent = resolver.lookup(self, "parent", self.__parent_id)
+        if self.__parent != None:
             self.__parent.add_child(self)
             
     def clone(self):
         c = super().clone()
+        c.__factor_values = copy_values(self.__factor_values)
         c.__samples = [v.clone() for v in self.samples]
+        c.__children = []
         c.__scans = []
         c.__analyses = []
         c.__datastreams = []
+        c.__notes = []
+        c.__loader = None
+        c.__positions = {"children": {}, "datastreams": {}, "scans": {},
+                         "analyses": {}, "notes": {}}
         return c
     
     def parse(self, properties: dict):
@@ -734,7 +998,6 @@ class ObservationUnit(BaseImpl, IObservationUnit):
             self.__samples = []
         
     def serialize(self) -> dict:
-        print("ObservationUnit.serialize: parent '%s'" % self.__parent_id)
         return { 'id': self.id,
                  'type': self.type,
                  'short_name': self.short_name,
@@ -748,7 +1011,9 @@ class ObservationUnit(BaseImpl, IObservationUnit):
 
     
 class BiologicalMaterial(BaseImpl, IBiologicalMaterial):
-    
+    __slots__ = ("__short_name", "__description", "__genus", "__species",
+                 "__intraspecific_name", "__source_id", "__source_doi")
+
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
         self.__short_name = ""
@@ -842,13 +1107,15 @@ class BiologicalMaterial(BaseImpl, IBiologicalMaterial):
 
         
 class Pose(BaseImpl, IPose):
-    
+    __slots__ = ()
+
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
 
     
 class Observable(BaseImpl, IObservable):
-    
+    __slots__ = ("__uri", "__name")
+
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
         self.__uri = ""
@@ -872,7 +1139,8 @@ class Observable(BaseImpl, IObservable):
 
         
 class Unit(BaseImpl, IUnit):
-    
+    __slots__ = ("__uri", "__name")
+
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
         self.__uri = ""
@@ -896,7 +1164,9 @@ class Unit(BaseImpl, IUnit):
 
         
 class Note(BaseImpl, INote):
-        
+    __slots__ = ("__author", "__author_id", "__observation_unit",
+                 "__observation_unit_id", "__date", "__type", "__text")
+
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
         self.__author = None
@@ -937,18 +1207,35 @@ class Note(BaseImpl, INote):
     def text(self) -> str:
         return self.__text
 
-    def restore(self) -> None:
-        self.__author = self.database.lookup(self.__author_id)
-        self.__observation_unit = self.database.lookup(self.__observation_unit_id)
-        self.__observation_unit.add_note(self)
+    def restore(self, resolver: IResolver = None) -> None:
+        resolver = resolver or Resolver(self.database)
+        self.__author = resolver.lookup(self, "author", self.__author_id)
+        self.__observation_unit = resolver.lookup(self, "observation_unit",
+                                                  self.__observation_unit_id)
+        if self.__observation_unit != None:
+            self.__observation_unit.add_note(self)
         
     def parse(self, properties: dict):
         super().parse(properties)
         self.__author_id = properties["author"]
         self.__observation_unit_id = properties["observation_unit"]
-        self.__date = dateutil.parser.parse(properties["date"])
+        self.__date = parse_date(properties["date"])
         self.__type = properties["type"]
         self.__text = properties["text"]
+
+    @classmethod
+    def from_properties(cls, factory, database, classname, properties: dict):
+        """Creates a note from its properties, as __init__() and parse()
+        do, but without the wrappers of parse()."""
+        obj = cls.allocate(factory, database, classname, properties)
+        obj.__author = None
+        obj.__author_id = properties["author"]
+        obj.__observation_unit = None
+        obj.__observation_unit_id = properties["observation_unit"]
+        obj.__date = parse_date(properties["date"])
+        obj.__type = properties["type"]
+        obj.__text = properties["text"]
+        return obj
         
     def serialize(self) -> dict:
         return { 'id': self.id,
@@ -961,7 +1248,9 @@ class Note(BaseImpl, INote):
 
     
 class DataStream(BaseImpl, IDataStream):
-    
+    __slots__ = ("__observation_unit", "__observation_unit_id",
+                 "__observable", "__unit", "__file", "__file_id")
+
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
         self.__observation_unit = None
@@ -1018,10 +1307,13 @@ class DataStream(BaseImpl, IDataStream):
 
     ##
     
-    def restore(self) -> None:
-        self.__observation_unit = self.database.lookup(self.__observation_unit_id)
-        self.__observation_unit.add_datastream(self)
-        self.__file = self.database.get_file(self.__file_id)
+    def restore(self, resolver: IResolver = None) -> None:
+        resolver = resolver or Resolver(self.database)
+        self.__observation_unit = resolver.lookup(self, "observation_unit",
+                                                  self.__observation_unit_id)
+        if self.__observation_unit != None:
+            self.__observation_unit.add_datastream(self)
+        self.__file = resolver.get_file(self, "file", self.__file_id)
     
     def parse(self, properties: dict):
         super().parse(properties)
@@ -1041,7 +1333,8 @@ class DataStream(BaseImpl, IDataStream):
 
 
 class BoundingBox(BaseImpl, IBoundingBox):
-    
+    __slots__ = ("__x", "__y", "__z")
+
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
         self.__x = [0, 0]
@@ -1053,7 +1346,6 @@ class BoundingBox(BaseImpl, IBoundingBox):
         return self.__x
     
     @x.setter
-    @abstractmethod
     def x(self, values: List[float]):
         self.__x = values
     
@@ -1062,7 +1354,6 @@ class BoundingBox(BaseImpl, IBoundingBox):
         return self.__y
     
     @y.setter
-    @abstractmethod
     def y(self, values: List[float]):
         self.__y = values
         
@@ -1071,12 +1362,18 @@ class BoundingBox(BaseImpl, IBoundingBox):
         return self.__z
     
     @z.setter
-    @abstractmethod
     def z(self, values: List[float]):
         self.__z = values
 
     ##
 
+    def clone(self):
+        c = super().clone()
+        c.__x = list(self.__x)
+        c.__y = list(self.__y)
+        c.__z = list(self.__z)
+        return c
+
     def store(self) -> None:
         raise NotImplementedError()
 
@@ -1093,9 +1390,18 @@ class BoundingBox(BaseImpl, IBoundingBox):
 
     
 class Scan(BaseImpl, IScan):
-    
+    __slots__ = ("__observation_unit", "__observation_unit_id", "__date",
+                 "__people", "__person_ids", "__camera", "__camera_id",
+                 "__scanning_device", "__scanning_device_id",
+                 "__scan_path", "__factor_values", "__camera_poses",
+                 "__bounding_box", "__analyses",
+                 "parent",
+                 "__loader")
+
     def __init__(self, factory, database, classname): 
         BaseImpl.__init__(self, factory, database, classname)
+        # Set by the study or investigation that contains the object
+        self.parent = None
         self.__observation_unit = None
         self.__observation_unit_id = ""
         self.__date = ""
@@ -1109,8 +1415,8 @@ class Scan(BaseImpl, IScan):
         self.__factor_values = {}
         self.__camera_poses = {}
         self.__bounding_box = None
-        self.__images = []
         self.__analyses = []
+        self.__loader = None
 
     @property
     def observation_unit(self) -> str:
@@ -1178,31 +1484,63 @@ class Scan(BaseImpl, IScan):
 
     @property
     def images(self) -> List[IFile]:
-        return self.__images
+        # The images are queried on each access rather than kept with
+        # the scan: a scan can have thousands of images, and the file
+        # records are already indexed by source in the database.
+        if self.database == None:
+            return []
+        return self.database.select_files("scan", self.id, None)
             
     @property
     def analyses(self) -> List[IAnalysis]:
+        self.__load_children()
         return self.__analyses
         
     def add_analysis(self, analysis: IAnalysis):
-        print("Scan.add_analysis")
+        self.__load_children()
         if find(analysis.id, self.analyses, "id") == None:
             self.analyses.append(analysis)
             analysis.scan = self
 
+    def defer_children(self, loader: Any = None) -> None:
+        """See ObservationUnit.defer_children()."""
+        self.__loader = loader
+
+    def __load_children(self) -> None:
+        if self.__loader != None:
+            self.__loader(self)
+
     ##
 
-    def restore(self) -> None:
-        self.__observation_unit = self.database.lookup(self.__observation_unit_id)
-        self.__observation_unit.add_scan(self)
-        self.__camera = self.database.lookup(self.__camera_id)
-        self.__scanning_device = self.database.lookup(self.__scanning_device_id)
-        self.__images = self.database.select_files("scan", self.id, None)
+    def clone(self):
+        c = super().clone()
+        c.parent = None
+        c.__people = list(self.__people)
+        c.__person_ids = list(self.__person_ids)
+        c.__factor_values = copy_values(self.__factor_values)
+        if self.__scan_path:
+            c.__scan_path = self.__scan_path.clone()
+        if self.__bounding_box:
+            c.__bounding_box = self.__bounding_box.clone()
+        c.__camera_poses = {}
+        c.__analyses = []
+        c.__loader = None
+        return c
+
+    def restore(self, resolver: IResolver = None) -> None:
+        resolver = resolver or Resolver(self.database)
+        self.__observation_unit = resolver.lookup(self, "observation_unit",
+                                                  self.__observation_unit_id)
+        if self.__observation_unit != None:
+            self.__observation_unit.add_scan(self)
+        self.__camera = resolver.lookup(self, "camera", self.__camera_id)
+        self.__scanning_device = resolver.lookup(self, "scanning_device",
+                                                 self.__scanning_device_id)
 
     def parse(self, properties: dict): 
         super().parse(properties)
         self.__observation_unit_id = properties["observation_unit"]
-        self.__date = dateutil.parser.parse(properties["date"])
+        self.__date = parse_date(properties["date"])
         self.__person_ids = properties["people"]
         self.__camera_id = properties["camera"]
         self.__scanning_device_id = properties["scanning_device"]
@@ -1226,6 +1564,7 @@ class Scan(BaseImpl, IScan):
 
         
 class SoftwareModule(BaseImpl, ISoftwareModule):
+    __slots__ = ("__version", "__repository", "__branch")
 
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
@@ -1276,6 +1615,7 @@ class SoftwareModule(BaseImpl, ISoftwareModule):
 
 
 class Parameters(BaseImpl, IParameters):
+    __slots__ = ("__values",)
 
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
@@ -1295,18 +1635,24 @@ class Parameters(BaseImpl, IParameters):
 
     ##
 
+    def clone(self):
+        c = super().clone()
+        c.__values = copy_values(self.__values)
+        return c
+
     def store(self) -> None:
         raise NotImplementedError()
     
     def parse(self, properties: dict):
         super().parse(properties)
-        self.__values = copy.deepcopy(properties)
+        self.__values = copy_values(properties)
 
     def serialize(self) -> dict:
         return self.__values
 
 
 class ScanPath(BaseImpl, IScanPath):
+    __slots__ = ("__short_name", "__type", "__parameters")
 
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
@@ -1362,7 +1708,10 @@ class ScanPath(BaseImpl, IScanPath):
 
     
 class Task(BaseImpl, ITask):
-    
+    __slots__ = ("__short_name", "__software_module", "__parameters",
+                 "__state", "__input_files", "__output_files",
+                 "__log_file")
+
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
         self.__short_name = ""
@@ -1470,7 +1819,8 @@ class Task(BaseImpl, ITask):
 
 
 class ObservedVariable(BaseImpl, IObservedVariable):
-    
+    __slots__ = ("__name", "__trait", "__scale", "__time_scale")
+
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
         self.__name = ""
@@ -1528,9 +1878,16 @@ class ObservedVariable(BaseImpl, IObservedVariable):
 
         
 class Analysis(BaseImpl, IAnalysis):
-    
+    __slots__ = ("__short_name", "__name", "__description",
+                 "__observation_unit", "__observation_unit_id", "__scan",
+                 "__scan_id", "__state", "__observed_variables",
+                 "__tasks", "__results_file",
+                 "parent")
+
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
+        # Set by the study or investigation that contains the object
+        self.parent = None
         self.__short_name = ""
         self.__name = ""
         self.__description = ""
@@ -1584,7 +1941,7 @@ class Analysis(BaseImpl, IAnalysis):
     def scan(self, scan: IScan) -> None:
         self.__scan = scan
         self.__scan_id = scan.id
-        print("Analysis.scan: scan_id='%s'" % self.__scan_id)
+        logger.debug("Analysis.scan: scan_id='%s'", self.__scan_id)
         
     @property
     def state(self) -> str:
@@ -1628,19 +1985,23 @@ class Analysis(BaseImpl, IAnalysis):
 
     def clone(self):
         c = super().clone()
+        c.parent = None
         c.state = self.STATE_DEFINED
         c.__observed_variables = [v.clone() for v in self.observed_variables]
         c.__tasks = [v.clone() for v in self.tasks]
         return c
                     
-    def restore(self) -> None:
-        self.__observation_unit = self.database.lookup(self.__observation_unit_id)
-        self.__observation_unit.add_analysis(self)
-        print("Analysis.restore: scan_id='%s'" % self.__scan_id)
-        if self.__scan_id:
-            self.__scan = self.database.lookup(self.__scan_id)
+    def restore(self, resolver: IResolver = None) -> None:
+        resolver = resolver or Resolver(self.database)
+        self.__observation_unit = resolver.lookup(self, "observation_unit",
+                                                  self.__observation_unit_id)
+        if self.__observation_unit != None:
+            self.__observation_unit.add_analysis(self)
+        logger.debug("Analysis.restore: scan_id='%s'", self.__scan_id)
+        self.__scan = resolver.lookup(self, "scan", self.__scan_id)
+        if self.__scan != None:
             self.__scan.add_analysis(self)
-        files = self.database.select_files(self.short_name, self.id, "results")
+        files = resolver.select_files(self.short_name, self.id, "results")
         if len(files) >= 1:
             self.__results_file = files[0]
     
@@ -1651,14 +2012,12 @@ class Analysis(BaseImpl, IAnalysis):
         self.__description = properties["description"]
         self.__observation_unit_id = properties.get("observation_unit", "")
         self.__scan_id = properties.get("scan", "")
-        print("Analysis.parse: scan_id='%s'" % self.__scan_id)
         self.__state = properties["state"]
         self.observed_variables = self.factory.create_list("ObservedVariable",
                                                            properties["observed_variables"])
         self.tasks = self.factory.create_list("Task", properties["tasks"])
 
     def serialize(self) -> dict:
-        print("Analysis.serialize: scan_id='%s'" % self.__scan_id)
         return { 'id': self.id,
                  'short_name': self.short_name,
                  'name': self.name,
@@ -1671,7 +2030,8 @@ class Analysis(BaseImpl, IAnalysis):
 
 
 class ExperimentalFactor(BaseImpl, IExperimentalFactor):
-    
+    __slots__ = ("__short_name", "__description", "__values")
+
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
         self.__short_name = ""
@@ -1704,6 +2064,11 @@ class ExperimentalFactor(BaseImpl, IExperimentalFactor):
 
     ##
 
+    def clone(self):
+        c = super().clone()
+        c.__values = copy_values(self.__values)
+        return c
+
     def parse(self, properties: dict):
         super().parse(properties)
         self.short_name = properties["short_name"]
@@ -1717,9 +2082,17 @@ class ExperimentalFactor(BaseImpl, IExperimentalFactor):
 
 
 class Study(BaseImpl, IStudy):
-    
+    __slots__ = ("__investigation", "__investigation_id", "__title",
+                 "__description", "__people", "__cameras",
+                 "__scanning_devices", "__files", "__scans", "__analyses",
+                 "__experimental_factors", "__observation_units",
+                 "__scan_paths",
+                 "parent")
+
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
+        # Set by the study or investigation that contains the object
+        self.parent = None
         self.__investigation = None
         self.__investigation_id = ""
         self.__title = ""
@@ -1835,18 +2208,22 @@ class Study(BaseImpl, IStudy):
     
     def clone(self):
         c = super().clone()
-        c.__people = [p.clone for p in self.people]
-        c.__cameras = [c.clone for c in self.cameras]
-        c.__scanning_devices = [s.clone for s in self.scanning_devices]
-        c.__scan_paths = [s.clone for s in self.scan_paths]
+        c.parent = None
+        c.__people = [p.clone() for p in self.people]
+        c.__cameras = [v.clone() for v in self.cameras]
+        c.__scanning_devices = [s.clone() for s in self.scanning_devices]
+        c.__scan_paths = [s.clone() for s in self.scan_paths]
+        c.__experimental_factors = [f.clone() for f in self.experimental_factors]
         c.__files = []
         c.__scans = []
         c.__analyses = []
         c.__observation_units = []
         return c
             
-    def restore(self) -> None:
-        self.__investigation = self.database.lookup(self.__investigation_id)
+    def restore(self, resolver: IResolver = None) -> None:
+        resolver = resolver or Resolver(self.database)
+        self.__investigation = resolver.lookup(self, "investigation",
+                                               self.__investigation_id)
 
     def parse(self, properties: dict):
         super().parse(properties)
@@ -2015,13 +2392,16 @@ class Study(BaseImpl, IStudy):
         newscan = scan.clone()
         newscan.id = new_id()
         newscan.date = current_date()
-        self.add_scan(newscan)
+        self.scans.append(newscan)
+        newscan.parent = self
         return newscan
 
 
         
 class Investigation(BaseImpl, IInvestigation):
-    
+    __slots__ = ("__short_name", "__title", "__description", "__license",
+                 "__people", "__studies", "__publications")
+
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
         self.__short_name = ""
@@ -2099,6 +2479,7 @@ class Investigation(BaseImpl, IInvestigation):
         c = super().clone()
         c.__publications = []
         c.__people = []
+        c.__studies = []
         return c
     
     def parse(self, properties: dict):
@@ -2123,7 +2504,9 @@ class Investigation(BaseImpl, IInvestigation):
 
     
 class Zone(BaseImpl, IZone):
-    
+    __slots__ = ("__id", "__farm", "__farm_id", "__short_name",
+                 "__observation_units", "__loader")
+
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
         self.__id = ""
@@ -2131,6 +2514,7 @@ class Zone(BaseImpl, IZone):
         self.__farm_id = ""
         self.__short_name = ""
         self.__observation_units = []
+        self.__loader = None
     
     @property
     def farm(self) -> Any:
@@ -2151,9 +2535,11 @@ class Zone(BaseImpl, IZone):
         
     @property
     def observation_units(self) -> List[IObservationUnit]:
+        self.__load_children()
         return self.__observation_units
 
     def add_observation_unit(self, obj: IObservationUnit):
+        self.__load_children()
         if find(obj.id, self.observation_units, "id") == None:
             self.__observation_units.append(obj)
 
@@ -2166,11 +2552,27 @@ class Zone(BaseImpl, IZone):
                 break        
         return r
 
+    def defer_children(self, loader: Any = None) -> None:
+        """See ObservationUnit.defer_children()."""
+        self.__loader = loader
+
+    def __load_children(self) -> None:
+        if self.__loader != None:
+            self.__loader(self)
+
     ##
+
+    def clone(self):
+        c = super().clone()
+        c.__observation_units = []
+        c.__loader = None
+        return c
     
-    def restore(self) -> None:
-        self.__farm = self.database.lookup(self.__farm_id)
-        self.__farm.add_zone(self)
+    def restore(self, resolver: IResolver = None) -> None:
+        resolver = resolver or Resolver(self.database)
+        self.__farm = resolver.lookup(self, "farm", self.__farm_id)
+        if self.__farm != None:
+            self.__farm.add_zone(self)
 
     def parse(self, properties: dict):
         super().parse(properties)
@@ -2185,7 +2587,13 @@ class Zone(BaseImpl, IZone):
         
 
 class Farm(BaseImpl, IFarm):
-    
+    __slots__ = ("__short_name", "__description", "__address", "__country",
+                 "__photo", "__photo_id", "__location", "__license",
+                 "__people", "__person_ids", "__cameras",
+                 "__scanning_devices", "__scan_paths", "__zones",
+                 "__observation_units", "__name",
+                 "__loader")
+
     def __init__(self, factory, database, classname):
         BaseImpl.__init__(self, factory, database, classname)
         self.__short_name = ""
@@ -2203,6 +2611,7 @@ class Farm(BaseImpl, IFarm):
         self.__scan_paths = []
         self.__zones = []
         self.__observation_units = []
+        self.__loader = None
 
     @property
     def short_name(self) -> str:
@@ -2279,13 +2688,16 @@ class Farm(BaseImpl, IFarm):
     
     @property
     def cameras(self) -> List[ICamera]:
+        self.__load_children()
         return self.__cameras
 
     @cameras.setter
     def cameras(self, values: List[ICamera]):
+        self.__load_children()
         self.__cameras = values
 
     def add_camera(self, camera: ICamera):
+        self.__load_children()
         if find(camera.id, self.cameras, "id") == None:
             self.cameras.append(camera)
             camera.owner = self
@@ -2296,9 +2708,11 @@ class Farm(BaseImpl, IFarm):
             
     @property
     def scanning_devices(self) -> List[ScanningDevice]:
+        self.__load_children()
         return self.__scanning_devices
     
     def add_scanning_device(self, device: IScanningDevice):
+        self.__load_children()
         if find(device.id, self.scanning_devices, "id") == None:
             self.scanning_devices.append(device)
             device.owner = self
@@ -2320,18 +2734,22 @@ class Farm(BaseImpl, IFarm):
 
     @property
     def zones(self) -> List[str]:
+        self.__load_children()
         return self.__zones
 
     def add_zone(self, zone: IZone):
+        self.__load_children()
         if find(zone.id, self.zones, "id") == None:
             self.zones.append(zone)
             zone.farm = self
         
     @property
     def observation_units(self) -> List[IObservationUnit]:
+        self.__load_children()
         return self.__observation_units
 
     def add_observation_unit(self, obj: IObservationUnit):
+        self.__load_children()
         if find(obj.id, self.observation_units, "id") == None:
             obj.context = self
             self.__observation_units.append(obj)
@@ -2345,6 +2763,14 @@ class Farm(BaseImpl, IFarm):
                 break        
         return r
         
+    def defer_children(self, loader: Any = None) -> None:
+        """See ObservationUnit.defer_children()."""
+        self.__loader = loader
+
+    def __load_children(self) -> None:
+        if self.__loader != None:
+            self.__loader(self)
+
     ##
 
     def clone(self):
@@ -2353,16 +2779,19 @@ class Farm(BaseImpl, IFarm):
         c.__photo_id = ""
         c.__people = []
         c.__person_ids = []
-        c.__cameras = [s.clone for s in self.__cameras]
-        c.__scanning_devices = [s.clone for s in self.__scanning_devices]
-        c.__scan_paths = [s.clone for s in self.scan_paths]
+        c.__location = list(self.__location)
+        c.__cameras = [s.clone() for s in self.cameras]
+        c.__scanning_devices = [s.clone() for s in self.scanning_devices]
+        c.__scan_paths = [s.clone() for s in self.scan_paths]
         c.__zones = []
+        c.__observation_units = []
+        c.__loader = None
         return c
 
-    def restore(self) -> None:
-        self.__people = lookup_id_list(self.database, self.__person_ids)
-        if self.__photo_id:
-            self.__photo = self.database.get_file(self.__photo_id)
+    def restore(self, resolver: IResolver = None) -> None:
+        resolver = resolver or Resolver(self.database)
+        self.__people = resolver.lookup_list(self, "people", self.__person_ids)
+        self.__photo = resolver.get_file(self, "photo", self.__photo_id)
     
     def parse(self, properties: dict):
         super().parse(properties)
@@ -2399,46 +2828,86 @@ class Farm(BaseImpl, IFarm):
 
 
 class DefaultFactory(IFactory):
-    def __init__(self, database: IDatabase):
+    """The factory of the default implementation of the data objects.
+
+    The constructors are looked up by class name in a table. New
+    classes can be added, and the default classes replaced, with
+    register().
+    """
+    CLASSES = {
+        "File": File,
+        "Person": Person,
+        "Camera": Camera,
+        "ScanningDevice": ScanningDevice,
+        "BiologicalMaterial": BiologicalMaterial,
+        "Pose": Pose,
+        "Scan": Scan,
+        "SoftwareModule": SoftwareModule,
+        "Parameters": Parameters,
+        "Task": Task,
+        "ObservedVariable": ObservedVariable,
+        "Analysis": Analysis,
+        "Study": Study,
+        "Investigation": Investigation,
+        "Zone": Zone,
+        "Farm": Farm,
+        "ExperimentalFactor": ExperimentalFactor,
+        "ObservationUnit": ObservationUnit,
+        "Sample": Sample,
+        "ScanPath": ScanPath,
+        "Unit": Unit,
+        "Observable": Observable,
+        "DataStream": DataStream,
+        "Note": Note
+    }
+    # The constructors that create an object directly from its
+    # properties, for the classes whose objects are created in large
+    # numbers when a database is loaded
+    FAST_CONSTRUCTORS = {
+        "File": File.from_properties,
+        "Note": Note.from_properties
+    }
+
+    def __init__(self, database: IDatabase = None):
         self.__database = database
+        self.__classes = dict(DefaultFactory.CLASSES)
+        self.__fast_constructors = dict(DefaultFactory.FAST_CONSTRUCTORS)
+
+    def register(self, classname: str, constructor: Any) -> None:
+        """Registers the constructor of the objects of the given class. The
+        constructor is called with the factory, the database, and the
+        class name as arguments, and the properties are passed to the
+        parse() method of the new object. It replaces the fast
+        constructor of a default class.
+        """
+        self.__classes[classname] = constructor
+        self.__fast_constructors.pop(classname, None)
+
+    def __constructor(self, classname: str) -> Any:
+        constructor = self.__classes.get(classname)
+        if constructor == None:
+            raise ValueError("Can't find constructor for %s" % classname)
+        return constructor
     
     def create(self, classname: str, properties: dict) -> Any:
-        switcher = {
-            "File": File,
-            "Person": Person,
-            "Camera": Camera,
-            "ScanningDevice": ScanningDevice,
-            "BiologicalMaterial": BiologicalMaterial,
-            "Pose": Pose,
-            "Scan": Scan,
-            "SoftwareModule": SoftwareModule,
-            "Parameters": Parameters,
-            "Task": Task,
-            "ObservedVariable": ObservedVariable,
-            "Analysis": Analysis,
-            "Study": Study,
-            "Investigation": Investigation,
-            "Zone": Zone,
-            "Farm": Farm,
-            "ExperimentalFactor": ExperimentalFactor,
-            "ObservationUnit": ObservationUnit,
-            "Sample": Sample,
-            "ScanPath": ScanPath,
-            "Unit": Unit,
-            "Observable": Observable,
-            "DataStream": DataStream,
-            "Note": Note
-        }
-        constructor = switcher.get(classname)
-        if not constructor:
-            raise ValueError("Can't find constructor for %s" % classname)
-        obj = constructor(self, self.__database, classname)
+        fast = self.__fast_constructors.get(classname)
+        if fast != None:
+            return fast(self, self.__database, classname, properties)
+        obj = self.__constructor(classname)(self, self.__database, classname)
         obj.parse(properties)
         return obj
     
     def create_list(self, classname: str, properties: List[dict]) -> List[Any]:
         array = []
-        for p in properties:
-            obj = self.create(classname, p)
-            array.append(obj)
+        fast = self.__fast_constructors.get(classname)
+        if fast != None:
+            database = self.__database
+            return [fast(self, database, classname, p) for p in properties]
+        if len(properties) > 0:
+            constructor = self.__constructor(classname)
+            database = self.__database
+            for p in properties:
+                obj = constructor(self, database, classname)
+                obj.parse(p)
+                array.append(obj)
         return array
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""romidata2.instrument
+====================
+
+Provides the diagnostics of the romidata2 package. Each module logs
+its messages with its own logger (logging.getLogger(__name__)), so
+that the diagnostics of, for example, the web cache can be turned on
+without those of the database. Nothing is printed by default: the
+application decides what to show by configuring the logging module,
+for example with configure().
+
+Besides log messages, the hot paths (loading and storing objects,
+converting images, ...) increment named counters. Counting is cheap
+and always on, and the values can be inspected at any time.
+
+Examples
+--------
+>>> import logging
+>>> from romidata2 import instrument
+>>> instrument.configure(logging.DEBUG, "romidata2.webcache")
+>>> instrument.counters.snapshot()
+{'db.objects_loaded': 1234, 'webcache.hits': 56}
+
+"""
+from typing import Union
+import logging
+import threading
+
+__author__ = "Peter Hanappe"
+__copyright__ = "Copyright 2020, Sony Computer Science Laboratories"
+__credits__ = ["Peter Hanappe"]
+__license__ = "Affero General Public License"
+__version__ = "3"
+__maintainer__ = "Peter Hanappe"
+__email__ = "peter@hanappe.com"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+
+class Counters():
+    """Class implementing a set of named, thread-safe counters."""
+    def __init__(self):
+        self.__values = {}
+        self.__lock = threading.Lock()
+
+    def increment(self, name: str, n: int = 1) -> None:
+        with self.__lock:
+            self.__values[name] = self.__values.get(name, 0) + n
+
+    def get(self, name: str) -> int:
+        return self.__values.get(name, 0)
+
+    def snapshot(self) -> dict:
+        """Returns a copy of the current values of the counters."""
+        with self.__lock:
+            return dict(self.__values)
+
+    def reset(self) -> None:
+        with self.__lock:
+            self.__values.clear()
+
+
+# The counters of the romidata2 package
+counters = Counters()
+
+
+def count(name: str, n: int = 1) -> None:
+    """Increments the named counter of the romidata2 package."""
+    counters.increment(name, n)
+
+
+def configure(level: Union[int, str] = logging.INFO,
+              name: str = "romidata2") -> None:
+    """Shows the log messages of the given level, and above, of the named
+    logger on the standard error. By default, the messages of the
+    whole package are shown.
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    if len(logging.getLogger().handlers) == 0 and len(logger.handlers) == 0:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(
+            "%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        logger.addHandler(handler)
@@ -4,7 +4,11 @@
 from typing import List, Any
 from os import listdir
 from os.path import isfile, join, splitext
+import os
 import json
+import errno
+import shutil
+import logging
 
 from fs import open_fs
 
@@ -20,6 +24,16 @@ __email__ = "peter@hanappe.com"
 __status__ = "Prototype"
 __version__ = "0.0.1"
 
+logger = logging.getLogger(__name__)
+
+# The size of the chunks in which files are copied
+CHUNK_SIZE = 1024 * 1024
+
+# The errors of os.copy_file_range() after which the file is copied
+# by reading and writing it instead
+COPY_RANGE_ERRORS = [errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                     errno.EOPNOTSUPP, errno.EPERM]
+
 class JsonExporter(json.JSONEncoder):
     def default(self, o):
         return o.serialize()
@@ -33,9 +47,69 @@ class JsonImporter():
         array = []
         fs = open_fs(directory)
         for path in fs.walk.files(filter=['*.json']):
-            print("Loading %s from %s" % (classname, path)) # TODO: print name only
+            logger.debug("Loading %s from %s", classname, path)
             with fs.open(path) as json_file:
                 properties = json.load(json_file)
                 obj = self.__factory.create(classname, properties)
                 array.append(obj)
         return array
+
+
+def copy_file(source: str, target: str) -> None:
+    """Copies a file. The copy is made by the kernel with
+    os.copy_file_range() when it can, which shares the data blocks of
+    the two files (reflink) on the file systems that support it, such
+    as Btrfs and XFS. Otherwise, the file is copied in chunks."""
+    with open(source, "rb") as fin, open(target, "wb") as fout:
+        try:
+            while os.copy_file_range(fin.fileno(), fout.fileno(), CHUNK_SIZE) > 0:
+                pass
+            return
+        except AttributeError:
+            pass
+        except OSError as e:
+            if not e.errno in COPY_RANGE_ERRORS:
+                raise
+            fin.seek(0)
+            fout.seek(0)
+            fout.truncate()
+        shutil.copyfileobj(fin, fout, CHUNK_SIZE)
+
+
+def ingest_file(source: str, target: str, move: bool = False,
+                link: bool = True) -> str:
+    """Gives the target the contents of the source file, without copying
+    the data when possible. The source is renamed when move is set,
+    else hard linked when link is set, and copied with copy_file()
+    when it is on another file system. The target is replaced
+    atomically. A hard linked target shares its data with the source,
+    so the source must not be written to afterwards.
+
+    Returns the method used: 'move', 'link' or 'copy'.
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if move:
+        try:
+            os.replace(source, target)
+            return "move"
+        except OSError as e:
+            logger.debug("Cannot move %s (%s), copying it", source, e)
+    tmppath = "%s.%d.tmp" % (target, os.getpid())
+    method = "copy"
+    try:
+        if link and not move:
+            try:
+                os.link(source, tmppath)
+                method = "link"
+            except OSError as e:
+                logger.debug("Cannot link %s (%s), copying it", source, e)
+        if method == "copy":
+            copy_file(source, tmppath)
+        os.replace(tmppath, target)
+    except BaseException:
+        if os.path.lexists(tmppath):
+            os.remove(tmppath)
+        raise
+    if move:
+        os.remove(source)
+    return method
@@ -4,6 +4,7 @@
 from typing import List, Any
 from os.path import join
 import json
+import logging
 
 from romidata2.datamodel import *
 from romidata2.impl import *
@@ -19,6 +20,8 @@ __email__ = "peter@hanappe.com"
 __status__ = "Prototype"
 __version__ = "0.0.1"
 
+logger = logging.getLogger(__name__)
+
 class Prototypes(IPrototypes):
     def __init__(self, basedir: str, factory: IFactory = None):
         self.__basedir = basedir
@@ -126,7 +129,7 @@ class Prototypes(IPrototypes):
             "observation_units": "ObservationUnit",
             "scan_paths": "ScanPath"
         } 
-        print("Loading '%s' prototypes:" % name)
+        logger.info("Loading '%s' prototypes", name)
         directory = join(self.__basedir, name)
         importer = JsonImporter(self.__factory)
         prototypes = importer.load_dir(directory, classNames[name])
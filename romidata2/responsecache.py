@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""romidata2.responsecache
+=======================
+
+Provides an in-memory cache for the JSON resources assembled by the
+REST API. Each entry records the IDs of the objects and files that
+were used to build it. The cache registers itself as a listener of the
+database, and when an object or a file is stored, all the entries that
+depend on its ID, or on one of the IDs it refers to, are dropped.
+
+Besides object and file IDs, an entry can also depend on a class name
+(for example 'Farm'). Such an entry is dropped whenever an object of
+that class is stored. This is used for lists of objects.
+
+An entry can also hold variants of the response, such as its
+serialized or compressed encodings. They are dropped together with
+the entry, so that the cost of encoding a response is only paid once.
+
+Examples
+--------
+>>> from romidata2.db import FarmDatabase
+>>> from romidata2.responsecache import ResponseCache
+>>> db = FarmDatabase("demo/db")
+>>> responses = ResponseCache(db)
+>>> responses.put(("farm", "farm000"), {"id": "farm000"}, ["farm000"])
+>>> responses.get(("farm", "farm000"))
+
+"""
+from typing import List, Any, Iterable
+import threading
+from collections import OrderedDict
+
+from romidata2.datamodel import IDatabase
+
+__author__ = "Peter Hanappe"
+__copyright__ = "Copyright 2020, Sony Computer Science Laboratories"
+__credits__ = ["Peter Hanappe"]
+__license__ = "Affero General Public License"
+__version__ = "3"
+__maintainer__ = "Peter Hanappe"
+__email__ = "peter@hanappe.com"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+
+class ResponseCache():
+    """Class implementing a cache of assembled responses with
+    dependency-based invalidation.
+
+    Attributes
+    ----------
+    db : IDatabase
+        The database whose changes invalidate the cached responses.
+    max_entries : int
+        The maximum number of cached responses. The least recently
+        used responses are dropped first.
+
+    """
+    def __init__(self, db: IDatabase, max_entries: int = 1000):
+        self.__max_entries = max_entries
+        self.__entries = OrderedDict()
+        self.__dependents = {}
+        self.__generation = 0
+        self.__lock = threading.Lock()
+        db.add_listener(self.database_changed)
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @property
+    def generation(self) -> int:
+        """A counter that is incremented on each invalidation. See put()."""
+        return self.__generation
+
+    def get(self, key: Any) -> Any:
+        """Returns the cached response, or None if it is not in the cache."""
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry == None:
+                return None
+            self.__entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: Any, value: Any, dependencies: Iterable[str],
+            generation: int = None) -> None:
+        """Stores a response in the cache.
+
+        Parameters
+        ----------
+        key: Any
+            A hashable key, usually the resource name and the requested ID.
+        value: Any
+            The response.
+        dependencies: Iterable[str]
+            The IDs of the objects and files, and the class names,
+            that the response depends on.
+        generation: int
+            The value of the generation property before the response
+            was assembled. If the database changed in the meantime,
+            the response may be outdated and it is not stored.
+
+        """
+        dependencies = frozenset(dependencies)
+        with self.__lock:
+            if generation != None and generation != self.__generation:
+                return
+            self.__remove(key)
+            self.__entries[key] = (value, dependencies, {})
+            for dependency in dependencies:
+                self.__dependents.setdefault(dependency, set()).add(key)
+            while len(self.__entries) > self.__max_entries:
+                self.__remove(next(iter(self.__entries)))
+
+    def get_variant(self, key: Any, value: Any, name: str) -> Any:
+        """Returns the named variant of the cached response, or None if it is
+        not in the cache. The value must be the response that was returned
+        by get(). If the entry was replaced in the meantime, None is
+        returned.
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry == None or entry[0] is not value:
+                return None
+            return entry[2].get(name)
+
+    def put_variant(self, key: Any, value: Any, name: str, data: Any) -> None:
+        """Stores a variant of a cached response. The value must be the
+        response that was returned by get(). Nothing is stored if the
+        entry was dropped or replaced in the meantime.
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry != None and entry[0] is value:
+                entry[2][name] = data
+
+    def __remove(self, key: Any) -> None:
+        entry = self.__entries.pop(key, None)
+        if entry != None:
+            for dependency in entry[1]:
+                keys = self.__dependents.get(dependency)
+                if keys != None:
+                    keys.discard(key)
+                    if len(keys) == 0:
+                        del self.__dependents[dependency]
+
+    def invalidate(self, ids: Iterable[str]) -> None:
+        """Drops all the responses that depend on one of the given IDs or
+        class names.
+        """
+        with self.__lock:
+            self.__generation += 1
+            for dependency in ids:
+                keys = self.__dependents.get(dependency)
+                if keys != None:
+                    for key in list(keys):
+                        self.__remove(key)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+            self.__dependents.clear()
+
+    def database_changed(self, action: str, classname: str, obj_id: str,
+                         related_ids: List[str]) -> None:
+        """The listener that is registered with the database."""
+        self.invalidate([obj_id, classname] + related_ids)
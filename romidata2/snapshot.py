@@ -0,0 +1,510 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""romidata2.snapshot
+==================
+
+Provides a read-only, memory-mapped snapshot of a database, for
+serving the REST API from several worker processes.
+
+write_snapshot() exports the objects and the file records of a
+database into a single file. The file starts with a small JSON header
+that describes the sections that follow it. Each section is a packed
+array:
+
+* the IDs of the objects, sorted, as fixed-width byte strings, the
+  class of each object, and the offsets of their JSON records in a
+  data section;
+* for each object, the indices of the objects that add themselves to
+  it when they are linked (the notes, scans, ... of an observation
+  unit, the zones of a farm, ...);
+* the IDs of the file records, sorted, and the offsets of their JSON
+  records, and the file records sorted by source (name and ID).
+
+SnapshotDatabase maps the file in memory and implements IDatabase on
+top of it. Opening a snapshot only reads the header, and the pages of
+the file are shared by all the processes through the page cache. A
+lookup creates the object, together with the objects it refers to.
+The objects it contains (the observation units of a farm, the notes
+of a crop, ...) are found in the index of its children, and are only
+created when they are first accessed (see defer_children() in
+romidata2.impl), so that looking up a crop does not create the whole
+farm. Only the last looked up objects are kept, so the memory of a
+process does not grow with the size of the snapshot. The file
+records are indexed by source, and created on each selection. The
+snapshot cannot be modified: the methods that store objects or files
+raise a NotImplementedError.
+
+The snapshot is written under a temporary name and renamed, so that
+the processes that have mapped the previous snapshot can keep using
+it.
+
+Examples
+--------
+>>> from romidata2.db import FarmDatabase
+>>> from romidata2.snapshot import write_snapshot, FarmSnapshotDatabase
+>>> write_snapshot(FarmDatabase("demo/db"), "demo/db/snapshot.bin")
+>>> db = FarmSnapshotDatabase("demo/db/snapshot.bin")
+>>> farm = db.get_farm("farm000")
+
+"""
+from typing import List, Any, Iterator
+import os
+import json
+import mmap
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from romidata2.datamodel import IDatabase, IFactory, IFile, IResolver, BaseClass
+from romidata2.impl import DefaultFactory
+from romidata2.io import JsonExporter
+from romidata2.instrument import count
+from romidata2.db import Database, FarmLookup
+
+__author__ = "Peter Hanappe"
+__copyright__ = "Copyright 2020, Sony Computer Science Laboratories"
+__credits__ = ["Peter Hanappe"]
+__license__ = "Affero General Public License"
+__version__ = "3"
+__maintainer__ = "Peter Hanappe"
+__email__ = "peter@hanappe.com"
+__status__ = "Prototype"
+__version__ = "0.0.1"
+
+
+MAGIC = b"ROMISNAP"
+FORMAT_VERSION = 1
+
+# The fields through which an object adds itself to the object it
+# refers to when it is restored (see the restore() methods in
+# romidata2.impl). An object can only be linked once these objects
+# have been created.
+CONTAINER_FIELDS = {
+    "Camera": ["owner"],
+    "ScanningDevice": ["owner"],
+    "ObservationUnit": ["context", "zone", "parent"],
+    "Note": ["observation_unit"],
+    "DataStream": ["observation_unit"],
+    "Scan": ["observation_unit"],
+    "Analysis": ["observation_unit", "scan"],
+    "Zone": ["farm"]
+}
+
+# The default number of looked up objects that a snapshot keeps (see
+# SnapshotDatabase)
+CACHE_SIZE = 1000
+
+
+def _encode(records: List[bytes]) -> tuple:
+    offsets = np.zeros(len(records) + 1, dtype="<i8")
+    if len(records) > 0:
+        np.cumsum([len(r) for r in records], out=offsets[1:])
+    return b"".join(records), offsets
+
+
+def _key_array(keys: List[bytes]) -> np.ndarray:
+    width = max([len(k) for k in keys] + [1])
+    return np.array(keys, dtype="S%d" % width)
+
+
+def write_snapshot(db: Database, path: str) -> None:
+    """Exports the objects and the file records of the database into a
+    snapshot file."""
+    objects = sorted(db.iter_objects(), key=lambda obj: obj.id)
+    index = {obj.id: i for i, obj in enumerate(objects)}
+    classes = sorted(set(obj.classname for obj in objects))
+    class_codes = {name: i for i, name in enumerate(classes)}
+    records = []
+    children = [[] for obj in objects]
+    for i, obj in enumerate(objects):
+        value = json.loads(json.dumps(obj.serialize(), cls=JsonExporter))
+        for field in CONTAINER_FIELDS.get(obj.classname, []):
+            parent = index.get(value.get(field))
+            if parent != None:
+                children[parent].append(i)
+        records.append(json.dumps({"id": obj.id, "classname": obj.classname,
+                                   "value": value},
+                                  separators=(",", ":")).encode("utf-8"))
+    # The children are linked in the order of the database load: by
+    # class, then by ID
+    order = lambda i: (objects[i].classname, objects[i].id)
+    children = [sorted(set(c), key=order) for c in children]
+    object_data, object_offsets = _encode(records)
+    child_offsets = np.zeros(len(objects) + 1, dtype="<i8")
+    if len(objects) > 0:
+        np.cumsum([len(c) for c in children], out=child_offsets[1:])
+    child_indices = np.array([i for c in children for i in c], dtype="<i4")
+
+    files = sorted(db.select_files(None, None, None), key=lambda f: f.id)
+    file_data, file_offsets = _encode([
+        json.dumps(f.serialize(), separators=(",", ":")).encode("utf-8")
+        for f in files])
+    by_source = sorted(range(len(files)),
+                       key=lambda i: (files[i].source_name, files[i].source_id))
+
+    sections = [
+        ("object_ids", _key_array([obj.id.encode("utf-8") for obj in objects])),
+        ("object_classes", np.array([class_codes[obj.classname]
+                                     for obj in objects], dtype="<i4")),
+        ("object_offsets", object_offsets),
+        ("object_data", np.frombuffer(object_data, dtype="u1")),
+        ("child_offsets", child_offsets),
+        ("child_indices", child_indices),
+        ("file_ids", _key_array([f.id.encode("utf-8") for f in files])),
+        ("file_offsets", file_offsets),
+        ("file_data", np.frombuffer(file_data, dtype="u1")),
+        ("source_keys", _key_array([_source_key(files[i].source_name,
+                                                files[i].source_id)
+                                    for i in by_source])),
+        ("source_files", np.array(by_source, dtype="<i4"))
+    ]
+    header = {"version": FORMAT_VERSION, "classes": classes, "sections": {}}
+    offset = 0
+    for name, array in sections:
+        header["sections"][name] = [offset, array.dtype.str, len(array)]
+        offset += _aligned(array.nbytes)
+    header = json.dumps(header).encode("utf-8")
+    start = _aligned(len(MAGIC) + 8 + len(header))
+
+    tmppath = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmppath, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.array([len(header)], dtype="<u8").tobytes())
+        f.write(header)
+        f.write(b"\0" * (start - len(MAGIC) - 8 - len(header)))
+        for name, array in sections:
+            f.write(array.tobytes())
+            f.write(b"\0" * (_aligned(array.nbytes) - array.nbytes))
+    os.replace(tmppath, path)
+
+
+def _aligned(size: int) -> int:
+    return (size + 7) & ~7
+
+
+def _source_key(source_name: str, source_id: str) -> bytes:
+    return ("%s\0%s" % (source_name, source_id)).encode("utf-8")
+
+
+class _Graph(IResolver):
+    """The objects created for a lookup in a snapshot, and the resolver
+    that links them. The references are looked up in the graph first,
+    and the missing objects are created from the snapshot and added to
+    it."""
+    def __init__(self, create_object, create_file, select_files):
+        self.objects = {}
+        self.__create_object = create_object
+        self.__create_file = create_file
+        self.__select_files = select_files
+
+    def lookup(self, obj: Any, field: str, obj_id: str) -> Any:
+        if not obj_id:
+            return None
+        return self.objects.get(obj_id) or self.__create_object(self, obj_id)
+
+    def lookup_list(self, obj: Any, field: str, obj_ids: List[str]) -> List[Any]:
+        r = []
+        for obj_id in obj_ids:
+            value = self.lookup(obj, field, obj_id)
+            if value != None:
+                r.append(value)
+        return r
+
+    def get_file(self, obj: Any, field: str, file_id: str) -> Any:
+        if not file_id:
+            return None
+        return self.__create_file(file_id)
+
+    def select_files(self, source_name: str, source_id: str,
+                     short_name: str) -> List[Any]:
+        return self.__select_files(source_name, source_id, short_name)
+
+
+class SnapshotDatabase(IDatabase):
+    """Class implementing a read-only database on top of a memory-mapped
+    snapshot.
+
+    Attributes
+    ----------
+    path : str
+        The path of the snapshot file.
+    basedir : str
+        The directory of the database, whose 'data' subdirectory holds
+        the contents of the files. Defaults to the directory of the
+        snapshot.
+    factory : IFactory
+        The factory that creates the objects.
+    cache_size : int
+        The number of looked up objects that are kept, together with
+        the objects created with them.
+
+    """
+    def __init__(self, path: str, basedir: str = None,
+                 factory: IFactory = None, cache_size: int = CACHE_SIZE):
+        self.__basedir = basedir or os.path.dirname(os.path.abspath(path))
+        self.__factory = factory or DefaultFactory(self)
+        with open(path, "rb") as f:
+            self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.__map[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a snapshot: %s" % path)
+        length = int(np.frombuffer(self.__map, dtype="<u8", count=1,
+                                   offset=len(MAGIC))[0])
+        start = len(MAGIC) + 8
+        header = json.loads(self.__map[start:start + length])
+        if header["version"] != FORMAT_VERSION:
+            raise ValueError("Unsupported snapshot version: %s" % header["version"])
+        start = _aligned(start + length)
+        self.__classes = header["classes"]
+        sections = {}
+        for name, (offset, dtype, size) in header["sections"].items():
+            sections[name] = np.frombuffer(self.__map, dtype=dtype, count=size,
+                                           offset=start + offset)
+        self.__object_ids = sections["object_ids"]
+        self.__object_classes = sections["object_classes"]
+        self.__object_offsets = sections["object_offsets"]
+        self.__object_data = sections["object_data"]
+        self.__child_offsets = sections["child_offsets"]
+        self.__child_indices = sections["child_indices"]
+        self.__file_ids = sections["file_ids"]
+        self.__file_offsets = sections["file_offsets"]
+        self.__file_data = sections["file_data"]
+        self.__source_keys = sections["source_keys"]
+        self.__source_files = sections["source_files"]
+        # The objects that were last looked up, in the order of use
+        self.__cache = OrderedDict()
+        self.__cache_size = cache_size
+        self.__lock = threading.RLock()
+        self.__listeners = []
+
+    def __len__(self):
+        return len(self.__object_ids)
+
+    @property
+    def factory(self) -> IFactory:
+        return self.__factory
+
+    def __find(self, keys: np.ndarray, key: str) -> int:
+        key = key.encode("utf-8")
+        if len(keys) == 0 or len(key) > keys.dtype.itemsize:
+            return -1
+        i = int(np.searchsorted(keys, key))
+        if i < len(keys) and keys[i] == key:
+            return i
+        return -1
+
+    def __record(self, data: np.ndarray, offsets: np.ndarray, i: int) -> dict:
+        return json.loads(data[offsets[i]:offsets[i + 1]].tobytes())
+
+    def __create(self, graph: _Graph, i: int) -> BaseClass:
+        """Creates the object with the given index and adds it to the
+        graph, without linking it. The linking of the objects it
+        contains is deferred until they are accessed (see
+        __defer)."""
+        obj_id = self.__object_ids[i].decode("utf-8")
+        data = self.__record(self.__object_data, self.__object_offsets, i)
+        value = data["value"]
+        if not "id" in value:
+            value["id"] = obj_id
+        obj = self.__factory.create(data["classname"], value)
+        graph.objects[obj_id] = obj
+        if self.__child_offsets[i + 1] > self.__child_offsets[i]:
+            self.__defer(graph, obj, i)
+        count("snapshot.objects_created")
+        return obj
+
+    def __create_object(self, graph: _Graph, obj_id: str) -> BaseClass:
+        """Creates and links the object with the given ID, or returns
+        None if the snapshot does not contain it."""
+        i = self.__find(self.__object_ids, obj_id)
+        if i < 0:
+            return None
+        with self.__lock:
+            r = graph.objects.get(obj_id)
+            if r == None:
+                r = self.__create(graph, i)
+                r.restore(graph)
+            return r
+
+    def __defer(self, graph: _Graph, obj: BaseClass, i: int) -> None:
+        """Sets the loader of the objects contained in an object. The
+        loader creates the objects that are not in the graph yet, then
+        links them all, again for those that were linked before, in
+        the order in which the database links them: they add
+        themselves to the object. The add_*() calls made while they
+        are linked find the loader running and don't call it again."""
+        pending = [True]
+        def load(obj):
+            with self.__lock:
+                if not pending:
+                    return
+                pending.clear()
+                start, end = self.__child_offsets[i], self.__child_offsets[i + 1]
+                children = []
+                for c in self.__child_indices[start:end]:
+                    child_id = self.__object_ids[c].decode("utf-8")
+                    child = graph.objects.get(child_id)
+                    if child == None:
+                        child = self.__create(graph, int(c))
+                    children.append(child)
+                for child in children:
+                    child.restore(graph)
+                obj.defer_children(None)
+                count("snapshot.children_loaded")
+        obj.defer_children(load)
+
+    def __new_graph(self) -> _Graph:
+        return _Graph(self.__create_object, self.__create_file,
+                      self.select_files)
+
+    def __cached(self, obj_id: str) -> BaseClass:
+        with self.__lock:
+            r = self.__cache.get(obj_id)
+            if r != None:
+                self.__cache.move_to_end(obj_id)
+            return r
+
+    def __remember(self, obj: BaseClass) -> None:
+        if self.__cache_size > 0:
+            with self.__lock:
+                self.__cache[obj.id] = obj
+                while len(self.__cache) > self.__cache_size:
+                    self.__cache.popitem(last=False)
+
+    def lookup(self, obj_id: str) -> BaseClass:
+        if not isinstance(obj_id, str):
+            return None
+        r = self.__cached(obj_id)
+        if r == None:
+            r = self.__create_object(self.__new_graph(), obj_id)
+            if r != None:
+                self.__remember(r)
+        return r
+
+    def lookup_many(self, obj_ids: List[str]) -> List[BaseClass]:
+        return [self.lookup(obj_id) for obj_id in obj_ids]
+
+    def iter_objects(self):
+        """Iterates over all the objects of the snapshot. They are
+        created in a single graph, which is not kept."""
+        graph = self.__new_graph()
+        for i in range(len(self.__object_ids)):
+            yield self.__create_object(graph, self.__object_ids[i].decode("utf-8"))
+
+    def select(self, classname: str, prop: str = None, value: str = None) -> List[BaseClass]:
+        if not classname in self.__classes:
+            return []
+        code = self.__classes.index(classname)
+        graph = self.__new_graph()
+        r = []
+        for i in np.flatnonzero(self.__object_classes == code):
+            obj_id = self.__object_ids[i].decode("utf-8")
+            obj = self.__cached(obj_id) or self.__create_object(graph, obj_id)
+            if prop == None or getattr(obj, prop) == value:
+                r.append(obj)
+        return r
+
+    def add_listener(self, listener) -> None:
+        # The snapshot does not change: the listeners are never called
+        self.__listeners.append(listener)
+
+    def store(self, obj: BaseClass) -> None:
+        raise NotImplementedError("A snapshot is read-only")
+
+    def new_file(self, owner_id, source_name: str, source_id: str,
+                 short_name: str, relpath: str, mimetype: str) -> IFile:
+        raise NotImplementedError("A snapshot is read-only")
+
+    def new_file_from_path(self, owner_id, source_name: str, source_id: str,
+                           short_name: str, relpath: str, mimetype: str,
+                           path: str, move: bool = False) -> IFile:
+        raise NotImplementedError("A snapshot is read-only")
+
+    def __file(self, i: int) -> IFile:
+        properties = self.__record(self.__file_data, self.__file_offsets, i)
+        return self.__factory.create("File", properties)
+
+    def __create_file(self, file_id: str) -> IFile:
+        i = self.__find(self.__file_ids, file_id)
+        if i < 0:
+            return None
+        return self.__file(i)
+
+    def get_file(self, file_id: str) -> IFile:
+        if not isinstance(file_id, str):
+            return None
+        return self.__create_file(file_id)
+
+    def __source_range(self, source_name: str, source_id: str) -> tuple:
+        """Returns the range of the source keys of the files of the given
+        source. Without an ID, the range holds all the keys that start
+        with the name and the separator."""
+        if source_id != None:
+            low = high = _source_key(source_name, source_id)
+        else:
+            low = source_name.encode("utf-8")
+            high = low + b"\x01"
+        if len(high) > self.__source_keys.dtype.itemsize:
+            return 0, 0
+        return (int(np.searchsorted(self.__source_keys, low, "left")),
+                int(np.searchsorted(self.__source_keys, high, "right")))
+
+    def select_files(self, source_name: str, source_id: str,
+                     short_name: str) -> List[IFile]:
+        if source_name != None:
+            start, end = self.__source_range(source_name, source_id)
+            files = [self.__file(int(i)) for i in sorted(self.__source_files[start:end])]
+        else:
+            files = [self.__file(i) for i in range(len(self.__file_ids))]
+        return [f for f in files
+                if ((source_name == None or f.source_name == source_name)
+                    and (source_id == None or f.source_id == source_id)
+                    and (short_name == None or f.short_name == short_name))]
+
+    def __path(self, ifile: IFile) -> str:
+        return os.path.join(self.__basedir, "data", ifile.path)
+
+    def file_store_text(self, f: IFile, text: str) -> None:
+        raise NotImplementedError("A snapshot is read-only")
+
+    def file_store_bytes(self, f: IFile, data: bytes) -> None:
+        raise NotImplementedError("A snapshot is read-only")
+
+    def file_read_text(self, ifile: IFile) -> str:
+        with open(self.__path(ifile), "r") as f:
+            return f.read()
+
+    def file_read_json(self, ifile: IFile) -> Any:
+        return json.loads(self.file_read_text(ifile))
+
+    def file_read_bytes(self, ifile: IFile) -> bytes:
+        with open(self.__path(ifile), "rb") as f:
+            return f.read()
+
+    def file_open(self, ifile: IFile, mode: str = "rb") -> Any:
+        if not mode in ["r", "rb"]:
+            raise ValueError("Files can only be opened for reading: %s" % mode)
+        return open(self.__path(ifile), mode)
+
+    def file_iter_chunks(self, ifile: IFile,
+                         chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+        f = open(self.__path(ifile), "rb")
+        def chunks():
+            with f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+        return chunks()
+
+    def file_store_stream(self, ifile: IFile, stream: Any) -> None:
+        raise NotImplementedError("A snapshot is read-only")
+
+    def file_store_path(self, ifile: IFile, path: str) -> None:
+        raise NotImplementedError("A snapshot is read-only")
+
+
+class FarmSnapshotDatabase(SnapshotDatabase, FarmLookup):
+    """A snapshot of a FarmDatabase."""
+    pass
@@ -1,7 +1,11 @@
 
+import logging
+
 from romidata2.datamodel import *
 from romidata2.impl import current_date
 
+logger = logging.getLogger(__name__)
+
 def new_scan(db: IDatabase,
              factory: IFactory,
              observation_unit_id: str,
@@ -15,8 +19,9 @@ def new_scan(db: IDatabase,
         raise ValueError("Invalid observation unit ID")
         
     farm_or_study = observation_unit.context
-    print(observation_unit.serialize())
-    print(farm_or_study.serialize())
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Observation unit: %s", observation_unit.serialize())
+        logger.debug("Context: %s", farm_or_study.serialize())
     
     people = []
     for person_id in person_ids:
@@ -1,16 +1,28 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import json
+import gzip
+import time
+import base64
+import binascii
 
-from flask import Flask, make_response, abort
+from flask import Flask, Response, make_response, abort, current_app, g
 from flask import request, send_from_directory
 from flask_cors import CORS
 from flask_restful import Resource, Api
+from werkzeug.exceptions import HTTPException
 
 import dateutil.parser
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 from romidata2.datamodel import *
 from romidata2.webcache import WebCache
+from romidata2.responsecache import ResponseCache
+from romidata2.changefeed import ChangeFeed
 
 __author__ = "Peter Hanappe"
 __copyright__ = "Copyright 2020, Sony Computer Science Laboratories"
@@ -26,6 +38,10 @@ class RomiResource(Resource):
     def __init__(self, app):
         self.__app = app
 
+    @property
+    def app(self) -> Flask:
+        return self.__app
+
     @property
     def cache(self) -> WebCache:
         return self.__app.cache
@@ -34,23 +50,185 @@ class RomiResource(Resource):
     def db(self) -> IDatabase:
         return self.__app.database
 
+    @property
+    def responses(self) -> ResponseCache:
+        return self.__app.responses
+
+    @property
+    def changes(self) -> ChangeFeed:
+        return self.__app.changes
+
+    def cached_response(self, key, build, *args):
+        """Returns the response from the response cache. If it isn't
+        cached, yet, the response is assembled by calling
+        build(dependencies, *args). The build function adds the IDs
+        of all the objects and files it uses to the dependencies set.
+        """
+        responses = self.responses
+        if responses == None:
+            return build(set(), *args)
+        r = responses.get(key)
+        if r == None:
+            generation = responses.generation
+            dependencies = set()
+            r = build(dependencies, *args)
+            responses.put(key, r, dependencies, generation)
+        # Let output_json() find the encoded variants of the response
+        g.cached_response = (key, r)
+        return r
+
     
+# JSON responses smaller than this are not compressed
+MIN_COMPRESS_SIZE = 1024
+
+# The supported content encodings, in order of preference
+ENCODINGS = ["br", "gzip"] if brotli != None else ["gzip"]
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=9)
+    else:
+        return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def output_json(data, code, headers=None):
+    """Converts the data returned by a resource into a JSON response. The
+    body is compressed when it is large and the client accepts
+    it. When the data comes from the response cache, the serialized
+    and compressed bodies are stored alongside it, and reused by the
+    next requests.
+    """
+    key, value = g.get("cached_response", (None, None))
+    # Resources that set headers cache a (data, code, headers) tuple
+    returned = value[0] if isinstance(value, tuple) else value
+    responses = None
+    if returned is data and returned != None:
+        responses = current_app.responses
+    body = None
+    if responses != None:
+        body = responses.get_variant(key, value, "json")
+    if body == None:
+        body = (json.dumps(data) + "\n").encode("utf-8")
+        if responses != None:
+            responses.put_variant(key, value, "json", body)
+    encoding = None
+    if len(body) >= MIN_COMPRESS_SIZE:
+        encoding = request.accept_encodings.best_match(ENCODINGS)
+    if encoding:
+        compressed = None
+        if responses != None:
+            compressed = responses.get_variant(key, value, encoding)
+        if compressed == None:
+            compressed = compress(body, encoding)
+            if responses != None:
+                responses.put_variant(key, value, encoding, compressed)
+        body = compressed
+    response = make_response(body, code)
+    response.headers.extend(headers or {})
+    response.headers['Content-Type'] = 'application/json'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def encode_cursor(positions: dict) -> str:
+    """Encodes the IDs of the last elements returned for each list into
+    an opaque cursor string. Returns an empty string if all the lists
+    are complete.
+    """
+    if len(positions) == 0:
+        return ""
+    data = json.dumps(positions, separators=(',', ':')).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> dict:
+    """Decodes a cursor created by encode_cursor(). Aborts the request with
+    a 400 status if the cursor is invalid.
+    """
+    try:
+        positions = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, binascii.Error):
+        abort(400, "Invalid cursor")
+    if (not isinstance(positions, dict)
+        or not all(isinstance(v, str) for v in positions.values())):
+        abort(400, "Invalid cursor")
+    return positions
+
+
+def page_arguments():
+    """Returns the limit, cursor, and fields arguments of the request. The
+    fields are returned as a list of names, or None if all fields are
+    requested.
+    """
+    limit = request.args.get('limit', default=None, type=str)
+    if limit != None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            abort(400, "Invalid limit")
+        if limit <= 0:
+            abort(400, "Invalid limit")
+    cursor = request.args.get('cursor', default=None, type=str)
+    fields = request.args.get('fields', default=None, type=str)
+    if fields != None:
+        fields = [f for f in fields.split(",") if f]
+    return limit, cursor, fields
+
+
+def project(value: dict, fields: List[str]) -> dict:
+    """Keeps only the requested fields, and the ID, of the dictionary."""
+    if fields == None:
+        return value
+    return {k: v for k, v in value.items() if k == 'id' or k in fields}
+
+
 class FarmList(RomiResource):
     def __init__(self, app):
         super().__init__(app)
 
     def get(self):
+        limit, cursor, fields = page_arguments()
+        key = ("farms", limit, cursor, fields and tuple(fields))
+        return self.cached_response(key, self.__get, limit, cursor, fields)
+        
+    def __get(self, dependencies, limit, cursor, fields):
+        dependencies.add("Farm")
+        farms = self.db.select("Farm")
+        start = 0
+        if cursor:
+            after = decode_cursor(cursor).get("farms")
+            ids = [farm.id for farm in farms]
+            if after == None:
+                start = len(farms)
+            elif after in ids:
+                start = ids.index(after) + 1
+            else:
+                abort(400, "Invalid cursor")
+        stop = len(farms) if limit == None else start + limit
         response = []
-        for farm in self.db.select("Farm"):
-            response.append({
+        for farm in farms[start:stop]:
+            dependencies.add(farm.id)
+            response.append(project({
                 'id': farm.id,
                 'short_name': farm.short_name,
                 'name': farm.name,
                 'location': farm.location,
-                'photo': farm.photo.id if farm.photo else "" })
-        return response
-
-def cropImage(db, crop):
+                'photo': farm.photo.id if farm.photo else "" }, fields))
+        if limit == None and not cursor:
+            return response
+        # The list of farms remains a JSON array. The cursor of the
+        # next page is returned in a header.
+        next_cursor = ""
+        if stop < len(farms):
+            next_cursor = encode_cursor({"farms": farms[stop - 1].id})
+        return response, 200, {"X-Next-Cursor": next_cursor}
+
+def cropImage(db, crop, dependencies=None):
+    if dependencies == None:
+        dependencies = set()
     # By default, use the farm's photo
     farm = crop.context
     image = farm.photo.id if farm.photo else ""
@@ -58,10 +236,13 @@ def cropImage(db, crop):
     mostRecentData = None
     
     for scan in crop.scans:
+        dependencies.add(scan.id)
         for analysis in scan.analyses:
+            dependencies.add(analysis.id)
             if (analysis.short_name == "stitching"
                 and analysis.state == IAnalysis.STATE_FINISHED):
                 if (not mostRecentData or scan.date > mostRecentData):
+                    dependencies.add(analysis.results_file.id)
                     results = db.file_read_json(analysis.results_file)
                     if 'cropped_map' in results: 
                         image = results['cropped_map']
@@ -74,7 +255,16 @@ class FarmInfo(RomiResource):
         super().__init__(app)
 
     def get(self, farm_id: str):
+        return self.info(farm_id)
+
+    def info(self, farm_id: str) -> dict:
+        return self.cached_response(("farm", farm_id), self.__get, farm_id)
+        
+    def __get(self, dependencies, farm_id: str):
         farm = self.db.get_farm(farm_id)
+        dependencies.add(farm.id)
+        dependencies.update(p.id for p in farm.people)
+        dependencies.update(obj.id for obj in farm.observation_units)
         return {
             'id': farm.id,
             'short_name': farm.short_name,
@@ -88,7 +278,7 @@ class FarmInfo(RomiResource):
             'people': [ p.serialize() for p in farm.people ],
             'crops': [{"id": obj.id,
                        "short_name": obj.short_name,
-                       "photo": cropImage(self.db, obj)}
+                       "photo": cropImage(self.db, obj, dependencies)}
                       for obj in farm.observation_units
                       if obj.type == "crop" ] }#,
             #'zones': [{"id": obj.id, "short_name": obj.short_name} for obj in farm.zones ] }
@@ -99,6 +289,9 @@ class ZoneInfo(RomiResource):
         super().__init__(app)
 
     def get(self, zone_id: str):
+        return self.info(zone_id)
+
+    def info(self, zone_id: str) -> dict:
         zone = self.db.lookup(zone_id)
         if zone.classname != "Zone":
             abort(404)
@@ -116,47 +309,93 @@ class ObservationUnitInfo(RomiResource):
         self.__type = otype
         
     def get(self, obj_id: str):
+        return self.info(obj_id, *page_arguments())
+
+    def info(self, obj_id: str, limit: int = None, cursor: str = None,
+             fields: List[str] = None) -> dict:
+        key = (self.__type, obj_id, limit, cursor, fields and tuple(fields))
+        return self.cached_response(key, self.__get, obj_id, limit, cursor, fields)
+        
+    def __get(self, dependencies, obj_id: str, limit, cursor, fields):
         obj = self.db.lookup(obj_id)
         if (obj.classname != "ObservationUnit"
             or obj.type != self.__type):
             abort(404)
         farm = obj.context
-        r = {
+        dependencies.add(obj.id)
+        r = project({
             'id': obj.id,
             'short_name': obj.short_name,
             'farm': farm.id,
             'zone': obj.zone.id,
-            'parent': obj.parent.id if obj.parent else "",
-            'children': [{
-                "id": child.id,
-                "type": child.type
-            } for child in obj.children],
-            'scans': [{
-                "id": obj.id,
-                "date": obj.date.isoformat()
-            } for obj in obj.scans],
-            'datastreams': [{
-                "id": d.id,
-                "observable": d.observable.name,
-                "unit": d.unit.name
-            } for d in obj.datastreams],
-            'notes': [{
-                "id": obj.id,
-                "author": {"id": obj.author.id, "short_name": obj.author.short_name},
-                "date": obj.date.isoformat(),
-                "type": obj.type,
-                "text": obj.text
-            } for obj in obj.notes],
-            'analyses': [{
-                "id": analysis.id,
-                "short_name": analysis.short_name,
-                "name": analysis.name,
-                "scan": analysis.scan.id if analysis.scan != None else "",
-                "state": analysis.state
-            } for analysis in obj.analyses]
-        }
+            'parent': obj.parent.id if obj.parent else ""
+        }, fields)
+        lists = [('children', obj.iter_children, self.__child),
+                 ('scans', obj.iter_scans, self.__scan),
+                 ('datastreams', obj.iter_datastreams, self.__datastream),
+                 ('notes', obj.iter_notes, self.__note),
+                 ('analyses', obj.iter_analyses, self.__analysis)]
+        positions = decode_cursor(cursor) if cursor else {}
+        next_positions = {}
+        for name, iterate, describe in lists:
+            if fields != None and not name in fields:
+                continue
+            if cursor and not name in positions:
+                # This list was completed on a previous page
+                r[name] = []
+                continue
+            # Ask for one more element to know whether there is a next page
+            try:
+                page = list(iterate(positions.get(name),
+                                    None if limit == None else limit + 1))
+            except ValueError:
+                abort(400, "Invalid cursor")
+            if limit != None and len(page) > limit:
+                page = page[:limit]
+                next_positions[name] = page[-1].id
+            dependencies.update(o.id for o in page)
+            r[name] = [describe(o) for o in page]
+        if limit != None or cursor:
+            r['cursor'] = encode_cursor(next_positions)
         return r
 
+    def __child(self, child):
+        return {
+            "id": child.id,
+            "type": child.type
+        }
+
+    def __scan(self, scan):
+        return {
+            "id": scan.id,
+            "date": scan.date.isoformat()
+        }
+
+    def __datastream(self, d):
+        return {
+            "id": d.id,
+            "observable": d.observable.name,
+            "unit": d.unit.name
+        }
+
+    def __note(self, note):
+        return {
+            "id": note.id,
+            "author": {"id": note.author.id, "short_name": note.author.short_name},
+            "date": note.date.isoformat(),
+            "type": note.type,
+            "text": note.text
+        }
+
+    def __analysis(self, analysis):
+        return {
+            "id": analysis.id,
+            "short_name": analysis.short_name,
+            "name": analysis.name,
+            "scan": analysis.scan.id if analysis.scan != None else "",
+            "state": analysis.state
+        }
+
 
 class CropInfo(ObservationUnitInfo):
     def __init__(self, app):
@@ -173,12 +412,20 @@ class ScanInfo(RomiResource):
         super().__init__(app)
 
     def get(self, scan_id: str):
+        return self.info(scan_id)
+
+    def info(self, scan_id: str) -> dict:
+        return self.cached_response(("scan", scan_id), self.__get, scan_id)
+        
+    def __get(self, dependencies, scan_id: str):
         scan = self.db.lookup(scan_id)
         if scan.classname != "Scan":
             abort(404)
         
         observation_unit = scan.observation_unit
         farm = observation_unit.context
+        dependencies.add(scan.id)
+        dependencies.update(a.id for a in scan.analyses)
         
         analyses = [{
             "id": analysis.id,
@@ -202,12 +449,21 @@ class AnalysisInfo(RomiResource):
         super().__init__(app)
 
     def get(self, analysis_id: str):
+        return self.info(analysis_id)
+
+    def info(self, analysis_id: str) -> dict:
+        return self.cached_response(("analysis", analysis_id), self.__get,
+                                    analysis_id)
+        
+    def __get(self, dependencies, analysis_id: str):
         analysis = self.db.lookup(analysis_id)
         if analysis.classname != "Analysis":
             abort(404)
             
         observation_unit = analysis.observation_unit
         farm = observation_unit.context
+        dependencies.add(analysis.id)
+        dependencies.add(analysis.results_file.id)
             
         results = self.db.file_read_json(analysis.results_file)
         return {
@@ -228,12 +484,20 @@ class DataStreamInfo(RomiResource):
         super().__init__(app)
 
     def get(self, datastream_id: str):
+        return self.info(datastream_id)
+
+    def info(self, datastream_id: str) -> dict:
+        return self.cached_response(("datastream", datastream_id), self.__get,
+                                    datastream_id)
+        
+    def __get(self, dependencies, datastream_id: str):
         datastream = self.db.lookup(datastream_id)
         if datastream.classname != "DataStream":
             abort(404)
             
         observation_unit = datastream.observation_unit
         farm = observation_unit.context
+        dependencies.add(datastream.id)
             
         return {
             "id": datastream.id,
@@ -249,12 +513,19 @@ class NoteInfo(RomiResource):
         super().__init__(app)
 
     def get(self, ID: str):
+        return self.info(ID)
+
+    def info(self, ID: str) -> dict:
+        return self.cached_response(("note", ID), self.__get, ID)
+        
+    def __get(self, dependencies, ID: str):
         note = self.db.lookup(ID)
         if note.classname != "Note":
             abort(404)
             
         observation_unit = note.observation_unit
         farm = observation_unit.context
+        dependencies.add(note.id)
             
         return {
             "id": note.id,
@@ -267,17 +538,172 @@ class NoteInfo(RomiResource):
         }
 
     
+class ObjectList(RomiResource):
+    """Class representing a request for several objects of mixed types,
+    subclass of flask_restful's Resource class. The IDs are passed as
+    a comma-separated 'ids' argument (GET), or as the 'ids' list of a
+    JSON body (POST). Each object is returned as it would be by its own
+    endpoint, for example /scans/<id> or /notes/<id>.
+    """
+    MAX_IDS = 1000
+    
+    def __init__(self, app):
+        super().__init__(app)
+
+    def get(self):
+        ids = request.args.get('ids', default="", type=str)
+        return self.__get([i for i in ids.split(",") if i])
+
+    def post(self):
+        body = request.get_json(silent=True)
+        if (not isinstance(body, dict)
+            or not isinstance(body.get("ids"), list)
+            or not all(isinstance(i, str) for i in body["ids"])):
+            abort(400, "Expected a JSON object with a list of IDs")
+        return self.__get(body["ids"])
+        
+    def __get(self, ids: List[str]):
+        ids = list(dict.fromkeys(ids))
+        if len(ids) > ObjectList.MAX_IDS:
+            abort(400, "Too many IDs (maximum %d)" % ObjectList.MAX_IDS)
+        resources = {}
+        objects = []
+        missing = []
+        for obj_id, obj in zip(ids, self.db.lookup_many(ids)):
+            name = self.__resource_name(obj)
+            if name == None:
+                missing.append(obj_id)
+                continue
+            resource = resources.get(name)
+            if resource == None:
+                resource = OBJECT_RESOURCES[name](self.app)
+                resources[name] = resource
+            try:
+                value = resource.info(obj_id)
+            except HTTPException:
+                missing.append(obj_id)
+                continue
+            objects.append({"id": obj_id, "resource": name, "value": value})
+        return {"objects": objects, "missing": missing}
+
+    def __resource_name(self, obj):
+        if obj == None:
+            return None
+        elif obj.classname == "ObservationUnit":
+            name = "%ss" % obj.type
+        else:
+            name = OBJECT_CLASSES.get(obj.classname)
+        return name if name in OBJECT_RESOURCES else None
+
+    
+def change_arguments():
+    """Returns the since and ids arguments of a request for changes."""
+    since = request.args.get('since', default=None, type=int)
+    ids = request.args.get('ids', default=None, type=str)
+    if ids != None:
+        ids = [i for i in ids.split(",") if i]
+    return since, ids
+
+
+def check_change_feed(feed: ChangeFeed) -> None:
+    """Aborts the request if the change feed is disabled."""
+    if feed == None:
+        abort(503, "The change feed is only available when the server "
+              "runs in a single process")
+
+
+class ChangeList(RomiResource):
+    """Class representing a request for the changes made to the database,
+    subclass of flask_restful's Resource class. When there are no new
+    changes, the request waits for at most 'timeout' seconds for one
+    (long polling).
+    """
+    MAX_TIMEOUT = 30
+    
+    def __init__(self, app):
+        super().__init__(app)
+
+    def get(self):
+        check_change_feed(self.changes)
+        since, ids = change_arguments()
+        if since == None:
+            return {"changes": [], "last": self.changes.last, "reset": False}
+        timeout = request.args.get('timeout', default=0, type=float)
+        timeout = min(max(timeout, 0), ChangeList.MAX_TIMEOUT)
+        changes, last, reset = self.changes.changes(since, timeout, ids)
+        return {"changes": changes, "last": last, "reset": reset}
+
+    
+class ChangeStream(RomiResource):
+    """Class representing a stream of the changes made to the database,
+    sent as Server-Sent Events, subclass of flask_restful's Resource
+    class. A stream ends after MAX_LIFETIME seconds, and the client
+    then reconnects with the Last-Event-ID of the last event it
+    received, so that the streams of the clients that went away never
+    last forever.
+    """
+    HEARTBEAT = 15
+    MAX_LIFETIME = 300
+    
+    def __init__(self, app):
+        super().__init__(app)
+
+    def get(self):
+        check_change_feed(self.changes)
+        since, ids = change_arguments()
+        last_event_id = request.headers.get('Last-Event-ID')
+        if last_event_id:
+            try:
+                since = int(last_event_id)
+            except ValueError:
+                abort(400, "Invalid Last-Event-ID")
+        if since == None:
+            since = self.changes.last
+        response = Response(self.__stream(self.changes, since, ids),
+                            mimetype="text/event-stream")
+        response.headers['Cache-Control'] = 'no-cache'
+        # Don't let a reverse proxy buffer the events
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    def __stream(self, feed, since, ids):
+        # The generator is closed, ending the stream, when the server
+        # notices that the client went away
+        yield "retry: 5000\n\n"
+        deadline = time.monotonic() + ChangeStream.MAX_LIFETIME
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            changes, last, reset = feed.changes(since,
+                                                min(ChangeStream.HEARTBEAT, remaining),
+                                                ids)
+            if reset:
+                yield "id: %d\nevent: reset\ndata: {}\n\n" % last
+            for change in changes:
+                yield "id: %d\ndata: %s\n\n" % (change["seq"], json.dumps(change))
+            if len(changes) == 0 and not reset:
+                # A comment, to keep the connection open
+                yield ": \n\n"
+            since = last
+
+    
 class DataStreamValues(RomiResource):
     def __init__(self, app):
         super().__init__(app)
 
     def get(self, datastream_id: str):
+        start = request.args.get('start', default=None, type=str)
+        end = request.args.get('end', default=None, type=str)
+        return self.cached_response(("values", datastream_id, start, end),
+                                    self.__get, datastream_id, start, end)
+        
+    def __get(self, dependencies, datastream_id: str, start: str, end: str):
         datastream = self.db.lookup(datastream_id)
         if datastream.classname != "DataStream":
             abort(404)
-            
-        start = request.args.get('start', default=None, type=str)
-        end = request.args.get('end', default=None, type=str)
+        dependencies.add(datastream.id)
+        dependencies.add(datastream.file.id)
 
         if start:
             start_date = dateutil.parser.parse(start)
@@ -310,18 +736,127 @@ class RomiImage(RomiResource):
         if not orientation in ['orig', 'horizontal', 'vertical']:
             orientation = 'orig'
         direction = request.args.get('direction', default='cw', type=str)
-        data, mimetype = self.cache.image_data(image_id, size, orientation, direction)
+        if size == 'orig' and orientation == 'orig':
+            data, mimetype = self.cache.original_data(image_id)
+        else:
+            data, mimetype = self.cache.image_data(image_id, size, orientation, direction)
+        response = make_response(data)
+        response.headers['Content-Type'] = mimetype
+        return response
+
+
+class RomiImageTiles(RomiResource):
+    """Class representing the description of the tile pyramid of an
+    image, subclass of flask_restful's Resource class.
+    """
+    def __init__(self, app):
+        super().__init__(app)
+    
+    def get(self, image_id):
+        return self.cache.image_tile_info(image_id)
+
+
+class RomiImageTile(RomiResource):
+    """Class representing a request for one tile of the tile pyramid of
+    an image, subclass of flask_restful's Resource class.
+    """
+    def __init__(self, app):
+        super().__init__(app)
+    
+    def get(self, image_id, z, x, y):
+        try:
+            data, mimetype = self.cache.image_tile(image_id, z, x, y)
+        except ValueError:
+            abort(404)
+        response = make_response(data)
+        response.headers['Content-Type'] = mimetype
+        return response
+
+
+class RomiPointCloud(RomiResource):
+    """Class representing a point cloud HTTP request, subclass of
+    flask_restful's Resource class.
+    """
+    def __init__(self, app):
+        super().__init__(app)
+    
+    def get(self, pointcloud_id):
+        """Return the HTTP response with the point cloud data. Decimate
+        the point cloud if necessary.
+        """
+        size = request.args.get('size', default='thumb', type=str)
+        if not size in ['orig', 'thumb', 'large']:
+            size = 'thumb'
+        if size == 'orig':
+            data, mimetype = self.cache.original_data(pointcloud_id)
+        else:
+            data, mimetype = self.cache.pointcloud_data(pointcloud_id, size)
+        response = make_response(data)
+        response.headers['Content-Type'] = mimetype
+        return response
+
+
+class RomiMesh(RomiResource):
+    """Class representing a mesh HTTP request, subclass of
+    flask_restful's Resource class.
+    """
+    def __init__(self, app):
+        super().__init__(app)
+    
+    def get(self, mesh_id):
+        """Return the HTTP response with the mesh data. Decimate the mesh if
+        necessary.
+        """
+        size = request.args.get('size', default='thumb', type=str)
+        if not size in ['orig', 'thumb', 'large']:
+            size = 'thumb'
+        if size == 'orig':
+            data, mimetype = self.cache.original_data(mesh_id)
+        else:
+            data, mimetype = self.cache.mesh_data(mesh_id, size)
         response = make_response(data)
         response.headers['Content-Type'] = mimetype
         return response
 
 
+# The resources that can be returned by ObjectList, indexed by the
+# name of their endpoint.
+OBJECT_RESOURCES = {
+    "farms": FarmInfo,
+    "crops": CropInfo,
+    "plants": PlantInfo,
+    "scans": ScanInfo,
+    "analyses": AnalysisInfo,
+    "datastreams": DataStreamInfo,
+    "notes": NoteInfo
+}
+
+OBJECT_CLASSES = {
+    "Farm": "farms",
+    "Scan": "scans",
+    "Analysis": "analyses",
+    "DataStream": "datastreams",
+    "Note": "notes"
+}
+
+
 class FarmWebApp(Flask):
-    def __init__(self, db: IDatabase, cache: WebCache):
+    def __init__(self, db: IDatabase, cache: WebCache,
+                 response_cache_size: int = 1000,
+                 change_feed_size: int = 10000,
+                 change_feed: bool = True):
         super(FarmWebApp, self).__init__("Farmer's Dashboard API")
         self.__db = db
         self.__cache = cache
-        CORS(self)
+        self.__responses = None
+        if response_cache_size > 0:
+            self.__responses = ResponseCache(db, response_cache_size)
+        # The sequence numbers of the changes are only valid in this
+        # process: the feed is disabled when there are several
+        self.__changes = None
+        if change_feed:
+            self.__changes = ChangeFeed(db, change_feed_size)
+        CORS(self, expose_headers=["X-Next-Cursor"])
         self.__define_api()
 
     @property
@@ -331,10 +866,18 @@ class FarmWebApp(Flask):
     @property
     def cache(self) -> WebCache:
         return self.__cache
+
+    @property
+    def responses(self) -> ResponseCache:
+        return self.__responses
+
+    @property
+    def changes(self) -> ChangeFeed:
+        return self.__changes
         
     def __define_api(self) -> None:
         self.__api = Api(self)
-        print(self.__api.app)
+        self.__api.representation('application/json')(output_json)
         self.__api.add_resource(FarmList,
                                 '/farms',
                                 resource_class_kwargs={'app': self})
@@ -371,6 +914,18 @@ class FarmWebApp(Flask):
                                 '/notes/<string:ID>',
                                 resource_class_kwargs={'app': self})
         
+        self.__api.add_resource(ObjectList,
+                                '/objects',
+                                resource_class_kwargs={'app': self})
+        
+        self.__api.add_resource(ChangeList,
+                                '/changes',
+                                resource_class_kwargs={'app': self})
+        
+        self.__api.add_resource(ChangeStream,
+                                '/changes/stream',
+                                resource_class_kwargs={'app': self})
+        
         self.__api.add_resource(DataStreamValues,
                                 '/datastreams/<string:datastream_id>/values',
                                 resource_class_kwargs={'app': self})
@@ -379,3 +934,19 @@ class FarmWebApp(Flask):
                                 '/images/<string:image_id>',
                                 resource_class_kwargs={'app': self})
                 
+
+        self.__api.add_resource(RomiImageTiles,
+                                '/images/<string:image_id>/tiles',
+                                resource_class_kwargs={'app': self})
+
+        self.__api.add_resource(RomiImageTile,
+                                '/images/<string:image_id>/tiles/<int:z>/<int:x>/<int:y>',
+                                resource_class_kwargs={'app': self})
+
+        self.__api.add_resource(RomiPointCloud,
+                                '/pointclouds/<string:pointcloud_id>',
+                                resource_class_kwargs={'app': self})
+
+        self.__api.add_resource(RomiMesh,
+                                '/meshes/<string:mesh_id>',
+                                resource_class_kwargs={'app': self})
@@ -4,8 +4,8 @@
 ==================
 
 Provides utility functions that are used in combination with the
-IDatabase interface to create downsized versions of images (and in the
-future also of point clouds and mesh resources). The web cache can
+IDatabase interface to create downsized versions of images, point
+clouds, and meshes. The web cache can
 either serve data from an Investigation database or a Farm database.
 The resources are identified using either the investigation, the
 study, and the file IDs when used with a Investigation database, or
@@ -13,26 +13,78 @@ using either the farm, the zone, and the file IDs when used with a
 Farm database The downsized versions are cached in the directory
 passed as argument.
 
+The cached files are stored in a sharded directory layout,
+``<path>/<h[0:2]>/<h[2:4]>/<h>``, where ``h`` is the SHA1 hash of the
+resource key. The list of cached resources is kept in memory and
+persisted in the file ``<path>/manifest.txt`` so that existence checks
+do not have to touch the file system. Several processes can share the
+cache directory: the manifest is a log to which the keys that are
+added, and the removed keys prefixed with '-', are appended while
+holding an exclusive lock on ``<path>/manifest.lock`` (on POSIX
+systems). When a key is not found in memory, the lines that the other
+processes appended since the manifest was last read are applied
+first. The manifest is only rewritten, compacted, when the cache is
+opened or rebuilt. Caches created with the older, flat layout
+(``<path>/<h>``) are migrated when the cache is opened.
+
+Optionally, small resources (thumbnails, for example) can also be kept
+in a memory cache that sits in front of the disk cache. The memory
+cache is bounded by the total number of bytes it holds and evicts the
+least recently used resources first.
+
 The following size specifications are available:
 
 * Images: 'thumb' (max. 150x150), 'large' (max. 1500x1500), and 'orig' (original size).
+* Point clouds: 'thumb' (max. 10k points), 'large' (max. 200k points), and 'orig' (original file).
+* Meshes: 'thumb' (max. 5k vertices), 'large' (max. 100k vertices), and 'orig' (original file).
+
+Large images, such as the stitched maps of a zone, can also be served
+as a tile pyramid (deep zoom). At zoom level 0, the complete image
+fits in a single tile of 256x256 pixels. Every next level doubles the
+resolution, up to the level that has the original resolution. Tiles
+are computed and cached on demand.
+
+Point clouds and meshes must be stored as PLY files. The files are
+parsed in chunks, the downsized versions are decimated using a voxel
+grid (see romidata2.geometry), and they are returned as binary PLY
+files.
+
+The data is returned as bytes. The original files can also be
+streamed, in chunks, with original_data().
 
 Examples
 --------
 >>> from romidata2.db import FarmDatabase
 >>> from romidata2.webcache import WebCache
 >>> db = FarmDatabase("demo/db")
->>> cache = WebCache(db, "farms", "/tmp/romicache")
+>>> cache = WebCache(db, "farms", "/tmp/romicache", memory_size=64*1024*1024)
 >>> binary_image, mimetype = webcache.image_data('image000', 'thumb')
+>>> binary_ply, mimetype = webcache.pointcloud_data('pointcloud000', 'large')
+>>> binary_tile, mimetype = webcache.image_tile('map000', 3, 2, 1)
+>>> chunks, mimetype = webcache.original_data('image000')
 
 """
 import os
+import re
+import json
+import logging
+import math
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from io import BytesIO
 
 import hashlib
 from PIL import Image
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 from romidata2.datamodel import IDatabase
+from romidata2.geometry import read_ply_stream, write_ply, decimate
+from romidata2.instrument import count
 
 __author__ = "Peter Hanappe"
 __copyright__ = "Copyright 2020, Sony Computer Science Laboratories"
@@ -44,6 +96,60 @@ __email__ = "peter@hanappe.com"
 __status__ = "Prototype"
 __version__ = "0.0.1"
 
+logger = logging.getLogger(__name__)
+
+class MemoryCache():
+    """A byte-bounded, least-recently-used cache of binary data.
+
+    Attributes
+    ----------
+    max_size : int
+        The maximum number of bytes held by the cache.
+    max_item_size : int
+        Data larger than this number of bytes is not cached.
+
+    """
+    def __init__(self, max_size: int, max_item_size: int):
+        self.__max_size = max_size
+        self.__max_item_size = max_item_size
+        self.__size = 0
+        self.__items = OrderedDict()
+        self.__lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self.__size
+
+    def __len__(self):
+        return len(self.__items)
+
+    def get(self, key: str) -> bytes:
+        with self.__lock:
+            data = self.__items.get(key)
+            if data != None:
+                self.__items.move_to_end(key)
+            return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.__max_item_size or len(data) > self.__max_size:
+            return
+        with self.__lock:
+            old = self.__items.pop(key, None)
+            if old != None:
+                self.__size -= len(old)
+            self.__items[key] = data
+            self.__size += len(data)
+            while self.__size > self.__max_size:
+                evicted_key, evicted = self.__items.popitem(last=False)
+                self.__size -= len(evicted)
+
+    def remove(self, key: str) -> None:
+        with self.__lock:
+            old = self.__items.pop(key, None)
+            if old != None:
+                self.__size -= len(old)
+
+        
 class WebCache():
     """Class implementing a cache to store resources (images and other) in
     several resolutions to speed up the download for the web interface.
@@ -57,13 +163,251 @@ class WebCache():
         One of "farms" or "investigations".
     path: str
         ``The path of the local cache directory.
+    memory_size: int
+        The maximum number of bytes kept in the memory cache. Use
+        zero to disable the memory cache (the default).
+    memory_item_size: int
+        Only resources smaller than this size are kept in the memory
+        cache.
 
     """
-    def __init__(self, db: IDatabase, db_type: str, path: str):
+    MANIFEST = "manifest.txt"
+    MANIFEST_LOCK = "manifest.lock"
+    KEY_PATTERN = re.compile("^[0-9a-f]{40}$")
+    POINTCLOUD_SIZES = { "thumb": 10000, "large": 200000 }
+    MESH_SIZES = { "thumb": 5000, "large": 100000 }
+    TILE_SIZE = 256
+    TILE_SOURCES = 4
+    TILE_MAX_REDUCE = 8
+    
+    def __init__(self, db: IDatabase, db_type: str, path: str,
+                 memory_size: int = 0, memory_item_size: int = 64 * 1024):
         self.__db = db
         self.__db_type = db_type
         self.__path = path
+        self.__memory = None
+        if memory_size > 0:
+            self.__memory = MemoryCache(memory_size, memory_item_size)
+        self.__manifest = set()
+        # The inode of the manifest file, the offset up to which it was
+        # read, and the number of lines read
+        self.__manifest_file = (None, 0, 0)
+        self.__manifest_lock = threading.RLock()
+        self.__tile_sources = OrderedDict()
+        self.__tile_lock = threading.Lock()
         os.makedirs(self.__path, exist_ok=True)
+        self.__load_manifest()
+        self.__migrate_flat_layout()
+
+    # Manifest and sharded layout
+    def __key_path(self, key):
+        """Returns the path of a cached resource in the sharded layout.
+    
+        Parameters
+        ----------
+        key: str
+            The SHA1 hash of the resource
+
+        """
+        return os.path.join(self.__path, key[0:2], key[2:4], key)
+
+    def __manifest_path(self):
+        return os.path.join(self.__path, WebCache.MANIFEST)
+
+    @contextmanager
+    def __locked_manifest(self):
+        """Returns a context manager that holds the lock of the manifest.
+        The lock is exclusive across the threads of this process and,
+        where fcntl is available, across processes."""
+        with self.__manifest_lock:
+            if fcntl == None:
+                yield
+                return
+            lockpath = os.path.join(self.__path, WebCache.MANIFEST_LOCK)
+            with open(lockpath, "a") as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def __read_manifest(self):
+        """Applies the lines appended to the manifest file since it was
+        last read to the keys in memory. A manifest that was rewritten
+        since then is read again from the start. Returns False if the
+        manifest does not exist.
+
+        """
+        try:
+            f = open(self.__manifest_path(), mode="rb")
+        except FileNotFoundError:
+            return False
+        with f, self.__manifest_lock:
+            inode, offset, lines = self.__manifest_file
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != inode or stat.st_size < offset:
+                self.__manifest = set()
+                offset, lines = 0, 0
+            if stat.st_size > offset:
+                f.seek(offset)
+                data = f.read()
+                # A line that is being appended is read the next time
+                end = data.rfind(b"\n") + 1
+                for line in data[:end].decode("utf-8").split():
+                    if line[0] == "-":
+                        self.__manifest.discard(line[1:])
+                    else:
+                        self.__manifest.add(line)
+                    lines += 1
+                offset += end
+            self.__manifest_file = (stat.st_ino, offset, lines)
+        return True
+
+    def __load_manifest(self):
+        """Loads the list of cached resources from the manifest file. If
+        the manifest does not exist, it is rebuilt from the contents of
+        the cache directory. A manifest that holds many removed keys is
+        compacted.
+
+        """
+        if not self.__read_manifest():
+            self.rebuild_manifest()
+        elif self.__manifest_file[2] > 2 * len(self.__manifest) + 1000:
+            with self.__locked_manifest():
+                self.__read_manifest()
+                self.__save_manifest(set(self.__manifest))
+
+    def __save_manifest(self, keys):
+        """Rewrites the manifest file with the given keys. Must be called
+        while holding the lock of the manifest."""
+        path = self.__manifest_path()
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, mode="w") as f:
+            for key in sorted(keys):
+                f.write("%s\n" % key)
+        os.replace(tmp, path)
+        stat = os.stat(path)
+        self.__manifest = keys
+        self.__manifest_file = (stat.st_ino, stat.st_size, len(keys))
+
+    def __append_to_manifest(self, line):
+        """Appends a line to the manifest file. Must be called while
+        holding the lock of the manifest."""
+        with open(self.__manifest_path(), mode="a") as f:
+            f.write("%s\n" % line)
+
+    def __add_to_manifest(self, key):
+        if key in self.__manifest:
+            return
+        with self.__locked_manifest():
+            self.__read_manifest()
+            if not key in self.__manifest:
+                self.__manifest.add(key)
+                self.__append_to_manifest(key)
+
+    def __remove_from_manifest(self, key):
+        with self.__locked_manifest():
+            # The key is kept if another process has cached the
+            # resource again
+            if (key in self.__manifest
+                and not os.path.exists(self.__key_path(key))):
+                self.__manifest.discard(key)
+                self.__append_to_manifest("-%s" % key)
+
+    def rebuild_manifest(self):
+        """Rebuilds the manifest by scanning the sharded directories of the
+        cache. This can be used after the cache directory was modified
+        by an external tool.
+
+        """
+        keys = set()
+        for dirpath, dirnames, filenames in os.walk(self.__path):
+            if dirpath == self.__path:
+                continue
+            for filename in filenames:
+                if WebCache.KEY_PATTERN.match(filename):
+                    keys.add(filename)
+        with self.__locked_manifest():
+            self.__save_manifest(keys)
+
+    def __migrate_flat_layout(self):
+        """Moves the files of a cache that was created with the flat
+        layout (<path>/<hash>) into the sharded layout.
+
+        """
+        keys = set()
+        for entry in os.scandir(self.__path):
+            if entry.is_file() and WebCache.KEY_PATTERN.match(entry.name):
+                dst = self.__key_path(entry.name)
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                os.replace(entry.path, dst)
+                keys.add(entry.name)
+        if len(keys) > 0:
+            with self.__locked_manifest():
+                self.__read_manifest()
+                self.__save_manifest(keys | self.__manifest)
+            logger.info("Migrated %d cached files to the sharded layout", len(keys))
+
+    def __contains(self, key):
+        if key in self.__manifest:
+            return True
+        # The resource may have been cached by another process
+        self.__read_manifest()
+        return key in self.__manifest
+
+    def __read(self, key):
+        """Returns the cached data for the given key, or None if the
+        resource is not in the cache.
+    
+        Parameters
+        ----------
+        key: str
+            The SHA1 hash of the resource
+
+        """
+        if self.__memory != None:
+            data = self.__memory.get(key)
+            if data != None:
+                count("webcache.memory_hits")
+                return data
+        if not self.__contains(key):
+            count("webcache.misses")
+            return None
+        try:
+            with open(self.__key_path(key), mode="rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            # The file was removed behind our back
+            self.__remove_from_manifest(key)
+            count("webcache.misses")
+            return None
+        count("webcache.disk_hits")
+        if self.__memory != None:
+            self.__memory.put(key, data)
+        return data
+
+    def __write(self, key, data):
+        """Stores the data in the cache. The file is first written to a
+        temporary file and then renamed so that concurrent readers
+        never see a partially written file.
+    
+        Parameters
+        ----------
+        key: str
+            The SHA1 hash of the resource
+        data: bytes
+            The data to store
+
+        """
+        path = self.__key_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+        with open(tmp, mode="wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self.__add_to_manifest(key)
+        if self.__memory != None:
+            self.__memory.put(key, data)
 
     def __hash(self, components):
         """Computes a SHA1 hash.
@@ -130,18 +474,19 @@ class WebCache():
 
         """
         ifile = self.__db.get_file(file_id)
-        image = self.__db.file_read_bytes(ifile)
-        dst = os.path.join(self.__path, self.__image_hash(file_id, size, orientation, direction))
+        key = self.__image_hash(file_id, size, orientation, direction)
         
         resolutions = { "large": 1500, "thumb": 150 }
         maxsize = resolutions.get(size) 
         
-        image = Image.open(BytesIO(image))
-        image.load()
+        with self.__db.file_open(ifile) as f:
+            image = Image.open(f)
+            image.load()
         w, h = image.size
         image_orientation = 'horizontal' if w > h else 'vertical'
             
-        image = self.__image_resize(image, maxsize)
+        if maxsize:
+            image = self.__image_resize(image, maxsize)
 
         if orientation != 'orig' and orientation != image_orientation:
             angle = -90 if direction == 'cw' else 90
@@ -149,11 +494,15 @@ class WebCache():
             
         if image.mode != 'RGB':
             image = image.convert('RGB')
-        image.save(dst, "JPEG", quality=84)
+        buffer = BytesIO()
+        image.save(buffer, "JPEG", quality=84)
+        data = buffer.getvalue()
+        self.__write(key, data)
         
-        print("Converted (%s) to %s, size %d" % (file_id, dst, maxsize))
+        logger.debug("Converted (%s) to %s, size %s", file_id, key, maxsize)
+        count("webcache.images_converted")
 
-        return dst
+        return data
 
 
     def __cached_image_data(self, file_id, size, orientation, direction):
@@ -174,20 +523,19 @@ class WebCache():
             The direction of the rotation ('cw', 'ccw')
 
         """
-        data = None
-        path = os.path.join(self.__path, self.__image_hash(file_id, size, orientation, direction))
-        if not os.path.isfile(path):
-            self.__cache_image(file_id, size, orientation, direction)
-        with open(path, mode="rb") as f:
-            data = f.read()
-            f.close()
+        key = self.__image_hash(file_id, size, orientation, direction)
+        data = self.__read(key)
+        if data == None:
+            data = self.__cache_image(file_id, size, orientation, direction)
         return data
 
     
     def image_data(self, file_id, size, orientation, direction):
         """Return image data.
         
-        Returns the data of a given image file in the database.
+        Returns the data of a given image file in the database, as
+        bytes. Use original_data() to stream the original image
+        instead of reading it in memory.
     
         Parameters
         ----------
@@ -209,10 +557,250 @@ class WebCache():
             raise ValueError("Invalid direction: %s" % direction)
         
         if size == "orig" and orientation == 'orig':
-            print("Using original file")
             ifile = self.__db.get_file(file_id)
             return self.__db.file_read_bytes(ifile), ifile.mimetype
         else:
-            print("Using cached file")
             return self.__cached_image_data(file_id, size, orientation, direction), "image/jpg"
 
+
+    def original_data(self, file_id):
+        """Return the original data of a file.
+
+        Returns an iterator over the contents of a given file in the
+        database, in chunks of bytes, and its mimetype. The file is
+        streamed instead of read in memory, and is not cached.
+    
+        Parameters
+        ----------
+        file_id: str
+            The ID of the file
+
+        """
+        count("webcache.originals")
+        ifile = self.__db.get_file(file_id)
+        return self.__db.file_iter_chunks(ifile), ifile.mimetype
+
+    # Image tiles
+    def image_tile_info(self, file_id):
+        """Return the description of the tile pyramid of an image.
+
+        The returned dictionary contains the 'width' and 'height' of
+        the original image, the 'tile_size', and the number of zoom
+        'levels'. Level 'levels - 1' has the original resolution.
+    
+        Parameters
+        ----------
+        file_id: str
+            The ID of the image file
+
+        """
+        key = self.__hash(["tiles", file_id])
+        data = self.__read(key)
+        if data == None:
+            ifile = self.__db.get_file(file_id)
+            # Image.open() only reads the header of the image
+            with self.__db.file_open(ifile) as f:
+                w, h = Image.open(f).size
+            levels = 1
+            while max(w, h) > WebCache.TILE_SIZE * 2 ** (levels - 1):
+                levels += 1
+            data = json.dumps({ "width": w,
+                                "height": h,
+                                "tile_size": WebCache.TILE_SIZE,
+                                "levels": levels }).encode("utf-8")
+            self.__write(key, data)
+        return json.loads(data)
+
+    def __tile_source(self, file_id, reduce):
+        """Return the original image, decoded at a resolution reduced by
+        the given factor. JPEG images are decoded directly at the
+        reduced resolution (see PIL's Image.draft()), so the tiles of
+        the lower zoom levels do not need the full image. The other
+        formats are decoded completely and then reduced. The last
+        decoded images are kept in memory because the tiles of a map
+        are usually requested in bursts.
+    
+        Parameters
+        ----------
+        file_id: str
+            The ID of the image file
+        reduce: int
+            The reduction factor, a power of two up to TILE_MAX_REDUCE
+
+        """
+        key = (file_id, reduce)
+        with self.__tile_lock:
+            image = self.__tile_sources.get(key)
+            if image != None:
+                self.__tile_sources.move_to_end(key)
+                return image
+        ifile = self.__db.get_file(file_id)
+        with self.__db.file_open(ifile) as f:
+            image = Image.open(f)
+            w, h = image.size
+            if reduce > 1 and image.format == "JPEG":
+                image.draft("RGB", (math.ceil(w / reduce), math.ceil(h / reduce)))
+            image.load()
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        if image.width > math.ceil(w / reduce):
+            image = image.reduce(max(1, image.width // math.ceil(w / reduce)))
+        count("webcache.tile_sources_decoded")
+        with self.__tile_lock:
+            self.__tile_sources[key] = image
+            while len(self.__tile_sources) > WebCache.TILE_SOURCES:
+                self.__tile_sources.popitem(last=False)
+        return image
+
+    def __cache_tile(self, key, file_id, info, z, x, y):
+        """Compute a tile and add it to the cache.
+    
+        Parameters
+        ----------
+        key: str
+            The hash of the tile
+        file_id: str
+            The ID of the image file
+        info: dict
+            The description of the tile pyramid
+        z, x, y: int
+            The zoom level, the column, and the row of the tile
+
+        """
+        scale = 2 ** (info["levels"] - 1 - z)
+        extent = WebCache.TILE_SIZE * scale
+        left, top = x * extent, y * extent
+        right = min(left + extent, info["width"])
+        bottom = min(top + extent, info["height"])
+        source = self.__tile_source(file_id, min(scale, WebCache.TILE_MAX_REDUCE))
+        # The coordinates in the decoded image, which may be reduced
+        sx = source.width / info["width"]
+        sy = source.height / info["height"]
+        image = source.crop((math.floor(left * sx), math.floor(top * sy),
+                             min(math.ceil(right * sx), source.width),
+                             min(math.ceil(bottom * sy), source.height)))
+        size = (max(1, math.ceil((right - left) / scale)),
+                max(1, math.ceil((bottom - top) / scale)))
+        if image.size != size:
+            image = image.resize(size, Image.BILINEAR, reducing_gap=2.0)
+        buffer = BytesIO()
+        image.save(buffer, "JPEG", quality=84)
+        data = buffer.getvalue()
+        self.__write(key, data)
+        return data
+
+    def image_tile(self, file_id, z, x, y):
+        """Return the data of a tile of the image pyramid.
+
+        The tiles are at most TILE_SIZE pixels wide and high. The
+        tiles in the last column and row can be smaller.
+    
+        Parameters
+        ----------
+        file_id: str
+            The ID of the image file
+        z: int
+            The zoom level, between 0 and levels - 1
+        x: int
+            The column of the tile
+        y: int
+            The row of the tile
+
+        """
+        info = self.image_tile_info(file_id)
+        if z < 0 or z >= info["levels"]:
+            raise ValueError("Invalid zoom level: %d" % z)
+        scale = 2 ** (info["levels"] - 1 - z)
+        extent = WebCache.TILE_SIZE * scale
+        if (x < 0 or x * extent >= info["width"]
+            or y < 0 or y * extent >= info["height"]):
+            raise ValueError("Invalid tile: %d/%d/%d" % (z, x, y))
+        key = self.__hash(["tile", file_id, str(z), str(x), str(y)])
+        data = self.__read(key)
+        if data == None:
+            data = self.__cache_tile(key, file_id, info, z, x, y)
+        return data, "image/jpg"
+
+    # Point clouds and meshes
+    def __geometry_data(self, kind, file_id, size, max_vertices):
+        """Return the data of a decimated point cloud or mesh. If the
+        resource is not yet cached, it will be added.
+    
+        Parameters
+        ----------
+        kind: str
+            The resource type ('pointcloud' or 'mesh')
+        file_id: str
+            The ID of the PLY file
+        size: str
+            The requested size ('large' or 'thumb')
+        max_vertices: int
+            The maximum number of vertices of the decimated geometry
+
+        """
+        key = self.__hash([kind, file_id, size])
+        data = self.__read(key)
+        if data == None:
+            ifile = self.__db.get_file(file_id)
+            with self.__db.file_open(ifile) as f:
+                geometry = read_ply_stream(f)
+            if kind == "pointcloud":
+                geometry.faces = None
+            geometry = decimate(geometry, max_vertices)
+            data = write_ply(geometry)
+            self.__write(key, data)
+            logger.debug("Decimated %s (%s) to %d vertices", kind, file_id,
+                         geometry.vertex_count)
+            count("webcache.geometries_decimated")
+        return data
+    
+    def pointcloud_data(self, file_id, size):
+        """Return point cloud data.
+        
+        Returns the data of a given PLY file in the database,
+        decimated to the requested size, as bytes. Any faces in the
+        file are dropped from the decimated versions. Use
+        original_data() to stream the original file.
+    
+        Parameters
+        ----------
+        file_id: str
+            The ID of the PLY file
+        size: str
+            The requested size ('orig', 'large', or 'thumb')
+
+        """
+        if not size in ['orig', 'thumb', 'large']:
+            raise ValueError("Invalid size: %s" % size)
+        if size == "orig":
+            ifile = self.__db.get_file(file_id)
+            return self.__db.file_read_bytes(ifile), ifile.mimetype
+        else:
+            return (self.__geometry_data("pointcloud", file_id, size,
+                                         WebCache.POINTCLOUD_SIZES[size]),
+                    "application/octet-stream")
+    
+    def mesh_data(self, file_id, size):
+        """Return mesh data.
+        
+        Returns the data of a given PLY file in the database,
+        decimated to the requested size, as bytes. Use original_data()
+        to stream the original file.
+    
+        Parameters
+        ----------
+        file_id: str
+            The ID of the PLY file
+        size: str
+            The requested size ('orig', 'large', or 'thumb')
+
+        """
+        if not size in ['orig', 'thumb', 'large']:
+            raise ValueError("Invalid size: %s" % size)
+        if size == "orig":
+            ifile = self.__db.get_file(file_id)
+            return self.__db.file_read_bytes(ifile), ifile.mimetype
+        else:
+            return (self.__geometry_data("mesh", file_id, size,
+                                         WebCache.MESH_SIZES[size]),
+                    "application/octet-stream")
@@ -0,0 +1,97 @@
+import unittest
+import sys
+import time
+import asyncio
+import threading
+from os.path import abspath
+
+sys.path.append(abspath('..'))
+from romidata2.asgi import AsgiApp
+
+
+class Client():
+    """Sends one request to an ASGI application, and disconnects after
+    receiving a number of chunks of the body."""
+    def __init__(self, app, path, disconnect_after=None):
+        self.app = app
+        self.path = path
+        self.disconnect_after = disconnect_after
+        self.status = None
+        self.chunks = []
+        self.requested = False
+        self.gone = asyncio.Event()
+        self.received = asyncio.Event()
+
+    async def receive(self):
+        if not self.requested:
+            self.requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await self.gone.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+        elif message.get("body"):
+            self.chunks.append(message["body"])
+            self.received.set()
+            if self.disconnect_after != None and len(self.chunks) >= self.disconnect_after:
+                self.gone.set()
+
+    async def run(self):
+        scope = {"type": "http", "method": "GET", "path": self.path, "headers": []}
+        await self.app(scope, self.receive, self.send)
+
+
+class TestAsgi(unittest.TestCase):
+    def setUp(self):
+        self.closed = threading.Event()
+        self.app = AsgiApp(self.__wsgi_app, threads=1, max_streams=1)
+
+    def __wsgi_app(self, environ, start_response):
+        if environ["PATH_INFO"] == "/stream":
+            start_response("200 OK", [("Content-Type", "text/event-stream")])
+            return self.__stream()
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return [b"ok"]
+
+    def __stream(self):
+        self.closed.clear()
+        try:
+            while True:
+                time.sleep(0.01)
+                yield b"data: {}\n\n"
+        finally:
+            self.closed.set()
+
+    def test_disconnect(self):
+        async def run():
+            client = Client(self.app, "/stream", disconnect_after=2)
+            await asyncio.wait_for(client.run(), 5)
+            self.assertTrue(self.closed.is_set())
+            # The stream thread is free again
+            client = Client(self.app, "/stream", disconnect_after=1)
+            await asyncio.wait_for(client.run(), 5)
+            self.assertEqual(client.status, 200)
+        asyncio.run(run())
+
+    def test_stream_limit(self):
+        async def run():
+            stream = Client(self.app, "/stream")
+            task = asyncio.ensure_future(stream.run())
+            await stream.received.wait()
+            # The streams don't use the thread of the requests
+            client = Client(self.app, "/")
+            await asyncio.wait_for(client.run(), 5)
+            self.assertEqual(client.chunks, [b"ok"])
+            client = Client(self.app, "/stream")
+            await asyncio.wait_for(client.run(), 5)
+            self.assertEqual(client.status, 503)
+            stream.gone.set()
+            await asyncio.wait_for(task, 5)
+            self.assertTrue(self.closed.is_set())
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+import sys
+import os
+import io
+import shutil
+import tempfile
+from os.path import abspath
+
+sys.path.append(abspath('..'))
+from romidata2.db import FarmDatabase
+from romidata2.blobstore import BlobStore
+
+
+class TestBlobStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_blobs(self):
+        blobs = BlobStore(self.tmpdir, create=True)
+        digest = blobs.put_bytes(b"data")
+        self.assertEqual(blobs.put_stream(io.BytesIO(b"data")), digest)
+        self.assertEqual(blobs.digests(), [digest])
+        paths = [os.path.join(self.tmpdir, "a", "%d.bin" % i) for i in range(2)]
+        for path in paths:
+            blobs.link(digest, path)
+        self.assertEqual(blobs.refcount(digest), 2)
+        self.assertEqual(os.stat(paths[0]).st_ino, os.stat(blobs.path(digest)).st_ino)
+        other = blobs.put_bytes(b"other")
+        blobs.link(other, paths[1])
+        self.assertEqual(blobs.refcount(digest), 1)
+        os.remove(paths[0])
+        self.assertEqual(blobs.collect_garbage(), 1)
+        self.assertEqual(blobs.digests(), [other])
+        self.assertEqual(blobs.verify(), [])
+        os.chmod(paths[1], 0o644)
+        with open(paths[1], "wb") as f:
+            f.write(b"corrupted")
+        self.assertEqual(blobs.verify(), [other])
+
+    def test_database(self):
+        path = os.path.join(self.tmpdir, "db")
+        db = FarmDatabase(path, blobs=True)
+        files = [db.new_file("farm", "farm", "farm", "photo%d" % i,
+                             "farm/photo%d.jpg" % i, "image/jpeg")
+                 for i in range(3)]
+        for f in files:
+            db.file_store_bytes(f, b"image")
+        db.file_store_text(files[2], "text")
+        self.assertEqual(db.file_read_bytes(files[0]), b"image")
+        self.assertEqual(db.file_read_text(files[2]), "text")
+        self.assertEqual(len(db.blobs.digests()), 2)
+        self.assertEqual(db.blobs.refcount(db.blobs.digests()[0]) +
+                         db.blobs.refcount(db.blobs.digests()[1]), 3)
+        # The blob store is used by all the databases opened on the directory
+        self.assertNotEqual(FarmDatabase(path).blobs, None)
+        self.assertEqual(FarmDatabase(os.path.join(self.tmpdir, "db2")).blobs, None)
+
+    def test_streams(self):
+        source = os.path.join(self.tmpdir, "source.bin")
+        with open(source, "wb") as f:
+            f.write(b"0123456789")
+        for blobs in [False, True]:
+            db = FarmDatabase(os.path.join(self.tmpdir, "db%d" % blobs), blobs=blobs)
+            f = db.new_file("farm", "farm", "farm", "data", "farm/data.bin",
+                            "application/octet-stream")
+            db.file_store_path(f, source)
+            self.assertEqual(list(db.file_iter_chunks(f, 4)),
+                             [b"0123", b"4567", b"89"])
+            db.file_store_stream(f, io.BytesIO(b"stream"))
+            with db.file_open(f) as stream:
+                self.assertEqual(stream.read(), b"stream")
+            with self.assertRaises(ValueError):
+                db.file_open(f, "wb")
+
+    def test_new_file_from_path(self):
+        source = os.path.join(self.tmpdir, "source.bin")
+        with open(source, "wb") as f:
+            f.write(b"image")
+        db = FarmDatabase(os.path.join(self.tmpdir, "db"))
+        f = db.new_file_from_path("farm", "farm", "farm", "photo",
+                                  "farm/photo.jpg", "image/jpeg", source)
+        self.assertEqual(db.file_read_bytes(f), b"image")
+        with db.file_open(f) as stream:
+            self.assertEqual(os.fstat(stream.fileno()).st_ino, os.stat(source).st_ino)
+        # Storing new contents does not change the linked source
+        db.file_store_bytes(f, b"other")
+        self.assertEqual(db.file_read_bytes(f), b"other")
+        with open(source, "rb") as stream:
+            self.assertEqual(stream.read(), b"image")
+        f = db.new_file_from_path("farm", "farm", "farm", "moved",
+                                  "farm/moved.jpg", "image/jpeg", source, move=True)
+        self.assertEqual(db.file_read_bytes(f), b"image")
+        self.assertFalse(os.path.exists(source))
+        # With a blob store, the source is copied and keeps its mode
+        with open(source, "wb") as stream:
+            stream.write(b"image")
+        db = FarmDatabase(os.path.join(self.tmpdir, "db2"), blobs=True)
+        for i in range(2):
+            f = db.new_file_from_path("farm", "farm", "farm", "photo%d" % i,
+                                      "farm/photo%d.jpg" % i, "image/jpeg", source)
+        self.assertEqual(db.file_read_bytes(f), b"image")
+        self.assertEqual(db.blobs.refcount(db.blobs.digests()[0]), 2)
+        self.assertTrue(os.stat(source).st_mode & 0o200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,253 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import time
+from os.path import abspath
+
+sys.path.append(abspath('..'))
+from romidata2.db import FarmDatabase
+from romidata2.impl import DefaultFactory, BoundingBox
+from romidata2.responsecache import ResponseCache
+from romidata2.instrument import counters
+
+
+class TestDatabase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db = FarmDatabase(os.path.join(self.tmpdir, "db"))
+        self.factory = DefaultFactory(self.db)
+        self.__create_farm()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def __create_farm(self):
+        self.person = self.factory.create("Person", {
+            "short_name": "julie", "name": "Julie", "email": "",
+            "affiliation": "", "role": "" })
+        self.person.store()
+        self.farm = self.factory.create("Farm", {
+            "short_name": "farm", "name": "Farm", "description": "",
+            "address": "", "country": "FR", "license": "" })
+        self.farm.add_person(self.person)
+        self.zone = self.factory.create("Zone", {
+            "farm": self.farm.id, "short_name": "zone" })
+        self.zone.store()
+        self.farm.add_zone(self.zone)
+        self.crop = self.factory.create("ObservationUnit", {
+            "type": "crop", "short_name": "lettuce",
+            "context": self.farm.id, "zone": self.zone.id })
+        self.crop.zone = self.zone
+        self.farm.add_observation_unit(self.crop)
+        self.zone.add_observation_unit(self.crop)
+        self.crop.store()
+        self.farm.store()
+        for i in range(5):
+            self.add_note("Note %d" % i)
+
+    def add_note(self, text):
+        note = self.factory.create("Note", {
+            "type": "note", "observation_unit": "", "author": "",
+            "date": "2019-04-%02dT12:00:00+02:00" % (len(self.crop.notes) + 1),
+            "text": text })
+        note.author = self.person
+        note.observation_unit = self.crop
+        note.store()
+        self.crop.add_note(note)
+        return note
+
+    def test_iter_notes(self):
+        notes = self.crop.notes
+        page = list(self.crop.iter_notes(notes[1].id, 2))
+        self.assertEqual(page, notes[2:4])
+        self.assertEqual(list(self.crop.iter_notes(notes[-1].id)), [])
+        with self.assertRaises(ValueError):
+            self.crop.iter_notes("unknown")
+
+    def test_parallel_load(self):
+        path = os.path.join(self.tmpdir, "db")
+        self.db.new_file(self.crop.id, "scan", "scan", "image", "image.jpg",
+                         "image/jpeg")
+        expected = FarmDatabase(path)
+        crop = expected.lookup(self.crop.id)
+        db = FarmDatabase(path, workers=4)
+        self.assertEqual([note.id for note in db.lookup(crop.id).notes],
+                         [note.id for note in crop.notes])
+        self.assertEqual([f.serialize() for f in db.select_files(None, None, None)],
+                         [f.serialize() for f in expected.select_files(None, None, None)])
+
+    def test_dangling_references(self):
+        note = self.factory.create("Note", {
+            "type": "note", "observation_unit": self.crop.id,
+            "author": "ghost", "date": "2019-05-01T12:00:00+02:00",
+            "text": "Orphan" })
+        note.store()
+        db = FarmDatabase(os.path.join(self.tmpdir, "db"))
+        self.assertEqual(db.dangling_references,
+                         [("Note", note.id, "author", "ghost")])
+        self.assertEqual(len(db.lookup(self.crop.id).notes), 6)
+        self.assertEqual(db.lookup(self.person.id).id, self.person.id)
+
+    def test_lookup_misses(self):
+        misses = counters.get("db.lookup_misses")
+        cached = counters.get("db.lookup_misses_cached")
+        self.assertEqual(self.db.get_farm("farm"), self.farm)
+        self.assertEqual(self.db.get_farm("farm"), self.farm)
+        self.assertEqual(counters.get("db.lookup_misses"), misses + 1)
+        self.assertEqual(counters.get("db.lookup_misses_cached"), cached + 1)
+        # An object stored by another process is a miss until it is
+        # loaded by refresh()
+        other = FarmDatabase(os.path.join(self.tmpdir, "db"))
+        note = DefaultFactory(other).create("Note", {
+            "type": "note", "observation_unit": self.crop.id, "author": "",
+            "date": "2019-05-01T12:00:00+02:00", "text": "Other" })
+        note.store()
+        self.assertEqual(self.db.lookup(note.id), None)
+        self.assertEqual(counters.get("db.lookup_misses"), misses + 2)
+        self.assertEqual(self.db.refresh(), 1)
+        self.assertEqual(self.db.lookup(note.id).text, "Other")
+        self.assertIs(self.db.lookup(note.id), self.db.lookup(note.id))
+        # A missing ID that is stored later is no longer a miss
+        person = self.factory.create("Person", {
+            "id": "ghost", "short_name": "ghost", "name": "", "email": "",
+            "affiliation": "", "role": "" })
+        self.assertEqual(self.db.lookup("ghost"), None)
+        person.store()
+        self.assertIs(self.db.lookup("ghost"), person)
+
+    def test_refresh(self):
+        self.assertEqual(self.db.refresh(), 0)
+        other = FarmDatabase(os.path.join(self.tmpdir, "db"))
+        note = DefaultFactory(other).create("Note", {
+            "type": "note", "observation_unit": self.crop.id,
+            "author": self.person.id, "date": "2019-05-01T12:00:00+02:00",
+            "text": "Other" })
+        note.store()
+        changed = other.lookup(self.crop.id)
+        changed.short_name = "Changed"
+        changed.store()
+        f = other.new_file(self.crop.id, "crop", self.crop.id, "photo",
+                           "photo.jpg", "image/jpeg")
+        self.assertEqual(self.db.refresh(), 3)
+        self.assertEqual(self.db.refresh(), 0)
+        self.assertEqual(self.crop.short_name, "Changed")
+        self.assertIs(self.db.lookup(self.crop.id), self.crop)
+        self.assertEqual(self.db.lookup(note.id).observation_unit, self.crop)
+        self.assertEqual(self.db.get_file(f.id).path, "photo.jpg")
+        self.assertEqual(len(self.crop.notes), 6)
+        self.db.start_watcher(0.01)
+        self.db.stop_watcher()
+
+    def test_refresh_skips_directories(self):
+        path = os.path.join(self.tmpdir, "db")
+        directories = [os.path.join(path, "files")] + [
+            os.path.join(path, "objects", name)
+            for name in os.listdir(os.path.join(path, "objects"))]
+        past = time.time() - 60
+        for directory in directories:
+            os.utime(directory, (past, past))
+        self.db.refresh()
+        scanned = counters.get("db.directories_scanned")
+        self.assertEqual(self.db.refresh(), 0)
+        self.assertEqual(counters.get("db.directories_scanned"), scanned)
+        # Only the directory of the new object is scanned
+        other = FarmDatabase(path)
+        DefaultFactory(other).create("Note", {
+            "type": "note", "observation_unit": self.crop.id, "author": "",
+            "date": "2019-05-01T12:00:00+02:00", "text": "Other" }).store()
+        self.assertEqual(self.db.refresh(), 1)
+        self.assertEqual(counters.get("db.directories_scanned"), scanned + 1)
+
+    def test_shared(self):
+        path = os.path.join(self.tmpdir, "db")
+        self.assertFalse(self.db.shared)
+        writer = FarmDatabase(path, shared=True)
+        reader = FarmDatabase(path)
+        self.assertTrue(reader.shared)
+        note = DefaultFactory(writer).create("Note", {
+            "type": "note", "observation_unit": self.crop.id,
+            "author": self.person.id, "date": "2019-05-01T12:00:00+02:00",
+            "text": "Shared" })
+        note.store()
+        writer.new_file(note.id, "note", note.id, "photo", "photo.jpg",
+                        "image/jpeg")
+        self.assertEqual(writer.refresh(), 0)
+        self.assertEqual(reader.refresh(), 2)
+        self.assertEqual(reader.refresh(), 0)
+        crop = reader.lookup(self.crop.id)
+        self.assertEqual(crop.notes[-1].text, "Shared")
+        self.assertEqual(len(crop.notes), 6)
+        self.assertEqual([f for f in os.listdir(os.path.join(path, "objects", "Note"))
+                          if not f.endswith(".json")], [])
+        # A truncated log is replaced by a scan of the directories
+        open(os.path.join(path, "changes.log"), "w").close()
+        self.assertEqual(reader.refresh(), 0)
+
+    def test_data_file_changes(self):
+        path = os.path.join(self.tmpdir, "db")
+        for shared in [False, True]:
+            writer = FarmDatabase(path, shared=shared)
+            reader = FarmDatabase(path)
+            f = writer.new_file(self.crop.id, "crop", self.crop.id, "results",
+                                "results.json", "application/json")
+            writer.file_store_json(f, {"count": 1})
+            reader.refresh()
+            responses = ResponseCache(reader)
+            responses.put("results", {"count": 1}, [f.id])
+            writer.file_store_json(f, {"count": 2})
+            # The other process reloads the record and drops the
+            # responses that depend on the file
+            self.assertEqual(reader.refresh(), 1)
+            self.assertEqual(responses.get("results"), None)
+            self.assertEqual(reader.file_read_json(reader.get_file(f.id)),
+                             {"count": 2})
+            self.assertEqual([name for name in os.listdir(os.path.join(path, "data"))
+                              if name.endswith(".tmp")], [])
+
+    def test_clone(self):
+        crop = self.crop.clone()
+        self.assertNotEqual(crop.id, self.crop.id)
+        self.assertIs(crop.database, self.db)
+        self.assertIs(crop.context, self.farm)
+        self.assertEqual(crop.notes, [])
+        crop.factor_values["genotype"] = "WT"
+        self.assertEqual(self.crop.factor_values, {})
+        self.assertEqual(len(self.crop.notes), 5)
+
+    def test_scan_images(self):
+        scan = self.factory.create("Scan", {
+            "observation_unit": self.crop.id, "date": "2019-04-01T12:00:00+02:00",
+            "people": [], "camera": "", "scanning_device": "", "factor_values": {},
+            "scan_path": {"short_name": "circular_36", "type": "circular",
+                          "parameters": {"radius": 350, "nb_points": 36}} })
+        scan.store()
+        self.assertEqual(scan.images, [])
+        # The images are found without linking the scan again
+        images = [self.db.new_file(scan.id, "scan", scan.id, "image-%d" % i,
+                                   "scan/image-%d.jpg" % i, "image/jpeg")
+                  for i in range(3)]
+        self.assertEqual([f.id for f in scan.images], [f.id for f in images])
+        self.assertEqual(scan.clone().images, [])
+
+    def test_clone_scan(self):
+        scan = self.factory.create("Scan", {
+            "observation_unit": self.crop.id, "date": "2019-04-01T12:00:00+02:00",
+            "people": [], "camera": "", "scanning_device": "", "factor_values": {},
+            "scan_path": {"short_name": "circular_36", "type": "circular",
+                          "parameters": {"radius": 350, "nb_points": 36}} })
+        scan.bounding_box = BoundingBox(self.factory, self.db, "BoundingBox")
+        scan.bounding_box.parse({"x": [0, 10], "y": [0, 20], "z": [0, 30]})
+        c = scan.clone()
+        self.assertIsNot(c.bounding_box, scan.bounding_box)
+        c.bounding_box.x[1] = 5
+        c.bounding_box.z = [1, 2]
+        self.assertEqual(scan.bounding_box.serialize(),
+                         {"x": [0, 10], "y": [0, 20], "z": [0, 30]})
+        self.assertEqual(c.bounding_box.serialize(),
+                         {"x": [0, 5], "y": [0, 20], "z": [1, 2]})
+
+
+if __name__ == '__main__':
+    unittest.main()
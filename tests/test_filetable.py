@@ -0,0 +1,81 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from os.path import abspath
+
+sys.path.append(abspath('..'))
+from romidata2.db import FarmDatabase
+from romidata2.filetable import FileTable
+
+
+class TestFileTable(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def __properties(self, i, source_id, date="2020-08-26T12:00:00+02:00"):
+        return { "id": "file%d" % i, "owner": "farm",
+                 "source_name": "scan", "source_id": source_id,
+                 "short_name": "image-%d" % (i % 2), "date_created": date,
+                 "path": "scan/image-%d.jpg" % i, "mimetype": "image/jpeg" }
+
+    def test_select(self):
+        table = FileTable(capacity=1)
+        for i in range(10):
+            table.add(self.__properties(i, "scan%d" % (i // 5)))
+        self.assertEqual(len(table), 10)
+        ids = [f.id for f in table.select("scan", "scan1", "image-0")]
+        self.assertEqual(ids, ["file6", "file8"])
+        self.assertEqual(len(table.select(None, None, None)), 10)
+        self.assertEqual(table.select("scan", "unknown", None), [])
+        f = table.get("file3")
+        self.assertEqual(f.serialize(), self.__properties(3, "scan0"))
+        self.assertEqual(table.get("unknown"), None)
+        f.short_name = "renamed"
+        self.assertEqual([f.id for f in table.select(None, None, "renamed")],
+                         ["file3"])
+
+    def test_source_index(self):
+        table = FileTable(capacity=1)
+        for i in range(6):
+            table.add(self.__properties(i, "scan%d" % (i % 2)))
+        ids = lambda source_id: [f.id for f in table.select("scan", source_id, None)]
+        self.assertEqual(ids("scan0"), ["file0", "file2", "file4"])
+        # A record that changes source moves to the rows of the new source
+        table.get("file2").source_id = "scan1"
+        self.assertEqual(ids("scan0"), ["file0", "file4"])
+        self.assertEqual(ids("scan1"), ["file1", "file2", "file3", "file5"])
+        table.add(self.__properties(5, "scan0"))
+        self.assertEqual(ids("scan0"), ["file0", "file4", "file5"])
+        table.get("file4").source_name = "analysis"
+        self.assertEqual(ids("scan0"), ["file0", "file5"])
+        self.assertEqual([f.id for f in table.select("analysis", "scan0", "image-0")],
+                         ["file4"])
+
+    def test_dates(self):
+        table = FileTable()
+        for date in ["2020-08-26T12:00:00.123456-05:30",
+                     "1960-01-01T00:00:00+00:00",
+                     "2020-08-26T12:00:00"]:
+            f = table.add(self.__properties(0, "scan", date))
+            self.assertEqual(f.date_created, datetime.fromisoformat(date))
+            self.assertEqual(f.date_created.isoformat(), date)
+
+    def test_database(self):
+        path = os.path.join(self.tmpdir, "db")
+        db = FarmDatabase(path)
+        f = db.new_file("farm", "scan", "scan0", "image", "image.jpg",
+                        "image/jpeg")
+        self.assertEqual(db.get_file(f.id), f)
+        db = FarmDatabase(path)
+        self.assertEqual(db.get_file(f.id).serialize(), f.serialize())
+        self.assertEqual(db.select_files("scan", "scan0", None)[0].database, db)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import unittest
+import sys
+import os
+import json
+import shutil
+import tempfile
+from os.path import abspath, dirname, join
+
+from PIL import Image
+
+sys.path.append(abspath('..'))
+from romidata2.db import FarmDatabase
+from romidata2.impl import DefaultFactory
+from romidata2.protodb import Prototypes
+from romidata2.fsdbimport import ScanImporter, FsdbScan
+
+
+class TestFsdbImport(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db = FarmDatabase(join(self.tmpdir, "db"))
+        self.factory = DefaultFactory(self.db)
+        self.proto = Prototypes(join(dirname(abspath(__file__)), "..",
+                                     "examples", "prototypes"))
+        self.__create_farm()
+        self.fsdb = join(self.tmpdir, "fsdb")
+        self.__create_scan("scan1")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def __create_farm(self):
+        person = self.factory.create("Person", {
+            "short_name": "julie", "name": "Julie", "email": "",
+            "affiliation": "", "role": "" })
+        person.store()
+        self.farm = self.factory.create("Farm", {
+            "short_name": "farm", "name": "Farm", "description": "",
+            "address": "", "country": "FR", "license": "" })
+        self.farm.add_person(person)
+        camera = self.proto.get_camera("picamera_v2")
+        scanning_device = self.proto.get_scanning_device("camera_rail")
+        for device in [camera, scanning_device]:
+            device.owner = self.farm
+            self.db.store(device)
+        self.farm.add_camera(camera)
+        self.farm.add_scanning_device(scanning_device)
+        zone = self.factory.create("Zone", {
+            "farm": self.farm.id, "short_name": "zone" })
+        zone.store()
+        self.farm.add_zone(zone)
+        self.crop = self.factory.create("ObservationUnit", {
+            "type": "crop", "short_name": "lettuce",
+            "context": self.farm.id, "zone": zone.id })
+        self.crop.zone = zone
+        self.farm.add_observation_unit(self.crop)
+        self.crop.store()
+        self.farm.store()
+
+    def __write_image(self, path, size, format):
+        os.makedirs(dirname(path), exist_ok=True)
+        Image.new("RGB", size).save(path, format)
+
+    def __write_json(self, path, data):
+        os.makedirs(dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+    def __create_scan(self, scan_id):
+        path = join(self.fsdb, scan_id)
+        filesets = {"images": [], "maps": [], "individual_plants": []}
+        for i in range(4):
+            filesets["images"].append({"id": "rgb-%d" % i, "file": "rgb-%d.jpg" % i})
+            self.__write_image(join(path, "images", "rgb-%d.jpg" % i), (64, 48), "JPEG")
+        filesets["maps"].append({"id": "map", "file": "map.png"})
+        self.__write_image(join(path, "maps", "map.png"), (300, 100), "PNG")
+        for name in ["3", "3_mask"]:
+            filesets["individual_plants"].append({"id": name, "file": "%s.png" % name})
+            self.__write_image(join(path, "individual_plants", "%s.png" % name),
+                               (20, 10), "PNG")
+        self.__write_json(join(path, "metadata", "individual_plants", "3.json"),
+                          {"loc": [1, 2], "id": 3, "PLA": 12.5})
+        self.__write_json(join(path, "metadata", "metadata.json"), {"date": "20190416"})
+        self.__write_json(join(path, "files.json"), {"filesets": [
+            {"id": key, "files": files} for key, files in filesets.items()]})
+
+    def __importer(self, **kwargs):
+        return ScanImporter(self.db, self.factory, self.proto, self.farm, self.crop,
+                            ["julie"], "picamera_v2", "camera_rail", "linear_4m",
+                            workers=4, **kwargs)
+
+    def test_fsdb_scan(self):
+        scan = FsdbScan(self.fsdb, "scan1")
+        self.assertTrue(scan.exists())
+        self.assertEqual(scan.metadata("date"), "20190416")
+        self.assertEqual([f.id for f in scan.get_files("maps")], ["map"])
+        self.assertEqual(scan.get_files("unknown"), None)
+        self.assertEqual(scan.get_files("individual_plants")[0].metadata()["PLA"], 12.5)
+        self.assertFalse(FsdbScan(self.fsdb, "unknown").exists())
+
+    def test_import(self):
+        progress = []
+        stats = self.__importer(progress=lambda *args: progress.append(args)).import_scans(
+            self.fsdb, ["scan1", "unknown"])
+        self.assertEqual(stats.files, 7)
+        self.assertEqual(progress[-1], ("scan1", 7, 7))
+        self.assertEqual(len(self.crop.scans), 1)
+        self.assertEqual(len(self.crop.children), 1)
+        db = FarmDatabase(join(self.tmpdir, "db"))
+        scan = db.lookup(self.crop.scans[0].id)
+        self.assertEqual(db.dangling_references, [])
+        self.assertEqual(scan.date.strftime("%Y%m%d"), "20190416")
+        self.assertEqual(len(db.select_files("scan", scan.id, None)), 4)
+        analyses = {a.short_name: a for a in scan.analyses}
+        self.assertEqual(len(analyses), 2)
+        stitching = analyses["stitching"]
+        plant_analysis = analyses["plant_analysis"]
+        results = db.file_read_json(stitching.results_file)
+        self.assertEqual((results["width"], results["height"]), (300, 100))
+        with open(join(self.fsdb, "scan1", "maps", "map.png"), "rb") as f:
+            self.assertEqual(db.file_read_bytes(db.get_file(results["map"])), f.read())
+        plants = db.file_read_json(plant_analysis.results_file)["plants"]
+        self.assertEqual(len(plants), 1)
+        self.assertEqual(plants[0]["PLA"], 12.5)
+        self.assertEqual((plants[0]["width"], plants[0]["height"]), (20, 10))
+        self.assertNotEqual(plants[0]["mask"], plants[0]["image"])
+
+    def test_dry_run(self):
+        stats = self.__importer(dry_run=True).import_scans(self.fsdb, ["scan1"])
+        self.assertEqual(stats.files, 7)
+        self.assertTrue(stats.bytes > 0)
+        self.assertEqual(self.crop.scans, [])
+        self.assertEqual(self.db.select_files(None, None, None), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,7 +5,7 @@ import copy
 
 sys.path.append(abspath('..'))
 from romidata2.db import Database
-from romidata2.impl import DefaultFactory
+from romidata2.impl import DefaultFactory, Person
 
 
 
@@ -137,7 +137,43 @@ class TestRomiData(unittest.TestCase):
         self.assertEqual(obj.serialize(), values)
         self.assertEqual(obj.values, values)
 
-        
+    # Factory
+
+    def test_register(self):
+        class Label(Person):
+            __slots__ = ()
+        factory = DefaultFactory()
+        factory.register("Label", Label)
+        objs = factory.create_list("Label", [self.values["Person"]] * 2)
+        self.assertEqual([type(obj) for obj in objs], [Label, Label])
+        self.assertEqual(objs[0].serialize(), self.values["Person"])
+        with self.assertRaises(ValueError):
+            self.factory.create("Label", self.values["Person"])
+
+    def test_fast_constructors(self):
+        values = { "owner": "farm", "source_name": "scan", "source_id": "scan",
+                   "short_name": "image", "date_created": "2020-08-26T12:00:00+02:00",
+                   "path": "scan/image.jpg", "mimetype": "image/jpeg" }
+        note = { "observation_unit": "crop", "author": "", "type": "note",
+                 "date": "2020-08-26T12:00:00+02:00", "text": "Note" }
+        for classname, values in [("File", values), ("Note", note)]:
+            fast = self.factory.create(classname, values)
+            obj = DefaultFactory.CLASSES[classname](self.factory, None, classname)
+            obj.parse(values)
+            self.assertEqual(type(fast), type(obj))
+            self.assertEqual(fast.modified, obj.modified)
+            # Without an ID in the properties, one is generated
+            self.assertEqual(len(fast.id), len(obj.id))
+            fast.id = obj.id
+            self.assertEqual(fast.serialize(), obj.serialize())
+        # A registered class replaces the fast constructor
+        class Memo(DefaultFactory.CLASSES["Note"]):
+            __slots__ = ()
+        factory = DefaultFactory()
+        factory.register("Note", Memo)
+        self.assertEqual(type(factory.create("Note", note)), Memo)
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,140 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+from os.path import abspath
+
+sys.path.append(abspath('..'))
+from romidata2.db import FarmDatabase
+from romidata2.impl import DefaultFactory
+from romidata2.snapshot import write_snapshot, FarmSnapshotDatabase
+from romidata2.webcache import WebCache
+from romidata2.webapp import FarmWebApp
+from romidata2.instrument import counters
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "db")
+        self.db = FarmDatabase(self.path)
+        self.factory = DefaultFactory(self.db)
+        self.__create_farm()
+        write_snapshot(self.db, os.path.join(self.path, "snapshot.bin"))
+        self.snapshot = FarmSnapshotDatabase(os.path.join(self.path, "snapshot.bin"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def __create_farm(self):
+        person = self.factory.create("Person", {
+            "short_name": "julie", "name": "Julie", "email": "",
+            "affiliation": "", "role": "" })
+        person.store()
+        self.farm = self.factory.create("Farm", {
+            "short_name": "farm", "name": "Farm", "description": "",
+            "address": "", "country": "FR", "license": "" })
+        self.farm.add_person(person)
+        zone = self.factory.create("Zone", {
+            "farm": self.farm.id, "short_name": "zone" })
+        zone.store()
+        self.farm.add_zone(zone)
+        self.crop = self.factory.create("ObservationUnit", {
+            "type": "crop", "short_name": "lettuce",
+            "context": self.farm.id, "zone": zone.id })
+        self.crop.zone = zone
+        self.farm.add_observation_unit(self.crop)
+        zone.add_observation_unit(self.crop)
+        self.crop.store()
+        self.farm.store()
+        for i in range(3):
+            note = self.factory.create("Note", {
+                "type": "note", "observation_unit": self.crop.id,
+                "author": person.id, "date": "2019-04-%02dT12:00:00+02:00" % (i + 1),
+                "text": "Note %d" % i })
+            note.store()
+        self.file = self.db.new_file(self.crop.id, "crop", self.crop.id,
+                                     "notes", "crop/notes.txt", "text/plain")
+        self.db.file_store_text(self.file, "text")
+
+    def test_lookup(self):
+        crop = self.snapshot.lookup(self.crop.id)
+        self.assertEqual(crop.serialize(), self.crop.serialize())
+        self.assertEqual([n.text for n in crop.notes],
+                         [n.text for n in FarmDatabase(self.path).lookup(self.crop.id).notes])
+        self.assertEqual(crop.context.id, self.snapshot.get_farm("farm").id)
+        self.assertIs(crop.notes[0].observation_unit, crop)
+        self.assertIs(self.snapshot.lookup(crop.id), crop)
+        self.assertEqual(self.snapshot.lookup("unknown"), None)
+        self.assertEqual(len(self.snapshot.select("Note")), 3)
+        self.assertEqual(self.snapshot.lookup_many([crop.id, "x"]), [crop, None])
+
+    def test_lazy_children(self):
+        # A second crop of the same farm, with notes of its own
+        other = self.factory.create("ObservationUnit", {
+            "type": "crop", "short_name": "tomato", "context": self.farm.id })
+        self.farm.add_observation_unit(other)
+        other.store()
+        for i in range(10):
+            self.factory.create("Note", {
+                "type": "note", "observation_unit": other.id, "author": "",
+                "date": "2019-04-01T12:00:00+02:00", "text": "Other %d" % i }).store()
+        path = os.path.join(self.path, "snapshot.bin")
+        write_snapshot(self.db, path)
+        snapshot = FarmSnapshotDatabase(path)
+        created = lambda: counters.snapshot().get("snapshot.objects_created", 0)
+        start = created()
+        crop = snapshot.lookup(self.crop.id)
+        self.assertEqual(len(crop.notes), 3)
+        # The crop, its farm and the person, the children of the farm
+        # (the two crops and the zone), and the notes of the crop, but
+        # not those of the other crop
+        self.assertEqual(created() - start, 8)
+        farm = crop.context
+        self.assertEqual(sorted(c.short_name for c in farm.observation_units),
+                         ["lettuce", "tomato"])
+        self.assertTrue(any(c is crop for c in farm.observation_units))
+        self.assertEqual(len(snapshot.lookup(other.id).notes), 10)
+        self.assertIs(crop.zone.observation_units[0], crop)
+
+    def test_cache(self):
+        path = os.path.join(self.path, "snapshot.bin")
+        snapshot = FarmSnapshotDatabase(path, cache_size=1)
+        crop = snapshot.lookup(self.crop.id)
+        self.assertIs(snapshot.lookup(self.crop.id), crop)
+        farm = snapshot.lookup(self.farm.id)
+        self.assertIs(snapshot.lookup(self.farm.id), farm)
+        # The crop was dropped: it is created again
+        other = snapshot.lookup(self.crop.id)
+        self.assertIsNot(other, crop)
+        self.assertEqual(other.serialize(), crop.serialize())
+
+    def test_files(self):
+        f = self.snapshot.get_file(self.file.id)
+        self.assertEqual(f.serialize(), self.file.serialize())
+        ids = lambda files: [f.id for f in files]
+        self.assertEqual(ids(self.snapshot.select_files("crop", self.crop.id, None)), [f.id])
+        self.assertEqual(ids(self.snapshot.select_files("crop", None, None)), [f.id])
+        self.assertEqual(ids(self.snapshot.select_files("crop", None, "notes")), [f.id])
+        self.assertEqual(self.snapshot.select_files("crop", self.crop.id, "x"), [])
+        self.assertEqual(self.snapshot.select_files("scan", self.crop.id, None), [])
+        self.assertEqual(self.snapshot.select_files("cro", None, None), [])
+        self.assertEqual(self.snapshot.select_files("crops", None, None), [])
+        self.assertEqual(self.snapshot.file_read_text(f), "text")
+        with self.assertRaises(NotImplementedError):
+            self.snapshot.store(self.crop)
+
+    def test_webapp(self):
+        urls = ["/farms", "/farms/%s" % self.farm.id, "/crops/%s" % self.crop.id]
+        responses = []
+        for db in [FarmDatabase(self.path), self.snapshot]:
+            app = FarmWebApp(db, WebCache(db, "farms",
+                                          os.path.join(self.tmpdir, "cache")))
+            client = app.test_client()
+            responses.append([client.get(url).get_json() for url in urls])
+        self.assertEqual(responses[0], responses[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,239 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import gzip
+import json
+from os.path import abspath
+
+sys.path.append(abspath('..'))
+from romidata2.db import FarmDatabase
+from romidata2.impl import DefaultFactory
+from romidata2.webcache import WebCache
+from romidata2.webapp import FarmWebApp, ChangeStream
+from romidata2.responsecache import ResponseCache
+from romidata2.changefeed import ChangeFeed
+
+
+class TestWebApp(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db = FarmDatabase(os.path.join(self.tmpdir, "db"))
+        self.factory = DefaultFactory(self.db)
+        self.__create_farm()
+        self.app = FarmWebApp(self.db, WebCache(self.db, "farms",
+                                                os.path.join(self.tmpdir, "cache")))
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def __create_farm(self):
+        self.person = self.factory.create("Person", {
+            "short_name": "julie", "name": "Julie", "email": "",
+            "affiliation": "", "role": "" })
+        self.person.store()
+        self.farm = self.factory.create("Farm", {
+            "short_name": "farm", "name": "Farm", "description": "",
+            "address": "", "country": "FR", "license": "" })
+        self.farm.add_person(self.person)
+        self.zone = self.factory.create("Zone", {
+            "farm": self.farm.id, "short_name": "zone" })
+        self.zone.store()
+        self.farm.add_zone(self.zone)
+        self.crop = self.factory.create("ObservationUnit", {
+            "type": "crop", "short_name": "lettuce",
+            "context": self.farm.id, "zone": self.zone.id })
+        self.crop.zone = self.zone
+        self.farm.add_observation_unit(self.crop)
+        self.zone.add_observation_unit(self.crop)
+        self.crop.store()
+        self.farm.store()
+        for i in range(5):
+            self.add_note("Note %d" % i)
+
+    def add_note(self, text):
+        note = self.factory.create("Note", {
+            "type": "note", "observation_unit": "", "author": "",
+            "date": "2019-04-%02dT12:00:00+02:00" % (len(self.crop.notes) + 1),
+            "text": text })
+        note.author = self.person
+        note.observation_unit = self.crop
+        note.store()
+        self.crop.add_note(note)
+        return note
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def test_response_cache(self):
+        url = "/crops/%s" % self.crop.id
+        crop = self.get(url)
+        self.assertEqual(len(crop["notes"]), 5)
+        self.get("/farms/%s" % self.farm.id)
+        self.get("/farms")
+        self.assertEqual(len(self.app.responses), 3)
+        self.assertEqual(self.get(url), crop)
+        self.assertEqual(len(self.app.responses), 3)
+        # Storing a note invalidates the crop and the farm, but not
+        # the list of farms
+        self.add_note("New note")
+        self.assertEqual(len(self.app.responses), 1)
+        self.assertEqual(len(self.get(url)["notes"]), 6)
+
+    def test_pagination(self):
+        url = "/crops/%s?limit=2" % self.crop.id
+        ids = []
+        while True:
+            crop = self.get(url)
+            self.assertLessEqual(len(crop["notes"]), 2)
+            ids.extend(note["id"] for note in crop["notes"])
+            if not crop["cursor"]:
+                break
+            url = "/crops/%s?limit=2&cursor=%s" % (self.crop.id, crop["cursor"])
+        self.assertEqual(ids, [note.id for note in self.crop.notes])
+        response = self.client.get("/crops/%s?cursor=xyz" % self.crop.id)
+        self.assertEqual(response.status_code, 400)
+
+    def test_field_selection(self):
+        crop = self.get("/crops/%s?fields=short_name,notes" % self.crop.id)
+        self.assertEqual(set(crop.keys()), set(["id", "short_name", "notes"]))
+        farms = self.get("/farms?fields=name&limit=1")
+        self.assertEqual(farms, [{"id": self.farm.id, "name": "Farm"}])
+
+    def test_objects(self):
+        note = self.crop.notes[0]
+        ids = [self.crop.id, note.id, "unknown", self.person.id]
+        r = self.get("/objects?ids=%s" % ",".join(ids))
+        self.assertEqual([o["resource"] for o in r["objects"]], ["crops", "notes"])
+        self.assertEqual(r["objects"][1]["value"],
+                         self.get("/notes/%s" % note.id))
+        self.assertEqual(r["missing"], ["unknown", self.person.id])
+        response = self.client.post("/objects", json={"ids": ids})
+        self.assertEqual(response.get_json(), r)
+        response = self.client.post("/objects", json={"ids": "x"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_compression(self):
+        self.add_note("x" * 2000)
+        url = "/crops/%s" % self.crop.id
+        plain = self.get(url)
+        for i in range(2):
+            response = self.client.get(url, headers={"Accept-Encoding": "gzip"})
+            self.assertEqual(response.headers["Content-Encoding"], "gzip")
+            self.assertEqual(json.loads(gzip.decompress(response.data)), plain)
+        response = self.client.get("/notes/%s" % self.crop.notes[0].id,
+                                   headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_response_variants(self):
+        responses = ResponseCache(self.db)
+        value = {"a": 1}
+        responses.put("a", value, ["x"])
+        responses.put_variant("a", value, "gzip", b"data")
+        self.assertEqual(responses.get_variant("a", value, "gzip"), b"data")
+        self.assertEqual(responses.get_variant("a", {"a": 1}, "gzip"), None)
+        responses.invalidate(["x"])
+        responses.put_variant("a", value, "gzip", b"data")
+        self.assertEqual(responses.get_variant("a", value, "gzip"), None)
+
+    def test_changes(self):
+        last = self.get("/changes")["last"]
+        note = self.add_note("New note")
+        r = self.get("/changes?since=%d" % last)
+        self.assertEqual(len(r["changes"]), 1)
+        self.assertEqual(r["changes"][0]["id"], note.id)
+        self.assertIn(self.crop.id, r["changes"][0]["related"])
+        # Only the IDs are related, not the text or the type of the note
+        self.assertNotIn("New note", r["changes"][0]["related"])
+        self.assertNotIn("note", r["changes"][0]["related"])
+        self.assertFalse(r["reset"])
+        r = self.get("/changes?since=%d&ids=%s" % (last, self.farm.id))
+        self.assertEqual(r["changes"], [])
+        r = self.get("/changes?since=%d" % (r["last"] + 10))
+        self.assertTrue(r["reset"])
+
+    def test_change_stream(self):
+        last = self.get("/changes")["last"]
+        note = self.add_note("New note")
+        response = self.client.get("/changes/stream",
+                                   headers={"Last-Event-ID": str(last)},
+                                   buffered=False)
+        self.assertEqual(response.mimetype, "text/event-stream")
+        events = response.iter_encoded()
+        next(events)
+        event = next(events).decode("utf-8")
+        self.assertIn("id: %d\n" % (last + 1), event)
+        self.assertIn(note.id, event)
+        response.close()
+
+    def test_change_stream_lifetime(self):
+        lifetime = ChangeStream.MAX_LIFETIME
+        ChangeStream.MAX_LIFETIME = 0.1
+        try:
+            last = self.get("/changes")["last"]
+            response = self.client.get("/changes/stream",
+                                       headers={"Last-Event-ID": str(last)})
+            # The stream ends, and only has the retry delay and heartbeats
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.get_data(as_text=True).startswith("retry: 5000"))
+        finally:
+            ChangeStream.MAX_LIFETIME = lifetime
+
+    def test_change_feed_disabled(self):
+        app = FarmWebApp(self.db, WebCache(self.db, "farms",
+                                           os.path.join(self.tmpdir, "cache")),
+                         change_feed=False)
+        client = app.test_client()
+        self.assertEqual(client.get("/changes").status_code, 503)
+        self.assertEqual(client.get("/changes/stream").status_code, 503)
+        with self.assertRaises(ValueError):
+            ChangeFeed(self.db, max_changes=0)
+
+    def test_change_feed(self):
+        feed = ChangeFeed(self.db, max_changes=3)
+        for i in range(5):
+            feed.database_changed("created", "Note", "note%d" % i, [])
+        changes, last, reset = feed.changes(3)
+        self.assertEqual([c["id"] for c in changes], ["note3", "note4"])
+        self.assertEqual((last, reset), (5, False))
+        changes, last, reset = feed.changes(0)
+        self.assertEqual(len(changes), 3)
+        self.assertTrue(reset)
+        changes, last, reset = feed.changes(5, timeout=0.01)
+        self.assertEqual((changes, last, reset), ([], 5, False))
+
+    def test_refresh(self):
+        # The responses that depend on the objects loaded by refresh()
+        # are invalidated
+        url = "/crops/%s" % self.crop.id
+        self.assertEqual(len(self.get(url)["notes"]), 5)
+        other = FarmDatabase(os.path.join(self.tmpdir, "db"))
+        DefaultFactory(other).create("Note", {
+            "type": "note", "observation_unit": self.crop.id,
+            "author": self.person.id, "date": "2019-05-01T12:00:00+02:00",
+            "text": "Other" }).store()
+        self.assertEqual(self.db.refresh(), 1)
+        self.assertEqual(len(self.get(url)["notes"]), 6)
+
+    def test_response_cache_dependencies(self):
+        responses = ResponseCache(self.db, max_entries=2)
+        responses.put("a", 1, ["x", "y"])
+        responses.put("b", 2, ["y"])
+        responses.invalidate(["x"])
+        self.assertEqual(responses.get("a"), None)
+        self.assertEqual(responses.get("b"), 2)
+        responses.put("c", 3, ["z"])
+        responses.put("d", 4, ["z"])
+        self.assertEqual(responses.get("b"), None)
+        generation = responses.generation
+        responses.invalidate(["z"])
+        responses.put("e", 5, ["w"], generation)
+        self.assertEqual(len(responses), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,241 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+from os.path import abspath
+from io import BytesIO
+
+from PIL import Image
+import numpy as np
+
+sys.path.append(abspath('..'))
+from romidata2.db import FarmDatabase
+from romidata2.webcache import WebCache, MemoryCache
+from romidata2 import geometry
+from romidata2.geometry import Geometry, read_ply, read_ply_stream, write_ply
+from romidata2 import instrument
+
+
+class TestWebCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cachedir = os.path.join(self.tmpdir, "cache")
+        self.db = FarmDatabase(os.path.join(self.tmpdir, "db"))
+        self.image = self.__new_image("image", 800, 600)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def __new_image(self, short_name, width, height, fmt="JPEG"):
+        image = Image.new("RGB", (width, height), (20, 120, 220))
+        buffer = BytesIO()
+        image.save(buffer, fmt)
+        ifile = self.db.new_file("farm", "scan", "scan", short_name,
+                                 "%s.jpg" % short_name, "image/jpeg")
+        self.db.file_store_bytes(ifile, buffer.getvalue())
+        return ifile
+
+    def __cached_files(self):
+        r = []
+        for dirpath, dirnames, filenames in os.walk(self.cachedir):
+            for filename in filenames:
+                if not filename in [WebCache.MANIFEST, WebCache.MANIFEST_LOCK]:
+                    r.append(os.path.relpath(os.path.join(dirpath, filename),
+                                             self.cachedir))
+        return r
+
+    def test_sharded_layout(self):
+        cache = WebCache(self.db, "farms", self.cachedir)
+        data, mimetype = cache.image_data(self.image.id, "thumb", "orig", "cw")
+        self.assertEqual(mimetype, "image/jpg")
+        files = self.__cached_files()
+        self.assertEqual(len(files), 1)
+        key = os.path.basename(files[0])
+        self.assertEqual(files[0], os.path.join(key[0:2], key[2:4], key))
+        with open(os.path.join(self.cachedir, WebCache.MANIFEST)) as f:
+            self.assertEqual(f.read().split(), [key])
+
+    def test_manifest_reload(self):
+        cache = WebCache(self.db, "farms", self.cachedir)
+        data, mimetype = cache.image_data(self.image.id, "thumb", "orig", "cw")
+        cache = WebCache(self.db, "farms", self.cachedir)
+        data2, mimetype = cache.image_data(self.image.id, "thumb", "orig", "cw")
+        self.assertEqual(data, data2)
+        self.assertEqual(len(self.__cached_files()), 1)
+
+    def test_shared_manifest(self):
+        # Two processes that opened the cache before either wrote to it
+        cache = WebCache(self.db, "farms", self.cachedir)
+        other = WebCache(self.db, "farms", self.cachedir)
+        path = os.path.join(self.cachedir, WebCache.MANIFEST)
+        inode = os.stat(path).st_ino
+        instrument.counters.reset()
+        cache.image_data(self.image.id, "thumb", "orig", "cw")
+        thumb = self.__cached_files()[0]
+        # The other process finds the thumbnail in the manifest
+        other.image_data(self.image.id, "thumb", "orig", "cw")
+        self.assertEqual(instrument.counters.get("webcache.images_converted"), 1)
+        other.image_data(self.image.id, "large", "orig", "cw")
+        self.assertEqual(len(self.__cached_files()), 2)
+        os.remove(os.path.join(self.cachedir, thumb))
+        cache.image_data(self.image.id, "thumb", "orig", "cw")
+        # The removal and the new entry are appended to the manifest,
+        # which is not rewritten
+        self.assertEqual(os.stat(path).st_ino, inode)
+        keys = set()
+        with open(path) as f:
+            lines = f.read().split()
+        for line in lines:
+            if line[0] == "-":
+                keys.discard(line[1:])
+            else:
+                keys.add(line)
+        self.assertIn("-" + os.path.basename(thumb), lines)
+        self.assertEqual(keys, set(os.path.basename(f) for f in self.__cached_files()))
+        self.assertEqual([f for f in os.listdir(self.cachedir) if f.endswith(".tmp")], [])
+
+    def test_missing_file_is_recreated(self):
+        cache = WebCache(self.db, "farms", self.cachedir)
+        data, mimetype = cache.image_data(self.image.id, "thumb", "orig", "cw")
+        os.remove(os.path.join(self.cachedir, self.__cached_files()[0]))
+        data2, mimetype = cache.image_data(self.image.id, "thumb", "orig", "cw")
+        self.assertEqual(data, data2)
+
+    def test_counters(self):
+        instrument.counters.reset()
+        cache = WebCache(self.db, "farms", self.cachedir)
+        for i in range(3):
+            cache.image_data(self.image.id, "thumb", "orig", "cw")
+        counters = instrument.counters.snapshot()
+        self.assertEqual(counters["webcache.images_converted"], 1)
+        self.assertEqual(counters["webcache.misses"], 1)
+        self.assertEqual(counters["webcache.disk_hits"], 2)
+
+    def test_migrate_flat_layout(self):
+        cache = WebCache(self.db, "farms", self.cachedir)
+        data, mimetype = cache.image_data(self.image.id, "thumb", "orig", "cw")
+        path = self.__cached_files()[0]
+        key = os.path.basename(path)
+        os.replace(os.path.join(self.cachedir, path),
+                   os.path.join(self.cachedir, key))
+        os.remove(os.path.join(self.cachedir, WebCache.MANIFEST))
+        cache = WebCache(self.db, "farms", self.cachedir)
+        self.assertEqual(self.__cached_files(), [path])
+        data2, mimetype = cache.image_data(self.image.id, "thumb", "orig", "cw")
+        self.assertEqual(data, data2)
+
+    def test_memory_cache_lru(self):
+        memory = MemoryCache(10, 4)
+        memory.put("a", b"aaaa")
+        memory.put("b", b"bbbb")
+        memory.put("big", b"bigger")
+        self.assertEqual(memory.get("big"), None)
+        self.assertEqual(memory.get("a"), b"aaaa")
+        memory.put("c", b"cccc")
+        self.assertEqual(memory.get("b"), None)
+        self.assertEqual(memory.get("a"), b"aaaa")
+        self.assertEqual(memory.size, 8)
+
+    def test_memory_tier(self):
+        cache = WebCache(self.db, "farms", self.cachedir, memory_size=1024*1024)
+        data, mimetype = cache.image_data(self.image.id, "thumb", "orig", "cw")
+        os.remove(os.path.join(self.cachedir, self.__cached_files()[0]))
+        data2, mimetype = cache.image_data(self.image.id, "thumb", "orig", "cw")
+        self.assertEqual(data, data2)
+        self.assertEqual(self.__cached_files(), [])
+
+    def test_jpeg_tiles(self):
+        # The lower zoom levels are decoded at a reduced resolution
+        image = self.__new_image("map", 3000, 1000, "JPEG")
+        cache = WebCache(self.db, "farms", self.cachedir)
+        data, mimetype = cache.image_tile(image.id, 0, 0, 0)
+        self.assertEqual(Image.open(BytesIO(data)).size, (188, 63))
+        data, mimetype = cache.image_tile(image.id, 3, 5, 1)
+        tile = Image.open(BytesIO(data))
+        self.assertEqual(tile.size, (220, 244))
+        for value, expected in zip(tile.getpixel((100, 100)), (20, 120, 220)):
+            self.assertTrue(abs(value - expected) <= 4)
+
+    def test_image_tiles(self):
+        image = self.__new_image("map", 3000, 1000, "PNG")
+        cache = WebCache(self.db, "farms", self.cachedir)
+        info = cache.image_tile_info(image.id)
+        self.assertEqual(info, {"width": 3000, "height": 1000,
+                                "tile_size": 256, "levels": 5})
+        data, mimetype = cache.image_tile(image.id, 0, 0, 0)
+        self.assertEqual(Image.open(BytesIO(data)).size, (188, 63))
+        data, mimetype = cache.image_tile(image.id, 4, 0, 0)
+        self.assertEqual(Image.open(BytesIO(data)).size, (256, 256))
+        data, mimetype = cache.image_tile(image.id, 4, 11, 3)
+        self.assertEqual(Image.open(BytesIO(data)).size, (184, 232))
+        with self.assertRaises(ValueError):
+            cache.image_tile(image.id, 4, 12, 0)
+        with self.assertRaises(ValueError):
+            cache.image_tile(image.id, 5, 0, 0)
+
+    def __new_grid_mesh(self, n):
+        xs, ys = np.meshgrid(np.arange(n), np.arange(n))
+        vertices = np.stack([xs.ravel(), ys.ravel(), np.zeros(n * n)], axis=-1)
+        index = np.arange(n * n).reshape((n, n))
+        a, b = index[:-1, :-1].ravel(), index[:-1, 1:].ravel()
+        c, d = index[1:, :-1].ravel(), index[1:, 1:].ravel()
+        faces = np.concatenate([np.stack([a, b, d], axis=-1),
+                                np.stack([a, d, c], axis=-1)])
+        mesh = Geometry(vertices.astype(np.float32), None, faces.astype(np.int32))
+        ifile = self.db.new_file("farm", "analysis", "analysis", "mesh",
+                                 "mesh.ply", "application/octet-stream")
+        self.db.file_store_bytes(ifile, write_ply(mesh))
+        return ifile
+
+    def test_ply_ascii(self):
+        data = (b"ply\nformat ascii 1.0\nelement vertex 4\n"
+                b"property float x\nproperty float y\nproperty float z\n"
+                b"element face 1\nproperty list uchar int vertex_indices\n"
+                b"end_header\n0 0 0\n1 0 0\n1 1 0\n0 1 0\n4 0 1 2 3\n")
+        geometry = read_ply(data)
+        self.assertEqual(geometry.vertex_count, 4)
+        self.assertEqual(geometry.faces.tolist(), [[0, 1, 2], [0, 2, 3]])
+
+    def test_ply_stream(self):
+        # A triangle, a quad, and a triangle, read in chunks of two
+        # faces
+        faces = [[0, 1, 2], [0, 1, 2, 3], [1, 2, 3]]
+        data = (b"ply\nformat binary_little_endian 1.0\nelement vertex 4\n"
+                b"property float x\nproperty float y\nproperty float z\n"
+                b"element face 3\nproperty list uchar int vertex_indices\n"
+                b"end_header\n"
+                + np.arange(12, dtype="<f4").tobytes()
+                + b"".join(bytes([len(f)]) + np.array(f, dtype="<i4").tobytes()
+                           for f in faces))
+        chunk_rows = geometry.CHUNK_ROWS
+        geometry.CHUNK_ROWS = 2
+        try:
+            mesh = read_ply_stream(BytesIO(data))
+            with self.assertRaises(ValueError):
+                read_ply_stream(BytesIO(data[:-4]))
+        finally:
+            geometry.CHUNK_ROWS = chunk_rows
+        self.assertEqual(mesh.vertices[3].tolist(), [9, 10, 11])
+        self.assertEqual(mesh.faces.tolist(),
+                         [[0, 1, 2], [0, 1, 2], [0, 2, 3], [1, 2, 3]])
+
+    def test_mesh_decimation(self):
+        ifile = self.__new_grid_mesh(200)
+        cache = WebCache(self.db, "farms", self.cachedir)
+        data, mimetype = cache.mesh_data(ifile.id, "thumb")
+        mesh = read_ply(data)
+        self.assertTrue(mesh.vertex_count <= WebCache.MESH_SIZES["thumb"])
+        self.assertTrue(mesh.vertex_count > WebCache.MESH_SIZES["thumb"] / 2)
+        self.assertTrue(len(mesh.faces) > 0)
+        self.assertTrue(mesh.faces.max() < mesh.vertex_count)
+        data, mimetype = cache.pointcloud_data(ifile.id, "thumb")
+        self.assertFalse(read_ply(data).is_mesh)
+        data, mimetype = cache.mesh_data(ifile.id, "orig")
+        self.assertEqual(read_ply(data).vertex_count, 200 * 200)
+        chunks, mimetype = cache.original_data(ifile.id)
+        self.assertEqual(b"".join(chunks), data)
+
+
+if __name__ == '__main__':
+    unittest.main()